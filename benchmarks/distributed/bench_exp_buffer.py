@@ -0,0 +1,78 @@
+"""
+Per step agent overhead of surreal.distributed.ExpBuffer for each
+session_config.sender.obs_hash.
+
+Every step adds an experience in the format of ExpSenderWrapperSSAR,
+{'obs': [obs, obs_next]} with a fresh obs_next, and the buffer is
+flushed every --flush-iteration steps. 'serialized' is the previous
+behavior, hashing every observation through U.pyobj_hash.
+
+Usage:
+    python benchmarks/distributed/bench_exp_buffer.py --obs pixel --frames 12
+"""
+import argparse
+import json
+import time
+import numpy as np
+from surreal.distributed.exp_sender import ExpBuffer
+
+OBS_HASHES = ['serialized', 'content', 'identity']
+
+
+def make_obs(args):
+    if args.obs == 'pixel':
+        return {'pixel': {'camera0': np.random.randint(
+            0, 256, size=(args.frames, 84, 84), dtype=np.uint8)}}
+    return {'low_dim': {'flat_inputs':
+                        np.random.randn(args.low_dim).astype(np.float32)}}
+
+
+def bench(obs_hash, args):
+    buffer = ExpBuffer(obs_hash)
+    # generating observations is not part of the measurement
+    observations = [make_obs(args) for _ in range(args.steps + 1)]
+    action = np.zeros(8, dtype=np.float32)
+    add_time = 0.
+    flush_time = 0.
+    binary_bytes = 0
+    for step in range(args.steps):
+        start = time.perf_counter()
+        buffer.add({'obs': [observations[step], observations[step + 1]]},
+                   {'action': action, 'reward': 0., 'done': False,
+                    'info': {}})
+        add_time += time.perf_counter() - start
+        if (step + 1) % args.flush_iteration == 0:
+            start = time.perf_counter()
+            binary_bytes += sum(len(frame) for frame in buffer.flush())
+            flush_time += time.perf_counter() - start
+    return {
+        'benchmark': 'exp_buffer',
+        'obs_hash': obs_hash,
+        'obs': args.obs,
+        'obs_nbytes': sum(array.nbytes for array
+                          in observations[0][args.obs].values()),
+        'add_us_per_step': add_time / args.steps * 1e6,
+        'flush_us_per_step': flush_time / args.steps * 1e6,
+        'step_us': (add_time + flush_time) / args.steps * 1e6,
+        'bytes_per_step': binary_bytes / args.steps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--obs-hash', nargs='+', default=OBS_HASHES,
+                        choices=OBS_HASHES)
+    parser.add_argument('--obs', default='pixel', choices=['low_dim', 'pixel'])
+    parser.add_argument('--low-dim', type=int, default=64)
+    parser.add_argument('--frames', type=int, default=4,
+                        help='k of 84x84xk pixel observations')
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--flush-iteration', type=int, default=100)
+    args = parser.parse_args()
+
+    for obs_hash in args.obs_hash:
+        print(json.dumps(bench(obs_hash, args)))
+
+
+if __name__ == '__main__':
+    main()
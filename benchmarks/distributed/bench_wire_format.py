@@ -0,0 +1,180 @@
+"""
+Encode and decode throughput of the serialization codecs in
+surreal.distributed.codec, on the messages of each channel of
+session_config.codec, built from an env_config.obs_spec. Use it to
+pick the codec of every channel for your observation shapes.
+
+Payloads:
+    exp_collection: an ExpSender flush of --flush-iteration steps,
+        (exp_list, ob_storage, retain) with one observation per step,
+        sent as multipart frames
+    sampling: a sampled batch of --batch-size exp dicts
+    sampling_aggregated: the same batch with observations stacked,
+        as sampled with aggregate_on_replay
+    parameter_serve: an agent's 'parameter:<hash>' request and the
+        (None, info) reply when parameters did not change
+
+Pixel observations are uint8, low_dim ones float32, as in
+ColumnarStorage. Multipart messages are decoded from the frames they
+were encoded to, nothing is copied to emulate the socket.
+
+Usage:
+    python benchmarks/distributed/bench_wire_format.py \\
+        --obs-spec '{"pixel": {"camera0": [12, 84, 84]}}' --batch-size 64
+"""
+import argparse
+import json
+import time
+import numpy as np
+from surreal.session import ConfigError
+from surreal.distributed.codec import CODECS, make_codec
+from surreal.distributed.exp_sender import ExpBuffer
+
+PAYLOADS = ['exp_collection', 'sampling', 'sampling_aggregated',
+            'parameter_serve']
+
+
+def make_obs(obs_spec, rng, batch_shape=()):
+    obs = {}
+    for modality in obs_spec:
+        obs[modality] = {}
+        for key, shape in obs_spec[modality].items():
+            shape = batch_shape + tuple(shape)
+            if modality == 'pixel':
+                obs[modality][key] = rng.randint(0, 256, size=shape,
+                                                 dtype=np.uint8)
+            else:
+                obs[modality][key] = rng.randn(*shape).astype(np.float32)
+    return obs
+
+
+def make_exp(obs, obs_next, args):
+    exp = make_nonhash(args)
+    exp['obs'] = [obs, obs_next]
+    return exp
+
+
+def make_nonhash(args):
+    return {
+        'action': np.zeros(args.action_dim, dtype=np.float32),
+        'reward': 0.,
+        'done': False,
+        'info': {},
+    }
+
+
+def make_payload(payload, obs_spec, args):
+    """
+    Returns:
+        list of the messages of one round trip
+    """
+    rng = np.random.RandomState(0)
+    if payload == 'exp_collection':
+        buffer = ExpBuffer(obs_hash='identity')
+        observations = [make_obs(obs_spec, rng)
+                        for _ in range(args.flush_iteration + 1)]
+        for step in range(args.flush_iteration):
+            buffer.add({'obs': observations[step:step + 2]},
+                       make_nonhash(args))
+        return [(buffer.exp_list, buffer.ob_storage, [])]
+    if payload == 'sampling':
+        observations = [make_obs(obs_spec, rng)
+                        for _ in range(args.batch_size + 1)]
+        return [[make_exp(observations[i], observations[i + 1], args)
+                 for i in range(args.batch_size)]]
+    if payload == 'sampling_aggregated':
+        batch_shape = (args.batch_size,)
+        return [{
+            'obs': make_obs(obs_spec, rng, batch_shape),
+            'obs_next': make_obs(obs_spec, rng, batch_shape),
+            'action': np.zeros(batch_shape + (args.action_dim,),
+                               dtype=np.float32),
+            'reward': np.zeros(batch_shape, dtype=np.float32),
+            'done': np.zeros(batch_shape, dtype=np.float32),
+        }]
+    info = {'time': time.time(), 'iteration': 1000, 'message': '',
+            'hash': 'u7QZ0dQ9nqH1QyKz'}
+    return ['parameter:' + info['hash'], (None, info)]
+
+
+def bench(name, payload, obs_spec, args):
+    try:
+        codec = make_codec(name)
+    except ConfigError as e:
+        return {'benchmark': 'wire_format', 'codec': name,
+                'payload': payload, 'error': str(e)}
+    if payload == 'exp_collection':
+        serialize = codec.serialize_multipart
+        deserialize = codec.deserialize_multipart
+    else:
+        serialize = lambda obj: [codec.serialize(obj)]
+        deserialize = lambda frames: codec.deserialize(frames[0])
+    messages = make_payload(payload, obs_spec, args)
+    for message in messages:
+        decoded = deserialize(serialize(message))
+        assert _checksum(decoded) == _checksum(message)
+    encode_time = 0.
+    decode_time = 0.
+    for _ in range(args.repeats):
+        for message in messages:
+            start = time.perf_counter()
+            frames = serialize(message)
+            encode_time += time.perf_counter() - start
+            start = time.perf_counter()
+            deserialize(frames)
+            decode_time += time.perf_counter() - start
+    nbytes = sum(memoryview(frame).nbytes for message in messages
+                 for frame in serialize(message))
+    return {
+        'benchmark': 'wire_format',
+        'codec': name,
+        'payload': payload,
+        'frames': sum(len(serialize(message)) for message in messages),
+        'message_bytes': nbytes,
+        'encode_us': encode_time / args.repeats * 1e6,
+        'decode_us': decode_time / args.repeats * 1e6,
+        'encode_mb_per_s': nbytes * args.repeats / encode_time / 1e6,
+        'decode_mb_per_s': nbytes * args.repeats / decode_time / 1e6,
+    }
+
+
+def _checksum(obj):
+    """
+        Sum of all arrays, codecs may turn tuples into lists
+    """
+    if isinstance(obj, np.ndarray):
+        return float(obj.sum())
+    if isinstance(obj, dict):
+        return sum(_checksum(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_checksum(value) for value in obj)
+    return 0.
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--codec', nargs='+',
+                        default=[name for name in CODECS if name != 'global'],
+                        choices=list(CODECS))
+    parser.add_argument('--payload', nargs='+', default=PAYLOADS,
+                        choices=PAYLOADS)
+    parser.add_argument('--obs-spec',
+                        default='{"pixel": {"camera0": [12, 84, 84]}}',
+                        help='env_config.obs_spec as json, '
+                             '{modality: {key: shape}}')
+    parser.add_argument('--action-dim', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--flush-iteration', type=int, default=64)
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    obs_spec = json.loads(args.obs_spec)
+    for payload in args.payload:
+        for name in args.codec:
+            print(json.dumps(bench(name, payload, obs_spec, args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+"""
+End to end throughput benchmark of the replay classes.
+
+Synthetic agents send experiences through the real
+surreal.distributed.ExpSender and the collector proxy into
+ExperienceCollectorServer, synthetic learners request batches through
+the sampler proxy, exactly like surreal.replay.ShardedReplay is wired in
+an experiment. The replay runs in the benchmark process (--mode inproc,
+its threads compete with the proxies) or in a child process
+(--mode child, like a replay shard). Agents and learners are always
+child processes.
+
+Prints one json line per replay with:
+    exps_in_per_s, exps_out_per_s: replay side, after warmup
+    insert_*_ms, sample_*_ms, serialize_*_ms: p50/p90/p99 latency of
+        insert_batch, sample and serializing a batch inside the replay
+    request_*_ms: latency of a sample request as seen by the learner
+    rss_*_mb: resident memory of the replay process
+
+Usage:
+    python benchmarks/replay/bench_replay_throughput.py \\
+        --replay uniform prioritized fifo --obs pixel --frames 4
+"""
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+import multiprocessing
+from contextlib import contextmanager
+import psutil
+import numpy as np
+from caraml.zmq import ZmqClient, ZmqProxyThread
+from surreal.distributed import ExpSender
+from surreal.session import (Config, BASE_LEARNER_CONFIG, BASE_ENV_CONFIG,
+                             LOCAL_SESSION_CONFIG)
+from surreal.replay import (UniformReplay, PrioritizedReplay, FIFOReplay,
+                            TrajectoryReplay)
+import surreal.utils as U
+
+REPLAYS = {
+    'uniform': UniformReplay,
+    'prioritized': PrioritizedReplay,
+    'fifo': FIFOReplay,
+    'trajectory': TrajectoryReplay,
+}
+ACTION_DIM = 8
+N_STEP = 10
+STRIDE = 5
+# distinct observations each agent cycles through, more than one flush
+# so that ExpBuffer cannot deduplicate across steps
+OBS_POOL = 256
+
+
+class LatencyRecorder(U.TimeRecorder):
+    """
+        TimeRecorder that also keeps every duration, for percentiles
+    """
+    def __init__(self):
+        super().__init__()
+        self.durations = []
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        with super().time():
+            yield None
+        self.durations.append(time.perf_counter() - start)
+
+
+def set_ports(base_port):
+    """
+        Environment of a replay shard and its proxies, see ShardedReplay
+    """
+    for i, name in enumerate(['COLLECTOR_FRONTEND', 'COLLECTOR_BACKEND',
+                              'SAMPLER_FRONTEND', 'SAMPLER_BACKEND',
+                              'PRIORITY_UPDATE', 'LOGGERPLEX',
+                              'TENSORPLEX']):
+        os.environ['SYMPH_{}_HOST'.format(name)] = 'localhost'
+        os.environ['SYMPH_{}_PORT'.format(name)] = str(base_port + i)
+
+
+def obs_spec(args):
+    if args.obs == 'pixel':
+        return {'pixel': {'camera0': [args.frames, 84, 84]}}
+    return {'low_dim': {'flat_inputs': [args.low_dim]}}
+
+
+def make_configs(name, args):
+    learner_config = Config({
+        'model': {},
+        'algo': {'gamma': 0.99, 'n_step': N_STEP, 'stride': STRIDE},
+        'replay': {
+            'batch_size': args.batch_size,
+            'memory_size': args.memory_size,
+            'sampling_start_size': args.batch_size,
+            'storage': args.storage,
+            'aggregate_on_replay': args.storage == 'columnar',
+            'trajectory': name == 'trajectory',
+        },
+    }).extend(BASE_LEARNER_CONFIG)
+    env_config = Config({
+        'env_name': 'benchmark',
+        'obs_spec': obs_spec(args),
+        'action_spec': {'type': 'continuous', 'dim': [ACTION_DIM]},
+    }).extend(BASE_ENV_CONFIG)
+    session_config = Config({
+        'folder': '/tmp/surreal/bench_replay_throughput',
+        'replay': {'tensorboard_display': False},
+        'sender': {'flush_iteration': args.flush_iteration},
+    }).extend(LOCAL_SESSION_CONFIG)
+    if name == 'fifo':
+        # see FIFOReplay
+        session_config.replay.max_puller_queue = 1
+        session_config.replay.max_prefetch_queue = 1
+        session_config.sender.flush_iteration = min(args.flush_iteration, 10)
+    return learner_config, env_config, session_config
+
+
+def percentiles(durations, prefix):
+    if not durations:
+        return {prefix + '_' + p: None for p in ['p50_ms', 'p90_ms', 'p99_ms']}
+    p50, p90, p99 = np.percentile(np.array(durations) * 1000, [50, 90, 99])
+    return {
+        prefix + '_p50_ms': float(p50),
+        prefix + '_p90_ms': float(p90),
+        prefix + '_p99_ms': float(p99),
+    }
+
+
+def run_replay(name, configs, warmup, duration, results):
+    """
+        Runs the replay for warmup + duration seconds, then puts its
+        statistics of the last `duration` seconds on results
+    """
+    replay = REPLAYS[name](*configs)
+    recorders = {}
+    for key in ['insert', 'sample', 'serialize']:
+        recorders[key] = LatencyRecorder()
+        setattr(replay, key + '_time', recorders[key])
+    process = psutil.Process()
+    replay.start_threads()
+    time.sleep(warmup)
+    rss_start = process.memory_info().rss
+    collected_start = replay.cumulative_collected_count
+    sampled_start = replay.cumulative_sampled_count
+    for recorder in recorders.values():
+        recorder.durations = []
+    time.sleep(duration)
+    rss_end = process.memory_info().rss
+    result = {
+        'exps_in_per_s':
+            (replay.cumulative_collected_count - collected_start) / duration,
+        'exps_out_per_s':
+            (replay.cumulative_sampled_count - sampled_start) / duration,
+        'replay_size': len(replay),
+        'rss_start_mb': rss_start / 2 ** 20,
+        'rss_end_mb': rss_end / 2 ** 20,
+        'rss_growth_mb': (rss_end - rss_start) / 2 ** 20,
+    }
+    for key, recorder in recorders.items():
+        result.update(percentiles(recorder.durations, key))
+    results.put(('replay', result))
+
+
+def make_obs(args, rng):
+    if args.obs == 'pixel':
+        return {'pixel': {'camera0': rng.randint(
+            0, 256, size=(args.frames, 84, 84), dtype=np.uint8)}}
+    return {'low_dim': {'flat_inputs':
+                        rng.randn(args.low_dim).astype(np.float32)}}
+
+
+def run_agent(name, agent_id, args, stop_time, results):
+    """
+        Sends experiences in the format of ExpSenderWrapperSSAR, or of
+        ExpSenderWrapperStepWithInfo for TrajectoryReplay, until stop_time
+    """
+    _, _, session_config = make_configs(name, args)
+    sender = ExpSender(
+        host=os.environ['SYMPH_COLLECTOR_FRONTEND_HOST'],
+        port=os.environ['SYMPH_COLLECTOR_FRONTEND_PORT'],
+        flush_iteration=session_config.sender.flush_iteration,
+        agent_id=agent_id)
+    rng = np.random.RandomState(agent_id)
+    pool = [make_obs(args, rng) for _ in range(OBS_POOL)]
+    action = np.zeros(ACTION_DIM, dtype=np.float32)
+    steps = 0
+    while time.time() < stop_time:
+        obs, obs_next = pool[steps % OBS_POOL], pool[(steps + 1) % OBS_POOL]
+        step_index = steps % args.episode_length
+        done = step_index == args.episode_length - 1
+        if name == 'trajectory':
+            hash_dict = {'obs': obs, 'obs_next': obs_next if done else None}
+            nonhash_dict = {
+                'action': action,
+                'reward': 0.,
+                'done': done,
+                'persistent_infos': [action],
+                'onetime_infos': [action] if step_index % STRIDE == 0
+                                 else None,
+                'episode_start': step_index == 0,
+            }
+        else:
+            hash_dict = {'obs': [obs, obs_next]}
+            nonhash_dict = {
+                'action': action,
+                'reward': 0.,
+                'done': done,
+                'info': {},
+            }
+        sender.send(hash_dict, nonhash_dict)
+        steps += 1
+    results.put(('agent', steps))
+
+
+def run_learner(args, stop_time, results):
+    """
+        Requests batches like LearnerDataPrefetcher until stop_time
+    """
+    client = ZmqClient(
+        host=os.environ['SYMPH_SAMPLER_FRONTEND_HOST'],
+        port=os.environ['SYMPH_SAMPLER_FRONTEND_PORT'],
+        timeout=-1,
+        serializer=U.serialize,
+        deserializer=U.deserialize)
+    durations = []
+    while time.time() < stop_time:
+        start = time.perf_counter()
+        client.request(args.batch_size)
+        durations.append(time.perf_counter() - start)
+    results.put(('learner', durations))
+
+
+def run(name, args, base_port):
+    set_ports(base_port)
+    configs = make_configs(name, args)
+    results = multiprocessing.Queue()
+    stop_time = time.time() + args.warmup + args.duration
+
+    proxies = [
+        ZmqProxyThread(
+            in_add='tcp://*:{}'.format(os.environ['SYMPH_COLLECTOR_FRONTEND_PORT']),
+            out_add='tcp://*:{}'.format(os.environ['SYMPH_COLLECTOR_BACKEND_PORT']),
+            pattern='router-dealer'),
+        ZmqProxyThread(
+            in_add='tcp://*:{}'.format(os.environ['SYMPH_SAMPLER_FRONTEND_PORT']),
+            out_add='tcp://*:{}'.format(os.environ['SYMPH_SAMPLER_BACKEND_PORT']),
+            pattern='router-dealer'),
+    ]
+    for proxy in proxies:
+        proxy.start()
+
+    replay_args = (name, configs, args.warmup, args.duration, results)
+    if args.mode == 'child':
+        replay = multiprocessing.Process(target=run_replay, args=replay_args)
+    else:
+        replay = threading.Thread(target=run_replay, args=replay_args)
+    replay.daemon = True
+    replay.start()
+    children = [multiprocessing.Process(target=run_agent,
+                                        args=(name, i, args, stop_time,
+                                              results))
+                for i in range(args.agents)]
+    children += [multiprocessing.Process(target=run_learner,
+                                         args=(args, stop_time, results))
+                 for _ in range(args.learners)]
+    for child in children:
+        child.daemon = True
+        child.start()
+
+    result = {
+        'benchmark': 'replay_throughput',
+        'replay': name,
+        'mode': args.mode,
+        'obs': args.obs,
+        'obs_shape': obs_spec(args)[args.obs],
+        'storage': args.storage,
+        'agents': args.agents,
+        'learners': args.learners,
+        'batch_size': args.batch_size,
+        'agent_steps_per_s': 0.,
+    }
+    requests = []
+    # learners blocked on a request when the replay stops never report
+    deadline = stop_time + args.warmup + 10
+    for _ in range(1 + len(children)):
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            break
+        try:
+            kind, value = results.get(timeout=timeout)
+        except queue.Empty:
+            break
+        if kind == 'replay':
+            result.update(value)
+        elif kind == 'agent':
+            result['agent_steps_per_s'] += value / (args.warmup + args.duration)
+        else:
+            requests.extend(value)
+    result.update(percentiles(requests, 'request'))
+    return result
+
+
+def run_and_report(name, args, base_port, results):
+    results.put(run(name, args, base_port))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--replay', nargs='+', default=['uniform'],
+                        choices=sorted(REPLAYS))
+    parser.add_argument('--mode', default='child', choices=['inproc', 'child'])
+    parser.add_argument('--obs', default='low_dim', choices=['low_dim', 'pixel'])
+    parser.add_argument('--low-dim', type=int, default=64,
+                        help='size of low_dim observations')
+    parser.add_argument('--frames', type=int, default=4,
+                        help='k of 84x84xk pixel observations')
+    parser.add_argument('--storage', default='columnar',
+                        choices=['list', 'serialized', 'columnar'])
+    parser.add_argument('--agents', type=int, default=8)
+    parser.add_argument('--learners', type=int, default=1)
+    parser.add_argument('--episode-length', type=int, default=200)
+    parser.add_argument('--flush-iteration', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--memory-size', type=int, default=100000)
+    parser.add_argument('--warmup', type=float, default=5.)
+    parser.add_argument('--duration', type=float, default=20.)
+    parser.add_argument('--base-port', type=int, default=7300,
+                        help='every replay uses 10 ports from here on')
+    args = parser.parse_args()
+
+    for i, name in enumerate(args.replay):
+        # a fresh process per replay, the proxies never release their ports
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=run_and_report,
+            args=(name, args, args.base_port + 10 * i, results))
+        process.start()
+        print(json.dumps(results.get()))
+        for child in psutil.Process(process.pid).children(recursive=True):
+            child.kill()
+        process.kill()
+
+
+if __name__ == '__main__':
+    main()
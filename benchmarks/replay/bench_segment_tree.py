@@ -0,0 +1,138 @@
+"""
+Microbenchmark of the numpy segment trees in surreal.replay.segment_tree
+against the previous pure python implementation (list of node values,
+one tree walk per index).
+
+Measures, for a 512 batch:
+    sample: prefix sum search for `batch_size` random masses
+    update: setting `batch_size` priorities in a sum and a min tree
+
+Usage:
+    python benchmarks/replay/bench_segment_tree.py --capacity 1000000 4000000
+"""
+import argparse
+import json
+import operator
+import random
+import time
+import numpy as np
+from surreal.replay.segment_tree import SumSegmentTree, MinSegmentTree
+
+
+class ListSegmentTree(object):
+    """
+        Reference: segment tree with node values in a python list
+    """
+    def __init__(self, capacity, operation, neutral_element):
+        self._capacity = capacity
+        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._operation = operation
+
+    def fill(self, leaves):
+        self._value[self._capacity:] = list(leaves)
+        for idx in range(self._capacity - 1, 0, -1):
+            self._value[idx] = self._operation(self._value[2 * idx],
+                                               self._value[2 * idx + 1])
+
+    def __setitem__(self, idx, val):
+        idx += self._capacity
+        self._value[idx] = val
+        idx //= 2
+        while idx >= 1:
+            self._value[idx] = self._operation(
+                self._value[2 * idx],
+                self._value[2 * idx + 1]
+            )
+            idx //= 2
+
+    def find_prefixsum_idx(self, prefixsum):
+        idx = 1
+        while idx < self._capacity:
+            if self._value[2 * idx] > prefixsum:
+                idx = 2 * idx
+            else:
+                prefixsum -= self._value[2 * idx]
+                idx = 2 * idx + 1
+        return idx - self._capacity
+
+
+def _time(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def bench_list(capacity, batch_size, repeats):
+    leaves = np.random.random(capacity)
+    it_sum = ListSegmentTree(capacity, operator.add, 0.0)
+    it_min = ListSegmentTree(capacity, min, float('inf'))
+    it_sum.fill(leaves)
+    it_min.fill(leaves)
+    total = it_sum._value[1]
+
+    def sample():
+        for _ in range(batch_size):
+            it_sum.find_prefixsum_idx(random.random() * total)
+
+    def update():
+        for _ in range(batch_size):
+            idx = random.randint(0, capacity - 1)
+            priority = random.random()
+            it_sum[idx] = priority
+            it_min[idx] = priority
+
+    return _time(sample, repeats), _time(update, repeats)
+
+
+def bench_numpy(capacity, batch_size, repeats):
+    it_sum = SumSegmentTree(capacity)
+    it_min = MinSegmentTree(capacity)
+    leaves = np.random.random(capacity)
+    it_sum.update(np.arange(capacity), leaves)
+    it_min.update(np.arange(capacity), leaves)
+
+    def sample():
+        masses = np.random.random(batch_size) * it_sum.sum()
+        it_sum.find_prefixsum_idx(masses)
+
+    def update():
+        indices = np.random.randint(0, capacity, size=batch_size)
+        priorities = np.random.random(batch_size)
+        it_sum.update(indices, priorities)
+        it_min.update(indices, priorities)
+
+    return _time(sample, repeats), _time(update, repeats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--capacity', type=int, nargs='+',
+                        default=[2 ** 20, 2 ** 22],
+                        help='tree capacities, rounded up to a power of 2')
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    for capacity in args.capacity:
+        it_capacity = 1
+        while it_capacity < capacity:
+            it_capacity *= 2
+        for name, bench in [('list', bench_list), ('numpy', bench_numpy)]:
+            sample_s, update_s = bench(it_capacity,
+                                       args.batch_size,
+                                       args.repeats)
+            print(json.dumps({
+                'benchmark': 'segment_tree',
+                'implementation': name,
+                'capacity': it_capacity,
+                'batch_size': args.batch_size,
+                'sample_s': sample_s,
+                'update_s': update_s,
+            }))
+
+
+if __name__ == '__main__':
+    main()
@@ -42,6 +42,7 @@ setup(
         "benedict",
         "nanolog",
         "psutil",
+        "xxhash>=2.0",
         "tabulate",
         "imageio",
         "caraml>=0.10.0",
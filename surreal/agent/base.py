@@ -10,6 +10,7 @@ from surreal.session import (
     get_loggerplex_client, get_tensorplex_client,
 )
 from surreal.distributed import ParameterClient, ModuleDict
+from surreal.distributed.codec import make_codec
 from surreal.env import (
     MaxStepWrapper,
     TrainingTensorplexMonitor,
@@ -73,7 +74,10 @@ class Agent(object, metaclass=U.AutoInitializeMeta):
         self._ps_client = ParameterClient(
             host=host,
             port=port,
+            codec=self.session_config.codec.parameter_serve,
         )
+        self._parameter_codec = make_codec(
+            self.session_config.codec.parameter_publish)
 
     def _setup_parameter_pull(self):
         self._fetch_parameter_mode = self.session_config.agent.fetch_parameter_mode
@@ -350,7 +354,7 @@ class Agent(object, metaclass=U.AutoInitializeMeta):
         """
         params, info = self._ps_client.fetch_parameter_with_info()
         if params:
-            params = U.deserialize(params)
+            params = self._parameter_codec.deserialize(params)
             params = self.on_parameter_fetched(params, info)
             self._module_dict.load(params)
 
@@ -10,7 +10,8 @@ import torchx as tx
 import torchx.nn as nnx
 from surreal.distributed import ModuleDict
 from surreal.model.ddpg_net import DDPGModel
-from surreal.env import ExpSenderWrapperSSARNStepBootstrap
+from surreal.env import (ExpSenderWrapperSSAR,
+                         ExpSenderWrapperSSARNStepBootstrap)
 from surreal.session import ConfigError
 from .base import Agent
 from .action_noise import *
@@ -207,7 +208,14 @@ class DDPGAgent(Agent):
 
     def prepare_env_agent(self, env):
         env = super().prepare_env_agent(env)
-        env = ExpSenderWrapperSSARNStepBootstrap(env,
-                                                 self.learner_config,
-                                                 self.session_config)
+        if self.learner_config.replay.nstep_on_replay:
+            env = ExpSenderWrapperSSAR(env,
+                                       self.learner_config,
+                                       self.session_config,
+                                       agent_id=self.agent_id)
+        else:
+            env = ExpSenderWrapperSSARNStepBootstrap(env,
+                                                     self.learner_config,
+                                                     self.session_config,
+                                                     agent_id=self.agent_id)
         return env
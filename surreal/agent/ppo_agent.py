@@ -8,7 +8,8 @@ import torchx as tx
 import torchx.nn as nnx
 import surreal.utils as U
 from surreal.model.ppo_net import PPOModel, DiagGauss
-from surreal.env import ExpSenderWrapperMultiStepMovingWindowWithInfo
+from surreal.env import (ExpSenderWrapperMultiStepMovingWindowWithInfo,
+                         ExpSenderWrapperStepWithInfo)
 from surreal.session import ConfigError
 from .base import Agent
 
@@ -181,7 +182,14 @@ class PPOAgent(Agent):
 
     def prepare_env_agent(self, env):
         env = super().prepare_env_agent(env)
-        env = ExpSenderWrapperMultiStepMovingWindowWithInfo(env,
-                                                            self.learner_config,
-                                                            self.session_config)
+        if self.learner_config.replay.trajectory:
+            env = ExpSenderWrapperStepWithInfo(env,
+                                               self.learner_config,
+                                               self.session_config,
+                                               agent_id=self.agent_id)
+        else:
+            env = ExpSenderWrapperMultiStepMovingWindowWithInfo(env,
+                                                                self.learner_config,
+                                                                self.session_config,
+                                                                agent_id=self.agent_id)
         return env
@@ -1,6 +1,8 @@
 from .exp_sender import ExpSender
 from .exp_collector import ExperienceCollectorServer
-from .data_fetcher import LearnerDataPrefetcher
+from .stratified_sampler import StratifiedSampler
+from .data_fetcher import LearnerDataPrefetcher, StreamingDataFetcher
+from .priority_update import PrioritySender, PriorityReceiver
 from .module_dict import ModuleDict
 from .parameter_server import (
     ParameterPublisher,
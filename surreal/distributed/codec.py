@@ -0,0 +1,172 @@
+"""
+Serialization codecs for the messages between surreal components.
+Every channel picks its codec in session_config.codec:
+    exp_collection: agents -> replay, see ExpSender
+    sampling: replay -> learner, sample requests and batches
+    parameter_publish: learner -> parameter server, the parameters
+        themselves are decoded by agents with this codec too
+    parameter_serve: agents <-> parameter server, requests and replies
+
+'global' is U.serialize, pyarrow unless set_global_serializer() was
+called. 'pickle5' needs python >= 3.8 or the pickle5 package, 'msgpack'
+the msgpack package and 'pyarrow' a pyarrow that still has pa.serialize.
+Every component of a session must use the same codec for a channel.
+"""
+import surreal.utils as U
+from surreal.session import ConfigError
+
+
+class Codec(object):
+    """
+        Extend this class and register it in CODECS to add a codec.
+        Subclasses implement dumps() and loads(), and dumps_multipart()
+        and loads_multipart() if they send numpy arrays as separate
+        frames. Codecs are called from several threads and are pickled
+        with the handlers of caraml worker processes.
+    """
+    def dumps(self, obj):
+        """
+        Returns:
+            bytes-like
+        """
+        raise NotImplementedError
+
+    def loads(self, binary):
+        raise NotImplementedError
+
+    def dumps_multipart(self, obj):
+        return [self.dumps(obj)]
+
+    def loads_multipart(self, frames):
+        assert len(frames) == 1
+        return self.loads(frames[0])
+
+    def serialize(self, obj):
+        return self.dumps(obj)
+
+    def deserialize(self, binary):
+        """
+            Also reads U.join_serialized messages of serialize() binaries,
+            and of such messages
+        """
+        parts = U.split_joined(binary)
+        if parts is not None:
+            return [self.deserialize(part) for part in parts]
+        return self.loads(binary)
+
+    def serialize_multipart(self, obj):
+        """
+        Returns:
+            list of frames to send as one multipart message
+        """
+        return self.dumps_multipart(obj)
+
+    def deserialize_multipart(self, frames):
+        return self.loads_multipart(frames)
+
+
+class GlobalCodec(Codec):
+    """
+        U.serialize and U.serialize_multipart,
+        see U.set_global_serializer
+    """
+    def dumps(self, obj):
+        return U.serialize(obj)
+
+    def loads(self, binary):
+        return U.deserialize(binary)
+
+    def dumps_multipart(self, obj):
+        return U.serialize_multipart(obj)
+
+    def loads_multipart(self, frames):
+        return U.deserialize_multipart(frames)
+
+
+class PyarrowCodec(Codec):
+    def __init__(self):
+        import pyarrow
+        if not hasattr(pyarrow, 'serialize'):
+            raise ImportError('pyarrow {} no longer has pyarrow.serialize'
+                              .format(pyarrow.__version__))
+
+    def dumps(self, obj):
+        return U.pa_serialize(obj)
+
+    def loads(self, binary):
+        return U.pa_deserialize(binary)
+
+
+class Pickle5Codec(Codec):
+    """
+        Pickle protocol 5, numpy arrays are sent out-of-band
+    """
+    def __init__(self):
+        if U.pickle5 is None:
+            raise ImportError('pickle protocol 5 needs python >= 3.8 '
+                              'or the pickle5 package')
+
+    def dumps(self, obj):
+        return U.pickle5_serialize(obj)
+
+    def loads(self, binary):
+        return U.pickle5_deserialize(binary)
+
+    def dumps_multipart(self, obj):
+        return U.pickle5_serialize_multipart(obj)
+
+    def loads_multipart(self, frames):
+        return U.pickle5_deserialize_multipart(frames)
+
+
+class MsgpackCodec(Codec):
+    """
+        msgpack with numpy extension types,
+        tuples are received as lists
+    """
+    def __init__(self):
+        if U.msgpack is None:
+            raise ImportError('No module named msgpack')
+
+    def dumps(self, obj):
+        return U.msgpack_serialize(obj)
+
+    def loads(self, binary):
+        return U.msgpack_deserialize(binary)
+
+
+class NpframeCodec(Codec):
+    """
+        See U.npframe_serialize_multipart
+    """
+    def dumps(self, obj):
+        return U.npframe_serialize(obj)
+
+    def loads(self, binary):
+        return U.npframe_deserialize(binary)
+
+    def dumps_multipart(self, obj):
+        return U.npframe_serialize_multipart(obj)
+
+    def loads_multipart(self, frames):
+        return U.npframe_deserialize_multipart(frames)
+
+
+CODECS = {
+    'global': GlobalCodec,
+    'pyarrow': PyarrowCodec,
+    'pickle5': Pickle5Codec,
+    'msgpack': MsgpackCodec,
+    'npframe': NpframeCodec,
+}
+
+
+def make_codec(name):
+    if name not in CODECS:
+        raise ConfigError('unknown serialization codec: {}, available: {}'
+                          .format(name, list(CODECS)))
+    try:
+        return CODECS[name]()
+    except ImportError as e:
+        raise ConfigError('serialization codec {} is not installed: {}'
+                          .format(name, e))
@@ -1,9 +1,13 @@
 import os
 import queue
-from caraml.zmq import DataFetcher
+import functools
+from caraml.zmq import DataFetcher, ZmqClient
 from benedict import BeneDict
 import surreal.utils as U
-from threading import Thread
+from threading import Thread, Semaphore
+from .stratified_sampler import (StratifiedSampler, shard_sampler_address,
+                                 decode_parts)
+from .codec import make_codec
 
 
 class LearnerDataPrefetcher(DataFetcher):
@@ -12,37 +16,69 @@ class LearnerDataPrefetcher(DataFetcher):
         + batch_size
 
         Fetches data from replay in multiple processes and put them into
-        a queue
+        a queue. With session_config.learner.batches_per_request > 1,
+        each request to the replay returns that many batches.
+        With session_config.learner.stratified_sampling, requests go to
+        a StratifiedSampler that samples every batch across all
+        num_replay_shards shards.
     """
     def __init__(self,
                  session_config,
                  batch_size,
                  worker_preprocess=None,
-                 main_preprocess=None):
+                 main_preprocess=None,
+                 num_replay_shards=1):
         self.max_fetch_queue = session_config.learner.max_prefetch_queue
         self.max_preprocess_queue = session_config.learner.max_preprocess_queue
         self.fetch_queue = queue.Queue(maxsize=self.max_fetch_queue)
         self.preprocess_queue = queue.Queue(maxsize=self.max_preprocess_queue)
         self.timer = U.TimeRecorder()
+        self.codec = make_codec(session_config.codec.sampling)
 
         self.sampler_host = os.environ['SYMPH_SAMPLER_FRONTEND_HOST']
         self.sampler_port = os.environ['SYMPH_SAMPLER_FRONTEND_PORT']
+        self.stratified_sampler = None
+        if session_config.learner.stratified_sampling:
+            self.stratified_sampler = StratifiedSampler(
+                host='127.0.0.1',
+                port=os.environ['SYMPH_STRATIFIED_SAMPLER_PORT'],
+                shard_addresses=[shard_sampler_address(i)
+                                 for i in range(num_replay_shards)],
+                timeout=session_config.learner.shard_timeout,
+                codec=session_config.codec.sampling)
+            self.stratified_sampler.start()
+            self.sampler_host = '127.0.0.1'
+            self.sampler_port = os.environ['SYMPH_STRATIFIED_SAMPLER_PORT']
         self.batch_size = batch_size
+        self.batches_per_request = session_config.learner.batches_per_request
         self.prefetch_processes = session_config.learner.prefetch_processes
         self.prefetch_host = '127.0.0.1'
         self.worker_comm_port = os.environ['SYMPH_PREFETCH_QUEUE_PORT']
         self.worker_preprocess = worker_preprocess
         self.main_preprocess = main_preprocess
+        if self.stratified_sampler is not None:
+            decode = functools.partial(decode_parts, self.codec)
+        else:
+            decode = self.codec.deserialize
+        if self.batches_per_request > 1:
+            # batches are only deserialized by the prefetch workers
+            remote_deserializer = _split_batches
+            worker_handler = functools.partial(_preprocess_batches,
+                                               worker_preprocess,
+                                               decode)
+        else:
+            remote_deserializer = decode
+            worker_handler = worker_preprocess
         super().__init__(
             handler=self._put,
             remote_host=self.sampler_host,
             remote_port=self.sampler_port,
             requests=self.request_generator(),
             worker_comm_port=self.worker_comm_port,
-            remote_serializer=U.serialize,
-            remote_deserialzer=U.deserialize,
+            remote_serializer=self.codec.serialize,
+            remote_deserialzer=remote_deserializer,
             n_workers=self.prefetch_processes,
-            worker_handler=self.worker_preprocess)
+            worker_handler=worker_handler)
 
     def run(self):
         self._preprocess_thread = Thread(target=self._preprocess_loop,
@@ -53,9 +89,14 @@ class LearnerDataPrefetcher(DataFetcher):
     def _preprocess_loop(self):
         while True:
             sharedmem_obj = self.fetch_queue.get(block=True)
-            batch = BeneDict(sharedmem_obj.data)
-            batch = self.main_preprocess(batch)
-            self.preprocess_queue.put(batch)
+            if self.batches_per_request > 1:
+                batches = sharedmem_obj.data
+            else:
+                batches = [sharedmem_obj.data]
+            for batch in batches:
+                batch = BeneDict(batch)
+                batch = self.main_preprocess(batch)
+                self.preprocess_queue.put(batch)
 
     def _put(self, _, data):
         self.fetch_queue.put(data, block=True)
@@ -69,5 +110,80 @@ class LearnerDataPrefetcher(DataFetcher):
             return self.preprocess_queue.get(block=True)
 
     def request_generator(self):
+        if self.batches_per_request > 1:
+            request = (self.batch_size, self.batches_per_request)
+        else:
+            request = self.batch_size
         while True:
-            yield self.batch_size
+            yield request
+
+
+class StreamingDataFetcher(Thread):
+    """
+        On-policy alternative to LearnerDataPrefetcher, for FIFOReplay
+        with session_config.learner.streaming.
+
+        Keeps exactly one sample request at the replay, which acts as
+        the learner's only credit: the replay answers it as soon as
+        batch_size fresh experiences exist, and the next request is sent
+        when the learner takes the batch with get(). The replay collects
+        the next batch while the learner trains on the current one, and
+        at most one batch is ever in flight or waiting.
+    """
+    def __init__(self,
+                 session_config,
+                 batch_size,
+                 worker_preprocess=None,
+                 main_preprocess=None):
+        super().__init__(daemon=True)
+        self.sampler_host = os.environ['SYMPH_SAMPLER_FRONTEND_HOST']
+        self.sampler_port = os.environ['SYMPH_SAMPLER_FRONTEND_PORT']
+        self.batch_size = batch_size
+        self.worker_preprocess = worker_preprocess
+        self.main_preprocess = main_preprocess
+        self.timer = U.TimeRecorder()
+        self.codec = make_codec(session_config.codec.sampling)
+        self._credits = Semaphore(1)
+        self._queue = queue.Queue(maxsize=1)
+
+    def run(self):
+        # wait as long as the replay needs to fill the batch,
+        # a timed out request would lose the batch sent for it
+        client = ZmqClient(host=self.sampler_host,
+                           port=self.sampler_port,
+                           timeout=-1,
+                           serializer=self.codec.serialize,
+                           deserializer=self.codec.deserialize)
+        while True:
+            self._credits.acquire()
+            batch = client.request(self.batch_size)
+            if self.worker_preprocess is not None:
+                batch = self.worker_preprocess(batch)
+            batch = BeneDict(batch)
+            if self.main_preprocess is not None:
+                batch = self.main_preprocess(batch)
+            self._queue.put(batch)
+
+    def get(self):
+        """
+            Returns the next batch and lets the replay send another one
+        """
+        with self.timer.time():
+            batch = self._queue.get(block=True)
+        self._credits.release()
+        return batch
+
+
+def _split_batches(binary):
+    """
+        Splits a multi-batch response, see
+        Replay._sample_request_handler, into its serialized batches
+    """
+    return [bytes(part) for part in U.split_joined(binary)]
+
+
+def _preprocess_batches(worker_preprocess, decode, data):
+    """
+        Decodes and preprocesses every batch of a multi-batch response
+    """
+    return [worker_preprocess(decode(batch)) for batch in data]
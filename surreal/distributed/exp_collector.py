@@ -1,65 +1,155 @@
 import weakref
+import collections
 from threading import Thread
-import surreal.utils as U
-from caraml.zmq import ZmqReceiver
+from caraml.zmq import ZmqServer
+from .codec import make_codec
 
 
 class ExperienceCollectorServer(Thread):
     """
         Accepts experience from agents,
-        deduplicates experience whenever possible
+        deduplicates experience whenever possible.
+        exp_handler is called once per received message
+        with the list of experiences it holds
+
+        Messages are (exp_list, ob_storage, retain) in multipart frames
+        of `codec`, see ExpBuffer. Frames are received without copy,
+        the observations can be views of them.
+        A hash that is not in the message's ob_storage is looked up in the
+        objects that are still alive in the replay and in the observation
+        cache, an LRU of up to obs_cache_size objects that agents asked to
+        retain. Every message is answered with the list of hashes that
+        could not be found, the agent then sends the message again with
+        all of its objects and the experiences of the first attempt are
+        dropped.
     """
-    def __init__(self, host, port, exp_handler, load_balanced=True):
+    def __init__(self, host, port, exp_handler, load_balanced=True,
+                 obs_cache_size=0, codec='global'):
         Thread.__init__(self)
         self.host = host
         self.port = port
         self.load_balanced = load_balanced
         self._exp_handler = exp_handler
+        self.obs_cache_size = obs_cache_size
+        self._codec = make_codec(codec)
+        # hash -> object, least recently used first
+        self._obs_cache = collections.OrderedDict()
+        # agent id -> ObsCacheStats
+        self.obs_cache_stats = collections.defaultdict(ObsCacheStats)
         # To be initialized in run()
         self._weakref_map = None
-        self.receiver = None
+        self.server = None
 
     def run(self):
         """
             Starts the server loop
         """
         self._weakref_map = weakref.WeakValueDictionary()
-        self.receiver = ZmqReceiver(host=self.host,
-                                    port=self.port,
-                                    bind=not self.load_balanced,
-                                    deserializer=U.deserialize)
+        self.server = ZmqServer(host=self.host,
+                                port=self.port,
+                                bind=not self.load_balanced)
+        # multipart messages bypass ZmqServer.recv() and send()
+        socket = self.server.socket
         while True:
-            exp, storage = self.receiver.recv()
-            experience_list = self._retrieve_storage(exp, storage)
-            for exp in experience_list:
-                self._exp_handler(exp)
+            frames = socket.recv_multipart(copy=False)
+            message = self._codec.deserialize_multipart(
+                [f.buffer for f in frames])
+            experience_list, missing = self._resolve(*message)
+            socket.send(self._codec.serialize(missing))
+            if not missing:
+                self._exp_handler(experience_list)
+
+    def _resolve(self, exp, storage, retain):
+        """
+        Returns:
+            (experience list, hashes that were not found)
+        """
+        # hash -> object of the references resolved outside storage
+        hits = {}
+        missing = []
+        experience_list = self._retrieve_storage(exp, storage, hits, missing)
+        if experience_list:
+            agent_id = experience_list[0].get('agent_id', -1)
+            self.obs_cache_stats[agent_id].add(storage, hits, missing)
+        if not missing:
+            self._retain(retain, storage, hits)
+        return experience_list, missing
 
-    def _retrieve_storage(self, exp, storage):
+    def _retrieve_storage(self, exp, storage, hits, missing):
         """
         Args:
             exp: a nested dict or list
                 Only dict keys that end with `_hash` will be retrieved.
                 The processed key will see `_hash` removed
             storage: chunk of storage sent with the exps
+            hits: filled with the objects found outside storage
+            missing: filled with the hashes that were not found
         """
         if isinstance(exp, list):
             for i, e in enumerate(exp):
-                exp[i] = self._retrieve_storage(e, storage)
+                exp[i] = self._retrieve_storage(e, storage, hits, missing)
 
         elif isinstance(exp, dict):
             for key in list(exp.keys()):  # copy keys
                 if key.endswith('_hash'):
                     new_key = key[:-len('_hash')]  # delete suffix
-                    exp[new_key] = self._retrieve_storage(exp[key], storage)
+                    exp[new_key] = self._retrieve_storage(exp[key], storage,
+                                                          hits, missing)
                     del exp[key]
                 else:
-                    exp[key] = self._retrieve_storage(exp[key], storage)
+                    exp[key] = self._retrieve_storage(exp[key], storage,
+                                                      hits, missing)
 
         elif isinstance(exp, str):
             exphash = exp
             if exphash in self._weakref_map:
-                return self._weakref_map[exphash]
+                obj = self._weakref_map[exphash]
+            elif exphash in storage:
+                obj = storage[exphash]
+                self._weakref_map[exphash] = obj
+            elif exphash in self._obs_cache:
+                obj = self._obs_cache[exphash]
             else:
-                self._weakref_map[exphash] = storage[exphash]
-                return storage[exphash]
+                missing.append(exphash)
+                return None
+            if exphash not in storage:
+                hits[exphash] = obj
+            return obj
         return exp
+
+    def _retain(self, retain, storage, hits):
+        if not self.obs_cache_size:
+            return
+        for exphash in retain:
+            self._obs_cache[exphash] = storage.get(exphash, hits.get(exphash))
+            self._obs_cache.move_to_end(exphash)
+        for exphash in hits:
+            if exphash in self._obs_cache:
+                self._obs_cache.move_to_end(exphash)
+        while len(self._obs_cache) > self.obs_cache_size:
+            self._obs_cache.popitem(last=False)
+
+
+class ObsCacheStats(object):
+    """
+        Objects one agent sent and referenced
+    """
+    def __init__(self):
+        # distinct objects in messages
+        self.objects = 0
+        # objects resolved without being sent
+        self.hits = 0
+        self.bytes_saved = 0
+        # messages that had to be sent again
+        self.missed_messages = 0
+
+    def add(self, storage, hits, missing):
+        self.objects += len(storage) + len(hits) + len(set(missing))
+        self.hits += len(hits)
+        self.bytes_saved += sum(getattr(obj, 'nbytes', 0)
+                                for obj in hits.values())
+        self.missed_messages += bool(missing)
+
+    @property
+    def hit_percent(self):
+        return self.hits / max(self.objects, 1) * 100
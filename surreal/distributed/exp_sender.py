@@ -2,18 +2,82 @@
 Agent side.
 Send experience chunks (buffered) to Replay node.
 """
+import time
+import uuid
+import queue
+import weakref
+import itertools
 import surreal.utils as U
-from surreal.session import PeriodicTracker
-from caraml.zmq import ZmqSender
+from surreal.session import ConfigError
+from caraml.zmq import ZmqClient, ZmqTimeoutError
+from .codec import make_codec
+
+
+class ObjectIdentityHash(object):
+    """
+        Keys objects by identity instead of content. An object gets a new
+        key, unique across agents, the first time it is seen and keeps it
+        until it is garbage collected. Only correct if objects are never
+        modified in place after they were sent.
+        Objects that do not support weak references are hashed by content.
+    """
+    def __init__(self):
+        self._prefix = uuid.uuid4().hex[:8]
+        self._counter = itertools.count()
+        # id(obj) -> key, for objects that are still alive
+        self._keys = {}
+
+    def __call__(self, obj):
+        key = self._keys.get(id(obj))
+        if key is not None:
+            return key
+        try:
+            weakref.finalize(obj, self._keys.pop, id(obj), None)
+        except TypeError:
+            return U.array_hash(obj)
+        key = '{}-{}'.format(self._prefix, next(self._counter))
+        self._keys[id(obj)] = key
+        return key
 
 
 class ExpBuffer(object):
     """
         Temporarily holds and deduplicates experience
+
+        With obs_cache, the objects of the last experience of every flush
+        (typically the obs_next that is the obs of the next experience)
+        are retained by the replay, see ExperienceCollectorServer. Once
+        the replay acknowledged a flush, these objects are sent as hash
+        only in the next one.
     """
-    def __init__(self):
+    def __init__(self, obs_hash='content', obs_cache=False, codec='global'):
+        """
+        Args:
+            obs_hash: how objects in hash_dict are keyed
+                'content': hash of numpy arrays' memory (U.array_hash)
+                'serialized': hash of the serialized object (U.pyobj_hash)
+                'identity': see ObjectIdentityHash
+            obs_cache: send objects the replay retained as hash only
+            codec: serialization codec, see surreal.distributed.codec
+        """
         self.exp_list = []  # list of exp dicts
         self.ob_storage = {}
+        self.obs_cache = obs_cache
+        self._codec = make_codec(codec)
+        # hash -> object retained by the replay
+        self._retained = {}
+        # hash -> object of retained objects sent as hash only
+        self._references = {}
+        # (exp_list, ob_storage, references, retain) of the last flush
+        self._flushed = None
+        if obs_hash == 'content':
+            self._hash = U.array_hash
+        elif obs_hash == 'serialized':
+            self._hash = U.pyobj_hash
+        elif obs_hash == 'identity':
+            self._hash = ObjectIdentityHash()
+        else:
+            raise ConfigError('unknown obs_hash: {}'.format(obs_hash))
 
     def add(self, hash_dict, nonhash_dict):
         """
@@ -32,15 +96,46 @@ class ExpBuffer(object):
 
     def flush(self):
         """
-        Serialized all currenct content of the buffer into binary
+        Serialized all currenct content of the buffer into frames
 
         Returns:
-            binary data of (exp_list, ob_storage)
+            multipart frames of (exp_list, ob_storage, retain),
+            retain is the list of hashes the replay should keep in its
+            observation cache
         """
-        binary = U.serialize((self.exp_list, self.ob_storage))
+        retain = []
+        if self.obs_cache and self.exp_list:
+            retain = list(_nested_hashes(self.exp_list[-1]))
+        frames = self._codec.serialize_multipart((self.exp_list,
+                                                  self.ob_storage, retain))
+        self._flushed = (self.exp_list, self.ob_storage,
+                         self._references, retain)
         self.exp_list = []
         self.ob_storage = {}
-        return binary
+        self._references = {}
+        return frames
+
+    def flush_all_objects(self):
+        """
+        Returns:
+            frames of the last flush with every object included,
+            to send again when the replay did not find some of them
+        """
+        exp_list, ob_storage, references, retain = self._flushed
+        ob_storage = dict(ob_storage, **references)
+        self._flushed = (exp_list, ob_storage, {}, retain)
+        return self._codec.serialize_multipart((exp_list, ob_storage,
+                                                 retain))
+
+    def acknowledge(self):
+        """
+            Called when the replay accepted the last flush
+        """
+        _, ob_storage, references, retain = self._flushed
+        self._retained = {}
+        for hsh in retain:
+            self._retained[hsh] = ob_storage.get(hsh, references.get(hsh))
+        self._flushed = None
 
     def _hash_nested(self, values):
         if isinstance(values, list):
@@ -53,31 +148,102 @@ class ExpBuffer(object):
             return None
         else:  # values is a single object
             obj = values
-            hsh = U.pyobj_hash(obj)
-            if hsh not in self.ob_storage:
+            hsh = self._hash(obj)
+            if hsh in self._retained:
+                self._references[hsh] = obj
+            elif hsh not in self.ob_storage:
                 self.ob_storage[hsh] = obj
             return hsh
 
 
+def _nested_hashes(exp):
+    """
+        Yields the hashes in the `_hash` entries of an experience
+    """
+    for key, value in exp.items():
+        if key.endswith('_hash'):
+            yield from _hash_leaves(value)
+
+
+def _hash_leaves(values):
+    if isinstance(values, (list, tuple)):
+        for value in values:
+            yield from _hash_leaves(value)
+    elif isinstance(values, dict):
+        for value in values.values():
+            yield from _hash_leaves(value)
+    elif values is not None:
+        yield values
+
+
 class ExpSender(object):
     """
     `send()` logic can be overwritten to support
     more complicated agent experiences,
     such as multiagent, self-play, etc.
+
+    Experiences are flushed to the replay every flush_iteration send()
+    calls or flush_time seconds after the oldest buffered experience,
+    whichever comes first. With background, send() only queues the
+    experience, hashing, serialization and the round trip to the replay
+    happen on a thread, which also flushes on time when the agent does
+    not call send(). send() blocks while max_queue_size experiences
+    are queued.
+
+    Flushes are sent as one multipart message with copy=False,
+    observations are not copied into a message buffer if the codec
+    sends numpy arrays as separate frames (e.g. 'npframe', 'pickle5').
+    A flush that the replay does not acknowledge within timeout seconds
+    raises ZmqTimeoutError, from send() with background.
     """
     def __init__(self, *,
                  host,
                  port,
-                 flush_iteration):
+                 flush_iteration,
+                 agent_id=None,
+                 obs_hash='content',
+                 obs_cache=False,
+                 flush_time=0,
+                 background=False,
+                 max_queue_size=1000,
+                 timeout=60,
+                 codec='global'):
         """
         Args:
             flush_iteration: how many send() calls before we flush the buffer
+            agent_id: if not None, attached to every experience so that
+                the replay can tell agents apart
+            obs_hash: how hash_dict objects are deduplicated, see ExpBuffer
+            obs_cache: objects that span flushes are sent once,
+                see ExpBuffer
+            flush_time: seconds before buffered experiences are flushed,
+                0 to only flush every flush_iteration experiences
+            background: send from a background thread
+            max_queue_size: max number of experiences queued for the
+                background thread
+            timeout: seconds to wait for the replay to acknowledge
+                a flush, negative to wait indefinitely
+            codec: serialization codec, see surreal.distributed.codec
         """
         U.assert_type(flush_iteration, int)
-        self._client = ZmqSender(host=host,
-                                 port=port)
-        self._exp_buffer = ExpBuffer()
-        self._flush_tracker = PeriodicTracker(flush_iteration)
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._client = self._connect()
+        self._codec = make_codec(codec)
+        self._exp_buffer = ExpBuffer(obs_hash, obs_cache, codec)
+        self._flush_iteration = flush_iteration
+        self._flush_time = flush_time
+        self._agent_id = agent_id
+        # experiences in the buffer and when they must be flushed
+        self._num_buffered = 0
+        self._deadline = None
+        self._queue = None
+        self._thread = None
+        self._error = None
+        if background:
+            self._queue = queue.Queue(maxsize=max_queue_size)
+            self._thread = U.start_thread(self._send_loop)
 
     def send(self, hash_dict, nonhash_dict):
         """
@@ -85,14 +251,86 @@ class ExpSender(object):
             hash_dict: Large/Heavy data that should be deduplicated
                        by the caching mekanism
             nonhash_dict: Small data that we can afford to keep copies of
+
+        Returns:
+            hash of the flushed message header if this call flushed,
+            None otherwise
+            (always None with background)
         """
+        if self._agent_id is not None:
+            nonhash_dict['agent_id'] = self._agent_id
+        if self._queue is None:
+            return self._add(hash_dict, nonhash_dict)
+        while True:
+            if self._error is not None:
+                raise RuntimeError('ExpSender thread failed') from self._error
+            try:
+                self._queue.put((hash_dict, nonhash_dict), timeout=1.)
+                return None
+            except queue.Full:
+                pass
+
+    def _add(self, hash_dict, nonhash_dict):
+        if self._num_buffered == 0:
+            self._deadline = time.time() + self._flush_time
         self._exp_buffer.add(
             hash_dict=hash_dict,
             nonhash_dict=nonhash_dict,
         )
-        if self._flush_tracker.track_increment():
-            exp_binary = self._exp_buffer.flush()
-            self._client.send(exp_binary)
-            return U.binary_hash(exp_binary)
-        else:
-            return None
+        self._num_buffered += 1
+        if (self._num_buffered >= self._flush_iteration or
+                self._flush_time and time.time() >= self._deadline):
+            return self._flush()
+        return None
+
+    def _flush(self):
+        self._num_buffered = 0
+        frames = self._exp_buffer.flush()
+        missing = self._request(frames)
+        if missing:
+            # the replay forgot retained objects
+            frames = self._exp_buffer.flush_all_objects()
+            missing = self._request(frames)
+            assert not missing
+        self._exp_buffer.acknowledge()
+        return U.binary_hash(frames[0])
+
+    def _connect(self):
+        return ZmqClient(host=self._host, port=self._port,
+                         timeout=self._timeout)
+
+    def _request(self, frames):
+        """
+            Same as ZmqClient.request(), for a multipart message
+
+        Returns:
+            the hashes the replay did not find
+
+        Raises:
+            ZmqTimeoutError if the replay did not reply within timeout
+        """
+        socket = self._client.socket
+        socket.send_multipart(frames, copy=False)
+        if self._timeout >= 0 and not self._client.poller.poll(
+                self._timeout * 1000):
+            # a REQ socket cannot send again before it receives a reply
+            socket.close()
+            self._client = self._connect()
+            raise ZmqTimeoutError()
+        return self._codec.deserialize(socket.recv())
+
+    def _send_loop(self):
+        try:
+            while True:
+                timeout = None
+                if self._num_buffered and self._flush_time:
+                    timeout = max(self._deadline - time.time(), 0)
+                try:
+                    hash_dict, nonhash_dict = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    self._flush()
+                    continue
+                self._add(hash_dict, nonhash_dict)
+        except Exception as e:
+            self._error = e
+            raise
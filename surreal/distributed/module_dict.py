@@ -19,10 +19,13 @@ class ModuleDict(object):
                           '"{}" must be torchx.nn.Module.'.format(m))
         self._module_dict = module_dict
 
-    def dumps(self):
+    def dumps(self, serializer=U.serialize):
         """
             Dump content into binary
 
+        Args:
+            serializer: e.g. serialize() of a surreal.distributed.codec
+
         Returns:
             bytes
         """
@@ -32,16 +35,17 @@ class ModuleDict(object):
             for key in state_dict:
                 state_dict[key] = state_dict[key].cpu().numpy()
             bin_dict[k] = state_dict
-        return U.serialize(bin_dict)
+        return serializer(bin_dict)
 
-    def loads(self, binary):
+    def loads(self, binary, deserializer=U.deserialize):
         """
             Load from binary ()
 
         Args:
             binary: output of ModuleDict.dumps
+            deserializer: inverse of the serializer of dumps()
         """
-        numpy_dict = U.deserialize(binary)
+        numpy_dict = deserializer(binary)
         self.load(numpy_dict)
 
     def load(self, numpy_dict):
@@ -14,6 +14,7 @@ from caraml.zmq import (
     ZmqTimeoutError)
 import surreal.utils as U
 from surreal.distributed.module_dict import ModuleDict
+from surreal.distributed.codec import make_codec
 # TODO: better logging for this file
 
 
@@ -22,16 +23,19 @@ class ParameterPublisher(object):
         Publishes parameters from the learner side
         Using ZmqPub socket
     """
-    def __init__(self, port, module_dict):
+    def __init__(self, port, module_dict, codec='global'):
         """
         Args:
             port: the port connected to the pub socket
             module_dict: ModuleDict object that exposes model parameters
+            codec: serialization codec of the parameter_publish channel,
+                see surreal.distributed.codec
         """
+        self._codec = make_codec(codec)
         self._publisher = ZmqPub(
             host='*',
             port=port,
-            serializer=U.serialize,
+            serializer=self._codec.serialize,
         )
         if not isinstance(module_dict, ModuleDict):
             module_dict = ModuleDict(module_dict)
@@ -43,9 +47,9 @@ class ParameterPublisher(object):
 
         Args:
             iteration: current learning iteration
-            message: any U.serialize serializable data
+            message: any data the codec can serialize
         """
-        binary = self._module_dict.dumps()
+        binary = self._module_dict.dumps(self._codec.serialize)
         info = {
             'time': time.time(),
             'iteration': iteration,
@@ -59,8 +63,16 @@ class ShardedParameterServer(object):
     """
         Runs multiple parameter servers in parallel
     """
-    def __init__(self, shards):
+    def __init__(self, shards, publish_codec='global', serve_codec='global'):
+        """
+        Args:
+            shards: number of ParameterServer processes
+            publish_codec, serve_codec: serialization codecs of the
+                parameter_publish and parameter_serve channels
+        """
         self.shards = shards
+        self.publish_codec = publish_codec
+        self.serve_codec = serve_codec
 
         # Serving parameter to agents
         self.frontend_port = os.environ['SYMPH_PS_FRONTEND_PORT']
@@ -94,6 +106,8 @@ class ShardedParameterServer(object):
                 serving_host='localhost',
                 serving_port=self.backend_port,
                 load_balanced=True,
+                publish_codec=self.publish_codec,
+                serve_codec=self.serve_codec,
             )
             worker.start()
             self.workers.append(worker)
@@ -122,13 +136,18 @@ class ParameterServer(Process):
                  publisher_port,
                  serving_host,
                  serving_port,
-                 load_balanced=False,):
+                 load_balanced=False,
+                 publish_codec='global',
+                 serve_codec='global'):
         """
         Args:
             publisher_host, publisher_port: where learner publish parameters
             serving_host, serving_port: where to serve parameters to agents
             load_balanced: whether multiple parameter servers are sharing the
                 same address
+            publish_codec: codec of the messages from ParameterPublisher,
+                parameters are served as they were published
+            serve_codec: codec of the requests and replies of agents
         """
         Process.__init__(self)
         self.publisher_host = publisher_host
@@ -136,6 +155,8 @@ class ParameterServer(Process):
         self.serving_host = serving_host
         self.serving_port = serving_port
         self.load_balanced = load_balanced
+        self.publish_codec = publish_codec
+        self.serve_codec = serve_codec
         # storage
         self.parameters = None
         self.param_info = None
@@ -149,19 +170,21 @@ class ParameterServer(Process):
         """
             Run relative threads and wait until they finish (due to error)
         """
+        publish_codec = make_codec(self.publish_codec)
+        serve_codec = make_codec(self.serve_codec)
         self._subscriber = ZmqSub(
             host=self.publisher_host,
             port=self.publisher_port,
             # handler=self._set_storage,
             topic='ps',
-            deserializer=U.deserialize,
+            deserializer=publish_codec.deserialize,
         )
         self._server = ZmqServer(
             host=self.serving_host,
             port=self.serving_port,
             # handler=self._handle_agent_request,
-            serializer=U.serialize,
-            deserializer=U.deserialize,
+            serializer=serve_codec.serialize,
+            deserializer=serve_codec.deserialize,
             bind=not self.load_balanced,
         )
         self._subscriber_thread = self._subscriber.start_loop(
@@ -216,13 +239,16 @@ class ParameterClient(object):
         latest parameters.
     """
 
-    def __init__(self, host, port, timeout=2):
+    def __init__(self, host, port, timeout=2, codec='global'):
         """
         Args:
             host: parameter server host
             port: parameter server port
             timeout: how long should the the client wait
                 if the parameter server is not available
+            codec: serialization codec of the parameter_serve channel,
+                see surreal.distributed.codec. Parameters are returned
+                in the codec of the parameter_publish channel
         """
         self.host = host
         self.port = port
@@ -230,13 +256,14 @@ class ParameterClient(object):
         self._current_info = {}
         self._last_hash = ''
         self.alive = False
+        self._codec = make_codec(codec)
 
         self._client = ZmqClient(
             host=self.host,
             port=self.port,
             timeout=self.timeout,
-            serializer=U.serialize,
-            deserializer=U.deserialize)
+            serializer=self._codec.serialize,
+            deserializer=self._codec.deserialize)
 
     def fetch_parameter_with_info(self, force_update=False):
         """
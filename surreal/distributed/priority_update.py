@@ -0,0 +1,84 @@
+"""
+Propagates updated priorities (e.g. TD errors) from the learner
+back to the prioritized replay shards that sampled the batch
+"""
+import queue
+import surreal.utils as U
+from caraml.zmq import ZmqPub, ZmqSub
+
+
+class PrioritySender(object):
+    """
+        Learner side. Publishes priority updates from a background thread,
+        send() never blocks: updates are dropped when the queue is full
+    """
+    def __init__(self, port, max_queue=32):
+        """
+        Args:
+            port: the port the pub socket binds to
+            max_queue: max number of pending updates
+        """
+        self._publisher = ZmqPub(
+            host='*',
+            port=port,
+            serializer=U.serialize,
+        )
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped_count = 0
+        self._thread = U.start_thread(self._publish_loop)
+
+    def send(self, replay_index, indices, insert_ids, priorities):
+        """
+        Args:
+            replay_index: index of the replay shard that sampled the batch
+            indices: storage indices returned with the batch
+            insert_ids: insert ids returned with the batch
+            priorities: new priorities, same length as indices
+        """
+        try:
+            self._queue.put_nowait((replay_index, indices, insert_ids,
+                                    priorities))
+        except queue.Full:
+            self.dropped_count += 1
+
+    def _publish_loop(self):
+        while True:
+            data = self._queue.get(block=True)
+            self._publisher.pub(topic='priority', data=data)
+
+
+class PriorityReceiver(object):
+    """
+        Replay side. Subscribes to priority updates and forwards
+        the ones that belong to this replay shard to `handler`
+    """
+    def __init__(self, host, port, replay_index, handler):
+        """
+        Args:
+            host, port: where the learner publishes priorities
+            replay_index: only updates for this shard are handled
+            handler: f(indices, priorities, insert_ids)
+        """
+        self.replay_index = replay_index
+        self._handler = handler
+        self._subscriber = ZmqSub(
+            host=host,
+            port=port,
+            topic='priority',
+            deserializer=U.deserialize,
+        )
+        self._thread = None
+
+    def start(self):
+        self._thread = self._subscriber.start_loop(
+            handler=self._handle,
+            blocking=False)
+        return self._thread
+
+    def join(self):
+        self._thread.join()
+
+    def _handle(self, data):
+        replay_index, indices, insert_ids, priorities = data
+        if replay_index == self.replay_index:
+            self._handler(indices, priorities, insert_ids)
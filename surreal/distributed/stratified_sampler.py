@@ -0,0 +1,212 @@
+"""
+Stratified sampling across replay shards: instead of sending each
+request to whichever shard is free, the learner asks every shard for
+a share of the batch proportional to its size and merges the parts
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from caraml.zmq import ZmqServer, ZmqClient, ZmqTimeoutError
+import surreal.utils as U
+from surreal.session import ConfigError
+from .codec import make_codec
+
+
+class StratifiedSampler(object):
+    """
+        Learner side. Serves sample requests in the format of
+        Replay._sample_request_handler, batch_size or
+        (batch_size, num_batches), by scattering them across shards.
+
+        Replay shard i serves at shard_sampler_address(i) (see
+        Replay._shard_sample_request_handler). Every shard receives a
+        share of batch_size proportional to the number of experiences it
+        reported in its last reply, shares are equal until shards have
+        reported. Shards that are not ready to be sampled or do not reply
+        within `timeout` seconds are skipped for the current batch and
+        their share is redistributed to the others.
+
+        The serialized parts sent by the shards are not decoded here,
+        every batch is answered with its parts joined by
+        U.join_serialized and is merged by the receiver,
+        see decode_parts().
+    """
+    def __init__(self, host, port, shard_addresses, timeout, codec='global'):
+        """
+        Args:
+            host, port: where this sampler serves the prefetch workers
+            shard_addresses: list of (host, port) of every replay shard,
+                see shard_sampler_address()
+            timeout: seconds to wait for a shard before redistributing
+            codec: serialization codec of the sampling channel,
+                see surreal.distributed.codec
+        """
+        self.host = host
+        self.port = port
+        self.num_shards = len(shard_addresses)
+        self.codec = make_codec(codec)
+        self._clients = [ZmqClient(host=shard_host,
+                                   port=shard_port,
+                                   timeout=timeout,
+                                   serializer=self.codec.serialize,
+                                   deserializer=U.split_joined)
+                         for shard_host, shard_port in shard_addresses]
+        # one thread per shard, a ZmqClient is used by one thread only
+        self._executors = [ThreadPoolExecutor(max_workers=1)
+                           for _ in range(self.num_shards)]
+        self.shard_sizes = np.zeros(self.num_shards, dtype=np.int64)
+        self.timeout_count = 0
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server = ZmqServer(host=self.host, port=self.port, bind=True)
+        self._thread = self._server.start_loop(handler=self._handle,
+                                               blocking=False)
+        return self._thread
+
+    def _handle(self, req):
+        request = self.codec.deserialize(req)
+        if isinstance(request, int):
+            parts, = self.sample_parts(request)
+            return U.join_serialized(parts)
+        batch_size, num_batches = request
+        return U.join_serialized([U.join_serialized(parts) for parts
+                                  in self.sample_parts(batch_size,
+                                                       num_batches)])
+
+    def sample(self, batch_size, num_batches=None):
+        """
+        Returns:
+            one merged batch, or a list of num_batches merged batches
+            if num_batches is given
+        """
+        merged = [merge_batches([self.codec.deserialize(part)
+                                 for part in parts])
+                  for parts in self.sample_parts(batch_size, num_batches)]
+        if num_batches is None:
+            return merged[0]
+        return merged
+
+    def sample_parts(self, batch_size, num_batches=None):
+        """
+        Returns:
+            for each of the num_batches batches, or for the single batch
+            if num_batches is None, the list of serialized partial
+            batches sent by the shards
+        """
+        parts = []
+        remaining = batch_size
+        available = np.ones(self.num_shards, dtype=bool)
+        while remaining > 0:
+            if not available.any():
+                # no shard can serve now, wait for them to fill up
+                time.sleep(0.1)
+                available[:] = True
+            shares = np.zeros(self.num_shards, dtype=np.int64)
+            shares[available] = allocate(remaining,
+                                         self.shard_sizes[available])
+            futures = [(i, self._executors[i].submit(
+                            self._request, i, int(shares[i]), num_batches))
+                       for i in np.flatnonzero(available)]
+            for i, future in futures:
+                try:
+                    size, batches = future.result()
+                except ZmqTimeoutError:
+                    self.timeout_count += 1
+                    available[i] = False
+                    continue
+                self.shard_sizes[i] = size
+                if shares[i] == 0:
+                    continue
+                if batches is None:
+                    available[i] = False
+                    continue
+                parts.append(batches)
+                remaining -= shares[i]
+        return [list(batch_parts) for batch_parts in zip(*parts)]
+
+    def _request(self, shard, share, num_batches):
+        """
+        Returns:
+            (shard size, list of serialized batches or None if the shard
+            sent none), see Replay._shard_sample_request_handler
+        """
+        request = share if num_batches is None else (share, num_batches)
+        reply = self._clients[shard].request(request)
+        size = self.codec.deserialize(reply[0])
+        if len(reply) == 1:
+            return size, None
+        if num_batches is None:
+            return size, [reply[1]]
+        return size, U.split_joined(reply[1])
+
+    def join(self):
+        self._thread.join()
+
+
+def shard_sampler_address(index):
+    """
+        Address where replay shard `index` serves StratifiedSampler,
+        declared as 'shard-sampler-<index>' by
+        surreal.launch.setup_network
+
+    Returns:
+        (host, port)
+    """
+    prefix = 'SYMPH_SHARD_SAMPLER_{}_'.format(index)
+    if prefix + 'PORT' not in os.environ:
+        raise ConfigError('stratified sampling needs the address of replay '
+                          'shard {}, setup_network() must be called with '
+                          'replay_shards = learner_config.replay.'
+                          'replay_shards'.format(index))
+    return os.environ.get(prefix + 'HOST'), os.environ[prefix + 'PORT']
+
+
+def allocate(total, weights):
+    """
+        Splits total into integer shares proportional to weights,
+        equal shares if all weights are 0
+
+    Returns:
+        int array of shares summing to total
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.sum() <= 0:
+        weights = np.ones(len(weights))
+    exact = total * weights / weights.sum()
+    shares = np.floor(exact).astype(np.int64)
+    # largest remainders get the leftover items
+    leftover = total - int(shares.sum())
+    shares[np.argsort(shares - exact, kind='stable')[:leftover]] += 1
+    return shares
+
+
+def decode_parts(codec, binary):
+    """
+        Deserializes a batch sent by StratifiedSampler and merges
+        its partial batches
+    """
+    return merge_batches(codec.deserialize(binary))
+
+
+def merge_batches(parts):
+    """
+        Concatenates partial batches of the same structure along the batch
+        dimension. Lists of experiences are concatenated, dicts are merged
+        key by key, batched arrays and lists of batched arrays
+        (e.g. persistent_infos) are concatenated along their first axis.
+    """
+    first = parts[0]
+    if first is None:
+        return None
+    if isinstance(first, dict):
+        return first.__class__((key, merge_batches([part[key]
+                                                    for part in parts]))
+                               for key in first)
+    if isinstance(first, np.ndarray):
+        return np.concatenate(parts)
+    if len(first) > 0 and isinstance(first[0], np.ndarray):
+        return [np.concatenate(column) for column in zip(*parts)]
+    return [exp for part in parts for exp in part]
@@ -8,7 +8,7 @@ import copy
 
 # https://effectivepython.com/2015/02/02/register-class-existence-with-metaclasses/
 class ExpSenderWrapperBase(Wrapper):
-    def __init__(self, env, learner_config, session_config):
+    def __init__(self, env, learner_config, session_config, agent_id=None):
         """
         Default sender configs are in BASE_SESSION_CONFIG['sender']
         They contain communication level information
@@ -25,6 +25,14 @@ class ExpSenderWrapperBase(Wrapper):
             host=host,
             port=port,
             flush_iteration=self.session_config.sender.flush_iteration,
+            agent_id=agent_id,
+            obs_hash=self.session_config.sender.obs_hash,
+            obs_cache=self.session_config.sender.obs_cache,
+            flush_time=self.session_config.sender.flush_time,
+            background=self.session_config.sender.background,
+            max_queue_size=self.session_config.sender.max_queue_size,
+            timeout=self.session_config.sender.timeout,
+            codec=self.session_config.codec.exp_collection,
         )
         
 
@@ -39,8 +47,8 @@ class ExpSenderWrapperSSAR(ExpSenderWrapperBase):
             'info': info
         }
     """
-    def __init__(self, env, learner_config, session_config):
-        super().__init__(env, learner_config, session_config)
+    def __init__(self, env, learner_config, session_config, agent_id=None):
+        super().__init__(env, learner_config, session_config, agent_id)
         self._obs = None  # obs of the current time step
 
     def _reset(self):
@@ -86,8 +94,8 @@ class ExpSenderWrapperSSARNStepBootstrap(ExpSenderWrapperSSAR):
             @self.learner_config.algo.n_step: number of steps to cumulate over
             @self.learner_config.algo.gamma: discount factor
     """
-    def __init__(self, env, learner_config, session_config):
-        super().__init__(env, learner_config, session_config)
+    def __init__(self, env, learner_config, session_config, agent_id=None):
+        super().__init__(env, learner_config, session_config, agent_id)
         self.n_step = self.learner_config.algo.n_step
         self.gamma = self.learner_config.algo.gamma
         self.last_n = deque()
@@ -175,7 +183,7 @@ class ExpSenderWrapperMultiStepMovingWindowWithInfo(ExpSenderWrapperBase):
             @self.learner_config.algo.stride: after sending experience [state_i, ...]
             the next experience is [state_{i + stride}]
     """
-    def __init__(self, env, learner_config, session_config):
+    def __init__(self, env, learner_config, session_config, agent_id=None):
         '''
         Consturctor for ExpSenderWrapperMultiStepMovingWindowWithInfo class
         Important Attributes:
@@ -187,7 +195,7 @@ class ExpSenderWrapperMultiStepMovingWindowWithInfo(ExpSenderWrapperBase):
             sender: distributed experience sender. communicate with local and
                     remote replay buffer
         '''
-        super().__init__(env, learner_config, session_config)
+        super().__init__(env, learner_config, session_config, agent_id)
         self._ob = None  # obs of the current time step
         self.n_step = self.learner_config.algo.n_step
         self.stride = self.learner_config.algo.stride # Stride for moving window
@@ -282,8 +290,8 @@ class ExpSenderWrapperMultiStepMovingWindow(ExpSenderWrapperMultiStep):
             @self.learner_config.algo.stride: after sending experience [state_i, ...]
             the next experience is [state_{i + stride}]
     """
-    def __init__(self, env, learner_config, session_config):
-        super().__init__(env, learner_config, session_config)
+    def __init__(self, env, learner_config, session_config, agent_id=None):
+        super().__init__(env, learner_config, session_config, agent_id)
         self._obs = None  # obs of the current time step
         self.n_step = self.learner_config.algo.n_step
         self.stride = self.learner_config.algo.stride # Stride for moving window
@@ -306,3 +314,69 @@ class ExpSenderWrapperMultiStepMovingWindow(ExpSenderWrapperMultiStep):
                     self.last_n.popleft()
         self._obs = obs_next
         return obs_next, reward, done, info
+
+
+class ExpSenderWrapperStepWithInfo(ExpSenderWrapperBase):
+    """
+        Sends every step exactly once, in format
+        {
+            'obs': state_i,
+            'obs_next': state_{i + 1} if done else None,
+            'action': action_i,
+            'reward': reward_i,
+            'done': done_i,
+            'persistent_infos': infolist_i,
+            'onetime_infos': infos if i is a multiple of stride else None,
+            'episode_start': whether i is the first step of an episode,
+        }
+        surreal.replay.TrajectoryReplay rebuilds the n_step windows of
+        ExpSenderWrapperMultiStepMovingWindowWithInfo from these steps,
+        so that overlapping windows are not sent and stored n_step / stride
+        times.
+
+        Requires:
+            agent_id: the replay keeps one trajectory per agent
+            @self.learner_config.algo.stride: windows start every stride steps
+    """
+    def __init__(self, env, learner_config, session_config, agent_id=None):
+        super().__init__(env, learner_config, session_config, agent_id)
+        if agent_id is None:
+            raise ConfigError('ExpSenderWrapperStepWithInfo requires agent_id')
+        self._ob = None  # obs of the current time step
+        self.stride = self.learner_config.algo.stride
+        if self.stride < 1:
+            raise ConfigError('stride {} for experience generation cannot be less than 1'.format(self.learner_config.algo.stride))
+        self._step_index = 0
+
+    def _reset(self):
+        '''
+            Note: deepcopy is required to prevent Mujoco changing the states
+                  under the hood
+        '''
+        obs, info = self.env.reset()
+        self._ob = copy.deepcopy(obs)
+        self._step_index = 0
+        return self._ob, info
+
+    def _step(self, action):
+        action_choice, action_info = action
+        obs_next, reward, done, info = self.env.step(action_choice)
+        hash_dict = {
+            'obs': self._ob,
+            'obs_next': obs_next if done else None,
+        }
+        onetime_infos = None
+        if self._step_index % self.stride == 0:
+            onetime_infos = action_info[0]
+        nonhash_dict = {
+            'action': action_choice,
+            'reward': reward,
+            'done': done,
+            'persistent_infos': action_info[1],
+            'onetime_infos': onetime_infos,
+            'episode_start': self._step_index == 0,
+        }
+        self.sender.send(hash_dict, nonhash_dict)
+        self._step_index += 1
+        self._ob = copy.deepcopy(obs_next)
+        return obs_next, reward, done, info
@@ -150,6 +150,13 @@ class KurrealParser(SymphonyParser):
             default=None,
             help='put how many eval on each eval pod'
         )
+        parser.add_argument(
+            '--replay-shards',
+            type=int,
+            default=None,
+            help='number of replay shards, must match '
+                 'learner_config.replay.replay_shards'
+        )
         parser.add_argument(
             '--env',
             type=str,
@@ -231,6 +238,7 @@ class KurrealParser(SymphonyParser):
         'num_evals': 1,
         'agent_batch': 1,
         'eval_batch': 1,
+        'replay_shards': 1,
         'restore_folder': None,
         'env': 'gym:HalfCheetah-v2',
         'agent': {
@@ -400,7 +408,8 @@ class KurrealParser(SymphonyParser):
                       ps=ps,
                       tensorboard=tensorboard,
                       tensorplex=tensorplex,
-                      loggerplex=loggerplex)
+                      loggerplex=loggerplex,
+                      replay_shards=settings.replay_shards)
 
         if 'nfs' in self.config:
             print('NFS mounted')
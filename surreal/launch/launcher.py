@@ -338,7 +338,11 @@ class SurrealDefaultLauncher(Launcher):
         """
         ps_config = self.session_config.ps
 
-        server = ShardedParameterServer(shards=ps_config.shards)
+        codec_config = self.session_config.codec
+        server = ShardedParameterServer(
+            shards=ps_config.shards,
+            publish_codec=codec_config.parameter_publish,
+            serve_codec=codec_config.parameter_serve)
 
         server.launch()
         server.join()
@@ -8,7 +8,8 @@ def setup_network(*, agents,
                   learner,
                   tensorplex,
                   loggerplex,
-                  tensorboard):
+                  tensorboard,
+                  replay_shards=1):
     """
         Sets up the communication between surreal
         components using symphony
@@ -17,6 +18,8 @@ def setup_network(*, agents,
             agents, evals (list): list of symphony processes
             ps, replay, learner, tensorplex, loggerplex, tensorboard:
                 symphony processes
+            replay_shards: learner_config.replay.replay_shards, every
+                shard serves learner.stratified_sampling on its own port
     """
     for proc in itertools.chain(agents, evals):
         proc.connects('ps-frontend')
@@ -30,10 +33,16 @@ def setup_network(*, agents,
     replay.binds('sampler-frontend')
     replay.binds('collector-backend')
     replay.binds('sampler-backend')
+    replay.connects('priority-update')
+    for i in range(replay_shards):
+        replay.binds('shard-sampler-{}'.format(i))
+        learner.connects('shard-sampler-{}'.format(i))
 
     learner.connects('sampler-frontend')
     learner.binds('parameter-publish')
     learner.binds('prefetch-queue')
+    learner.binds('priority-update')
+    learner.binds('stratified-sampler')
 
     tensorplex.binds('tensorplex')
     loggerplex.binds('loggerplex')
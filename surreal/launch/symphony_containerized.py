@@ -5,7 +5,8 @@ def create_surreal_containerized(exp,
                                  nonagent_image,
                                  agent_image,
                                  cmd_dict,
-                                 batched=False):
+                                 batched=False,
+                                 replay_shards=1):
     """
     TODO: document
 
@@ -15,6 +16,7 @@ def create_surreal_containerized(exp,
         agent_image: [description]
         cmd_dict: [description]
         batched: [description] (default: {False})
+        replay_shards: learner_config.replay.replay_shards (default: {1})
     """
     nonagent = exp.new_process_group('nonagent')
     learner = nonagent.new_process(
@@ -82,7 +84,8 @@ def create_surreal_containerized(exp,
                   ps=ps,
                   tensorboard=tensorboard,
                   tensorplex=tensorplex,
-                  loggerplex=loggerplex)
+                  loggerplex=loggerplex,
+                  replay_shards=replay_shards)
     return {
         'agents': agents,
         'evals': evals,
@@ -21,7 +21,9 @@ class FrameStackPreprocessor():
         # We must copy here because the experience sender should send the non-stacked version
         if 'pixel' in obs:
             for key in obs['pixel']:
-                obs['pixel'][key] = np.concatenate(obs['pixel'][key], axis=0)
+                # columnar replay storage already returns stacked arrays
+                if isinstance(obs['pixel'][key], (list, tuple)):
+                    obs['pixel'][key] = np.concatenate(obs['pixel'][key], axis=0)
                 assert len(obs['pixel'][key].shape) == 3
 
     def preprocess_list(self, exp_list):
@@ -15,7 +15,12 @@ from surreal.session import (
     get_tensorplex_client,
     Config
 )
-from surreal.distributed import ParameterPublisher, LearnerDataPrefetcher
+from surreal.distributed import (
+    ParameterPublisher,
+    LearnerDataPrefetcher,
+    StreamingDataFetcher,
+    PrioritySender,
+)
 
 
 class Learner(metaclass=U.AutoInitializeMeta):
@@ -40,6 +45,8 @@ class Learner(metaclass=U.AutoInitializeMeta):
         self.session_config = session_config
         self.current_iter = 0
 
+        self._priority_sender = None
+
         self._setup_logging()
         self._setup_checkpoint()
 
@@ -95,17 +102,28 @@ class Learner(metaclass=U.AutoInitializeMeta):
         ps_publish_port = os.environ['SYMPH_PARAMETER_PUBLISH_PORT']
         self._ps_publisher = ParameterPublisher(
             port=ps_publish_port,
-            module_dict=self.module_dict()
+            module_dict=self.module_dict(),
             # This must happen after subclass __init__
+            codec=self.session_config.codec.parameter_publish,
         )
 
     def _setup_prefetching(self):
         batch_size = self.learner_config.replay.batch_size
+        if self.session_config.learner.streaming:
+            self._prefetch_queue = StreamingDataFetcher(
+                session_config=self.session_config,
+                batch_size=batch_size,
+                worker_preprocess=self._prefetcher_preprocess_wrapper,
+                main_preprocess=self.preprocess,
+            )
+            self._prefetch_queue.start()
+            return
         self._prefetch_queue = LearnerDataPrefetcher(
             session_config=self.session_config,
             batch_size=batch_size,
-            worker_preprocess=self._prefetcher_preprocess,
-            main_preprocess=self.preprocess
+            worker_preprocess=self._prefetcher_preprocess_wrapper,
+            main_preprocess=self.preprocess,
+            num_replay_shards=self.learner_config.replay.replay_shards,
         )
         self._prefetch_queue.start()
 
@@ -140,6 +158,28 @@ class Learner(metaclass=U.AutoInitializeMeta):
         """
         self._ps_publisher.publish(iteration, message=message)
 
+    ######
+    # Prioritized replay
+    ######
+    def update_priorities(self, priority_info, priorities):
+        """
+        Sends new priorities of a batch sampled from PrioritizedReplay
+        back to the replay shard that owns it. Fire-and-forget,
+        never blocks the learner.
+
+        Args:
+            priority_info: batch['priority'] of the learned batch
+            priorities: new priorities (e.g. absolute TD errors),
+                one per experience in the batch
+        """
+        if self._priority_sender is None:
+            self._priority_sender = PrioritySender(
+                port=os.environ['SYMPH_PRIORITY_UPDATE_PORT'])
+        self._priority_sender.send(priority_info['replay_index'],
+                                   np.asarray(priority_info['indices']),
+                                   np.asarray(priority_info['insert_ids']),
+                                   np.asarray(priorities))
+
     ######
     # Getting data
     ######
@@ -344,6 +384,18 @@ class Learner(metaclass=U.AutoInitializeMeta):
         """
         return batch
 
+    def _prefetcher_preprocess_wrapper(self, batch):
+        """
+            Unwraps batches from PrioritizedReplay so that
+            _prefetcher_preprocess only sees the experiences,
+            priority info is passed on under batch['priority']
+        """
+        if isinstance(batch, dict) and 'priority' in batch:
+            data = self._prefetcher_preprocess(batch['exps'])
+            data['priority'] = batch['priority']
+            return data
+        return self._prefetcher_preprocess(batch)
+
     ######
     # Main Loop
     # Override to completely change learner behavior
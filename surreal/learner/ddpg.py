@@ -65,6 +65,7 @@ class DDPGLearner(Learner):
         self.use_action_regularization = self.learner_config.algo.network.use_action_regularization
 
         self.frame_stack_concatenate_on_env = self.env_config.frame_stack_concatenate_on_env
+        self.aggregate_on_replay = self.learner_config.replay.aggregate_on_replay
 
         self.log.info('Initializing DDPG learner')
         self._num_gpus = session_config.learner.num_gpus
@@ -225,6 +226,9 @@ class DDPGLearner(Learner):
             actions = torch.tensor(actions, dtype=torch.float32).to(torch.device(device_name))
             rewards = torch.tensor(rewards, dtype=torch.float32).to(torch.device(device_name))
             done = torch.tensor(done, dtype=torch.float32).to(torch.device(device_name))
+            if 'priority' in batch:
+                batch['priority']['weights'] = torch.tensor(batch['priority']['weights'],
+                    dtype=torch.float32).to(torch.device(device_name))
 
             (
                 batch['obs'],
@@ -241,7 +245,7 @@ class DDPGLearner(Learner):
             )
             return batch
 
-    def _optimize(self, obs, actions, rewards, obs_next, done):
+    def _optimize(self, obs, actions, rewards, obs_next, done, weights=None):
         '''
         Note that while the replay contains uint8, the
         aggregator returns float32 tensors
@@ -254,6 +258,11 @@ class DDPGLearner(Learner):
             rewards: rewards received after action is taken. Dimensionality: N
             obs_next: an observation from the minibatch, often represented as s_{n+1} in literature
             done: 1 if obs_next is terminal, 0 otherwise. Dimensionality: N
+            weights: importance sampling weights from prioritized replay, None for uniform replay.
+                Dimensionality: (N, 1)
+
+        Returns:
+            tensorplex_update_dict, absolute critic TD errors as numpy array of size N
         '''
         with tx.device_scope(self.gpu_ids):
 
@@ -303,7 +312,10 @@ class DDPGLearner(Learner):
                 self.model.critic.zero_grad()
                 if self.is_pixel_input:
                     self.model.perception.zero_grad()
-                critic_loss = self.critic_criterion(y_policy, y)        
+                if weights is None:
+                    critic_loss = self.critic_criterion(y_policy, y)
+                else:
+                    critic_loss = (weights * (y_policy - y) ** 2).mean()
                 critic_loss.backward()
                 if self.clip_critic_gradient:
                     self.model.critic.clip_grad_value(self.critic_gradient_clip_value)
@@ -313,7 +325,10 @@ class DDPGLearner(Learner):
                     self.model2.critic.zero_grad()
                     if self.is_pixel_input:
                         self.model2.perception.zero_grad()
-                    critic_loss = self.critic_criterion(y_policy2, y)
+                    if weights is None:
+                        critic_loss = self.critic_criterion(y_policy2, y)
+                    else:
+                        critic_loss = (weights * (y_policy2 - y) ** 2).mean()
                     critic_loss.backward()
                     if self.clip_critic_gradient:
                         self.model2.critic.clip_grad_value(self.critic_gradient_clip_value)
@@ -349,7 +364,8 @@ class DDPGLearner(Learner):
             # (possibly) update target networks
             self._target_update()
 
-            return tensorplex_update_dict
+            td_errors = (y - y_policy).abs().detach().cpu().numpy().reshape(-1)
+            return tensorplex_update_dict, td_errors
 
     def learn(self, batch):
         '''
@@ -360,14 +376,21 @@ class DDPGLearner(Learner):
             tensors and aggregation step
         '''
         self.current_iteration += 1
+        priority_info = batch.get('priority')
+        weights = None
+        if priority_info is not None:
+            weights = priority_info['weights']
         with self.total_learn_time.time():
-            tensorplex_update_dict = self._optimize(
+            tensorplex_update_dict, td_errors = self._optimize(
                 batch.obs,
                 batch.actions,
                 batch.rewards,
                 batch.obs_next,
-                batch.dones
+                batch.dones,
+                weights,
             )
+            if priority_info is not None:
+                self.update_priorities(priority_info, td_errors)
             tensorplex_update_dict['performance/total_learn_time'] = self.total_learn_time.avg
             self.tensorplex.add_scalars(tensorplex_update_dict, global_step=self.current_iteration)
             self.periodic_checkpoint(
@@ -433,7 +456,10 @@ class DDPGLearner(Learner):
         If frame_stack_preprocess is not set, each experience in the replay will be stored as a list of frames, as
         opposed to a single numpy array.  We must condense them into a single numpy array as that is what the
         aggregator expects.
+        With learner_config.replay.aggregate_on_replay, the replay already sends batched arrays.
         '''
+        if self.aggregate_on_replay:
+            return batch
         if not self.frame_stack_concatenate_on_env:
             batch = self.frame_stack_preprocess.preprocess_list(batch)
         batch = self.aggregator.aggregate(batch)
@@ -678,5 +678,8 @@ class PPOLearner(Learner):
         ]
 
     def _prefetcher_preprocess(self, batch):
+        if self.learner_config.replay.trajectory:
+            # TrajectoryReplay sends aggregated windows
+            return batch
         batch = self.aggregator.aggregate(batch)
         return batch
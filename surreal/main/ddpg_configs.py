@@ -7,7 +7,7 @@ from surreal.session import (
     )
 from surreal.agent import DDPGAgent
 from surreal.learner import DDPGLearner
-from surreal.replay import UniformReplay
+from surreal.replay import UniformReplay, PrioritizedReplay, TieredReplay
 from surreal.launch import SurrealDefaultLauncher
 from surreal.env import make_env
 
@@ -262,6 +262,16 @@ class DDPGLauncher(SurrealDefaultLauncher):
                             help='how many agents/evals per batch')
         parser.add_argument('--eval-batch', type=int, default=1,
                             help='how many agents/evals per batch')
+        parser.add_argument('--prioritized-replay', action='store_true',
+                            help='sample experiences proportional to critic '
+                            'TD errors, see surreal.replay.PrioritizedReplay')
+        parser.add_argument('--cold-memory-size', type=int, default=0,
+                            help='keep this many experiences per replay shard '
+                            'on disk, see surreal.replay.TieredReplay')
+        parser.add_argument('--nstep-on-replay', action='store_true',
+                            help='agents send single steps and the replay '
+                            'computes n-step returns, requires columnar storage '
+                            'and a single replay shard')
         parser.add_argument('--unit-test', action='store_true',
                             help='Prevents sharding replay and paramter '
                             'server. Helps prevent address collision'
@@ -283,6 +293,27 @@ class DDPGLauncher(SurrealDefaultLauncher):
                            env_config,
                            learner_config)
 
+        if args.prioritized_replay and args.cold_memory_size:
+            raise ValueError('--prioritized-replay and --cold-memory-size '
+                             'cannot be combined')
+        if args.nstep_on_replay and args.cold_memory_size:
+            raise ValueError('--nstep-on-replay and --cold-memory-size '
+                             'cannot be combined')
+        if args.prioritized_replay:
+            self.replay_class = PrioritizedReplay
+        if args.cold_memory_size:
+            self.replay_class = TieredReplay
+            self.learner_config.replay.storage = 'columnar'
+            self.learner_config.replay.cold_memory_size = args.cold_memory_size
+        if args.nstep_on_replay:
+            self.learner_config.replay.storage = 'columnar'
+            self.learner_config.replay.nstep_on_replay = True
+            # every step of an agent must reach the same shard,
+            # keep the total replay size on a single shard
+            replay_config = self.learner_config.replay
+            replay_config.memory_size *= replay_config.replay_shards
+            replay_config.replay_shards = 1
+
         self.env_config.env_name = args.env
         _, self.env_config = make_env(self.env_config)
         self.env_config.num_agents = args.num_agents
@@ -6,7 +6,7 @@ from surreal.session import (
     )
 from surreal.agent import PPOAgent
 from surreal.learner import PPOLearner
-from surreal.replay import FIFOReplay
+from surreal.replay import FIFOReplay, TrajectoryReplay
 from surreal.launch import SurrealDefaultLauncher
 from surreal.env import make_env
 import argparse
@@ -205,6 +205,13 @@ class PPOLauncher(SurrealDefaultLauncher):
                             'files like checkpoint and logs')
         parser.add_argument('--agent-batch', type=int, default=1,
                             help='how many agents/evals per batch')
+        parser.add_argument('--trajectory-replay', action='store_true',
+                            help='agents send every step once, see '
+                            'surreal.replay.TrajectoryReplay')
+        parser.add_argument('--streaming', action='store_true',
+                            help='the replay sends each batch as soon as it '
+                            'is filled, see surreal.distributed.'
+                            'StreamingDataFetcher')
         parser.add_argument('--unit-test', action='store_true',
                             help='Set config values to settings that can run locally for unit testing')
 
@@ -222,6 +229,13 @@ class PPOLauncher(SurrealDefaultLauncher):
         self.agent_batch_size = args.agent_batch
         self.eval_batch_size = args.agent_batch
 
+        if args.trajectory_replay:
+            self.replay_class = TrajectoryReplay
+            self.learner_config.replay.trajectory = True
+
+        if args.streaming:
+            self.session_config.learner.streaming = True
+
         if args.unit_test:
             self.learner_config.replay.batch_size = 2
             self.learner_config.replay.sampling_start_size = 2
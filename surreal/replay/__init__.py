@@ -1,5 +1,8 @@
 from .base import *
 from .dummy_replay import *
 from .uniform_replay import UniformReplay
+from .prioritized_replay import PrioritizedReplay
+from .tiered_replay import TieredReplay
 from .fifo_replay import FIFOReplay
+from .trajectory_replay import TrajectoryReplay
 from .sharded_replay import ShardedReplay
\ No newline at end of file
@@ -1,9 +1,15 @@
 import time
 import os
+import queue
+import threading
 import surreal.utils as U
-from surreal.session import get_tensorplex_client, get_loggerplex_client
+from surreal.session import (get_tensorplex_client, get_loggerplex_client,
+                             ConfigError)
 from surreal.distributed import ExperienceCollectorServer
+from surreal.distributed.codec import make_codec
+from surreal.distributed.stratified_sampler import shard_sampler_address
 from caraml.zmq import ZmqServer
+from .rate_limiter import RateLimiter
 
 
 class Replay:
@@ -30,32 +36,94 @@ class Replay:
 
         collector_port = os.environ['SYMPH_COLLECTOR_BACKEND_PORT']
         sampler_port = os.environ['SYMPH_SAMPLER_BACKEND_PORT']
+        self._obs_cache = self.session_config.sender.obs_cache
+        if self._obs_cache and not self.session_config.replay.obs_cache_size:
+            raise ConfigError('sender.obs_cache requires '
+                              'replay.obs_cache_size')
+        if self._obs_cache and self.learner_config.replay.replay_shards != 1:
+            # the collector proxy spreads an agent's messages over all
+            # shards, each shard would only know a random part of the
+            # objects that the agent assumes are cached
+            raise ConfigError('sender.obs_cache requires '
+                              'learner_config.replay.replay_shards == 1')
         self._collector_server = ExperienceCollectorServer(
             host='localhost',
             port=collector_port,
-            exp_handler=self._insert_wrapper,
+            exp_handler=self._insert_batch_wrapper,
             load_balanced=True,
+            obs_cache_size=(self.session_config.replay.obs_cache_size
+                            if self._obs_cache else 0),
+            codec=self.session_config.codec.exp_collection,
         )
+        self._sampling_codec = make_codec(self.session_config.codec.sampling)
         self._sampler_server = ZmqServer(
             host='localhost',
             port=sampler_port,
             bind=False)
         self._sampler_server_thread = None
+        # Serves StratifiedSampler on the learner directly,
+        # bypassing the load balancing sampler proxy
+        self._shard_sampler_server = None
+        self._shard_sampler_server_thread = None
+        if self.session_config.learner.stratified_sampling:
+            _, shard_sampler_port = shard_sampler_address(index)
+            self._shard_sampler_server = ZmqServer(
+                host='*',
+                port=shard_sampler_port,
+                bind=True)
+        # Both sampler servers run their own thread, this serializes their
+        # requests which share the counters, the rate limiter and sample()
+        self._sample_request_lock = threading.Lock()
 
         self._evict_interval = self.session_config.replay.evict_interval
         self._evict_thread = None
 
+        self._snapshot_interval = \
+            self.session_config.checkpoint.replay.snapshot_interval
+        self._snapshot_thread = None
+
+        # Notified after every insert, sampling waits on it
+        # for start_sample_condition()
+        self._insert_condition = threading.Condition()
+        # Batches serialized ahead of sample requests
+        self._sample_ahead = self.session_config.replay.sample_ahead_batches
+        self._sample_ahead_queue = queue.Queue(maxsize=max(self._sample_ahead, 1))
+        self._sample_ahead_batch_size = None
+        self._sample_ahead_thread = None
+
+        # Throttles inserts or samples to keep samples per insert on target
+        self._rate_limiter = None
+        samples_per_insert = self.learner_config.replay.samples_per_insert
+        if samples_per_insert:
+            tolerance = self.learner_config.replay.samples_per_insert_tolerance
+            if tolerance < self.learner_config.replay.batch_size:
+                raise ConfigError('samples_per_insert_tolerance must be at '
+                                  'least batch_size, sampling would block')
+            self._rate_limiter = RateLimiter(samples_per_insert, tolerance)
+
         self._setup_logging()
 
     def start_threads(self):
+        if self.session_config.checkpoint.restore:
+            self.restore_snapshot()
+
         if self._has_tensorplex:
             self.start_tensorplex_thread()
 
         self._collector_server.start()
 
+        if self._snapshot_interval:
+            self.start_snapshot_thread()
+
         if self._evict_interval:
             self.start_evict_thread()
 
+        if self._shard_sampler_server is not None:
+            self._shard_sampler_server_thread = \
+                self._shard_sampler_server.start_loop(
+                    handler=self._shard_sample_request_handler,
+                    blocking=False)
+
         self._sampler_server_thread = self._sampler_server.start_loop(
             handler=self._sample_request_handler)
 
@@ -66,6 +134,10 @@ class Replay:
             self._tensorplex_thread.join()
         if self._evict_interval:
             self._evict_thread.join()
+        if self._snapshot_interval:
+            self._snapshot_thread.join()
+        if self._shard_sampler_server_thread is not None:
+            self._shard_sampler_server_thread.join()
 
     def insert(self, exp_dict):
         """
@@ -77,6 +149,18 @@ class Replay:
         """
         raise NotImplementedError
 
+    def insert_batch(self, exps):
+        """
+        Adds a list of experiences, called once per message received
+        from the agents. Override to insert the whole batch at once,
+        the default inserts them one by one.
+
+        Args:
+            exps: list of exp_dict, see insert()
+        """
+        for exp in exps:
+            self.insert(exp)
+
     def sample(self, batch_size):
         """
         This function is called in _sample_handler for learner side Zmq request
@@ -105,6 +189,50 @@ class Replay:
         """
         raise NotImplementedError
 
+    def save_snapshot(self, folder):
+        """
+        Writes the replay content to folder, without blocking
+        insert and sample for the whole duration.
+        Called periodically when
+        session_config.checkpoint.replay.snapshot_interval is set.
+        """
+        raise NotImplementedError
+
+    def load_snapshot(self, folder):
+        """
+        Fills the replay with a snapshot written by save_snapshot()
+
+        Returns:
+            bool: whether a snapshot was found in folder
+        """
+        raise NotImplementedError
+
+    def restore_snapshot(self):
+        """
+            Loads this shard's snapshot from checkpoint.restore_folder,
+            or from the session folder if it is not set
+        """
+        SC = self.session_config
+        folder = self._snapshot_folder(SC.checkpoint.restore_folder
+                                       or SC.folder)
+        start_time = time.time()
+        if self.load_snapshot(folder):
+            self.log.info('restored {} experiences from {} in {:.1f}s'.format(
+                len(self), folder, time.time() - start_time))
+        else:
+            self.log.warning('no replay snapshot loaded from {}, '
+                             'starting empty'.format(folder))
+
+    def storage_metrics(self):
+        """
+        Storage specific stats reported to tensorplex under `.storage/`,
+        for example memory usage.
+
+        Returns:
+            dict of {metric name: value}
+        """
+        return {}
+
     def __len__(self):
         raise NotImplementedError
 
@@ -125,6 +253,8 @@ class Replay:
         self.init_time = time.time()
         # Number of experience collected by agents
         self.cumulative_collected_count = 0
+        # Number of insert_batch() calls
+        self.cumulative_insert_count = 0
         # Number of experience sampled by learner
         self.cumulative_sampled_count = 0
         # Number of sampling requests from the learner
@@ -133,42 +263,119 @@ class Replay:
         self.last_tensorplex_iter_time = time.time()
         # Last reported values used for speed computation
         self.last_experience_count = 0
+        self.last_insert_count = 0
         self.last_sample_count = 0
         self.last_request_count = 0
 
-        self.insert_time = U.TimeRecorder(decay=0.99998)
+        # Time per insert_batch() call
+        self.insert_time = U.TimeRecorder()
         self.sample_time = U.TimeRecorder()
         self.serialize_time = U.TimeRecorder()
+        # Seconds taken by the last snapshot
+        self.last_snapshot_duration = 0.
 
         # moving avrage of about 100s
         self.exp_in_speed = U.MovingAverageRecorder(decay=0.99)
+        self.insert_speed = U.MovingAverageRecorder(decay=0.99)
         self.exp_out_speed = U.MovingAverageRecorder(decay=0.99)
         self.handle_sample_request_speed = U.MovingAverageRecorder(decay=0.99)
 
-    def _insert_wrapper(self, exp):
+    def _insert_batch_wrapper(self, exps):
         """
             Allows us to do some book keeping in the base class
         """
-        self.cumulative_collected_count += 1
+        if self._rate_limiter is not None:
+            self._rate_limiter.await_insert(len(exps))
+        self.cumulative_collected_count += len(exps)
+        self.cumulative_insert_count += 1
         with self.insert_time.time():
-            self.insert(exp)
+            self.insert_batch(exps)
+        with self._insert_condition:
+            self._insert_condition.notify_all()
 
     def _sample_request_handler(self, req):
         """
-        Handle requests to the learner
-        https://stackoverflow.com/questions/29082268/python-time-sleep-vs-event-wait
-        Since we don't have external notify, we'd better just use sleep
+        Handle requests to the learner.
+        A request is either batch_size, answered with one serialized batch,
+        or (batch_size, num_batches), answered with num_batches serialized
+        batches joined by U.join_serialized, so that batches are not
+        serialized a second time.
         """
-        batch_size = U.deserialize(req)
+        request = self._sampling_codec.deserialize(req)
+        if isinstance(request, int):
+            batch_size, num_batches = request, None
+        else:
+            batch_size, num_batches = request
         U.assert_type(batch_size, int)
-        while not self.start_sample_condition():
-            time.sleep(0.01)
-        self.cumulative_sampled_count += batch_size
-        self.cumulative_request_count += 1
+        with self._sample_request_lock:
+            self.cumulative_request_count += 1
+            if num_batches is None:
+                self.cumulative_sampled_count += batch_size
+                return self._next_sample(batch_size)
+            self.cumulative_sampled_count += batch_size * num_batches
+            return U.join_serialized(
+                [self._next_sample(batch_size) for _ in range(num_batches)])
+
+    def _shard_sample_request_handler(self, req):
+        """
+        Handle requests from surreal.distributed.StratifiedSampler.
+        Requests are the same as for _sample_request_handler, replies join
+        the serialized len(self) and the reply of _sample_request_handler
+        with U.join_serialized. The reply is left out when no experience
+        is requested or start_sample_condition() is not met, so that the
+        learner asks other shards instead of waiting.
+        """
+        request = self._sampling_codec.deserialize(req)
+        batch_size = request if isinstance(request, int) else request[0]
+        size = self._sampling_codec.serialize(len(self))
+        if batch_size == 0 or not self.start_sample_condition():
+            return U.join_serialized([size])
+        return U.join_serialized([size, self._sample_request_handler(req)])
+
+    def _wait_sample_condition(self):
+        with self._insert_condition:
+            self._insert_condition.wait_for(self.start_sample_condition)
+
+    def _next_sample(self, batch_size):
+        """
+            Returns a serialized batch, from the sample ahead queue
+            if session_config.replay.sample_ahead_batches is set.
+            The rate limiter is charged here, when the batch is handed
+            to the learner, so batches sampled ahead are not counted
+        """
+        self._wait_sample_condition()
+        if self._rate_limiter is not None:
+            self._rate_limiter.await_sample(batch_size)
+        if self._sample_ahead:
+            if self._sample_ahead_thread is None:
+                self._sample_ahead_batch_size = batch_size
+                self._sample_ahead_thread = U.start_thread(
+                    self._sample_ahead_loop)
+            if batch_size == self._sample_ahead_batch_size:
+                return self._sample_ahead_queue.get()
+        return self._serialized_sample(batch_size)
+
+    def _serialized_sample(self, batch_size):
+        self._wait_sample_condition()
         with self.sample_time.time():
             sample = self.sample(batch_size)
         with self.serialize_time.time():
-            return U.serialize(sample)
+            return self.serialize_sample(sample)
+
+    def serialize_sample(self, sample):
+        """
+            Serializes the return value of sample() for the learner
+        """
+        return self._sampling_codec.serialize(sample)
+
+    def _sample_ahead_loop(self):
+        """
+            Keeps up to sample_ahead_batches batches of the first
+            requested batch size ready
+        """
+        while True:
+            self._sample_ahead_queue.put(
+                self._serialized_sample(self._sample_ahead_batch_size))
 
     def start_evict_thread(self):
         if self._evict_thread is not None:
@@ -182,6 +389,26 @@ class Replay:
             time.sleep(self._evict_interval)
             self.evict()
 
+    def start_snapshot_thread(self):
+        if self._snapshot_thread is not None:
+            raise RuntimeError('snapshot thread already running')
+        self._snapshot_thread = U.start_thread(self._snapshot_loop)
+        return self._snapshot_thread
+
+    def _snapshot_loop(self):
+        assert self._snapshot_interval
+        folder = self._snapshot_folder(self.session_config.folder)
+        while True:
+            time.sleep(self._snapshot_interval)
+            start_time = time.time()
+            self.save_snapshot(folder)
+            self.last_snapshot_duration = time.time() - start_time
+
+    def _snapshot_folder(self, folder):
+        if U.f_last_part_in_path(folder) != 'checkpoint':
+            folder = U.f_join(folder, 'checkpoint')
+        return U.f_join(folder, 'replay_{}'.format(self.index))
+
     def start_tensorplex_thread(self):
         if self._tensorplex_thread is not None:
             raise RuntimeError('tensorplex thread already running')
@@ -202,6 +429,10 @@ class Replay:
         new_exp_count = cum_count_collected - self.last_experience_count
         self.last_experience_count = cum_count_collected
 
+        cum_count_inserts = self.cumulative_insert_count
+        new_insert_count = cum_count_inserts - self.last_insert_count
+        self.last_insert_count = cum_count_inserts
+
         cum_count_sampled = self.cumulative_sampled_count
         new_sample_count = cum_count_sampled - self.last_sample_count
         self.last_sample_count = cum_count_sampled
@@ -211,6 +442,7 @@ class Replay:
         self.last_request_count = cum_count_requests
 
         exp_in_speed = self.exp_in_speed.add_value(new_exp_count / time_elapsed)
+        insert_speed = self.insert_speed.add_value(new_insert_count / time_elapsed)
         exp_out_speed = self.exp_out_speed.add_value(new_sample_count / time_elapsed)
         handle_sample_request_speed = self.handle_sample_request_speed.add_value(
                                                     new_request_count / time_elapsed)
@@ -228,12 +460,14 @@ class Replay:
             'exp_out_per_s': exp_out_speed,
             'requests_per_s': handle_sample_request_speed,
             'insert_time_s': insert_time,
+            'exps_per_insert': new_exp_count / max(new_insert_count, 1),
             'sample_time_s': sample_time,
             'serialize_time_s': serialize_time,
+            'snapshot_time_s': self.last_snapshot_duration,
         }
 
         serialize_load = serialize_time * handle_sample_request_speed / time_elapsed
-        collect_exp_load = insert_time * exp_in_speed / time_elapsed
+        collect_exp_load = insert_time * insert_speed / time_elapsed
         sample_exp_load = sample_time * handle_sample_request_speed / time_elapsed
 
         system_metrics = {
@@ -251,6 +485,35 @@ class Replay:
             all_metrics['.core/' + k] = core_metrics[k]
         for k in system_metrics:
             all_metrics['.system/' + k] = system_metrics[k]
+        storage_metrics = self.storage_metrics()
+        for k in storage_metrics:
+            all_metrics['.storage/' + k] = storage_metrics[k]
+        if self._rate_limiter is not None:
+            for k, v in self._rate_limiter.metrics().items():
+                all_metrics['.rate_limiter/' + k] = v
+        if self._obs_cache:
+            all_metrics.update(self._obs_cache_metrics())
         self.tensorplex.add_scalars(all_metrics, global_step=global_step)
 
         self.last_tensorplex_iter_time = time.time()
+
+    def _obs_cache_metrics(self):
+        """
+            Dedup hit rate and bytes saved by the observation cache,
+            in total and per agent
+        """
+        stats = dict(self._collector_server.obs_cache_stats)
+        objects = sum(s.objects for s in stats.values())
+        hits = sum(s.hits for s in stats.values())
+        metrics = {
+            '.obs_cache/hit_percent': hits / max(objects, 1) * 100,
+            '.obs_cache/bytes_saved':
+                sum(s.bytes_saved for s in stats.values()),
+            '.obs_cache/missed_messages':
+                sum(s.missed_messages for s in stats.values()),
+        }
+        for agent_id, s in stats.items():
+            prefix = '.obs_cache/agent_{}/'.format(agent_id)
+            metrics[prefix + 'hit_percent'] = s.hit_percent
+            metrics[prefix + 'bytes_saved'] = s.bytes_saved
+        return metrics
@@ -0,0 +1,102 @@
+"""
+Compression codecs for observations stored in the replay.
+'zlib' is always available, 'lz4' needs the lz4 package
+and 'zstd' the zstandard package.
+"""
+import numpy as np
+from surreal.session import ConfigError
+
+
+class Codec(object):
+    """
+        Extend this class and register it in CODECS to add a codec.
+        compress() and decompress() are called from several threads.
+    """
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    def __init__(self, level=1):
+        import zlib
+        self._zlib = zlib
+        self.level = level
+
+    def compress(self, data):
+        return self._zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return self._zlib.decompress(data)
+
+
+class Lz4Codec(Codec):
+    def __init__(self):
+        import lz4.frame
+        self._lz4 = lz4.frame
+
+    def compress(self, data):
+        return self._lz4.compress(data)
+
+    def decompress(self, data):
+        return self._lz4.decompress(data)
+
+
+class ZstdCodec(Codec):
+    def __init__(self, level=1):
+        import zstandard
+        self._zstd = zstandard
+        self.level = level
+
+    def compress(self, data):
+        # zstandard contexts are not thread safe, create one per call
+        return self._zstd.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data):
+        return self._zstd.ZstdDecompressor().decompress(data)
+
+
+CODECS = {
+    'zlib': ZlibCodec,
+    'lz4': Lz4Codec,
+    'zstd': ZstdCodec,
+}
+
+
+def make_codec(name):
+    if name not in CODECS:
+        raise ConfigError('unknown codec: {}, available: {}'
+                          .format(name, list(CODECS)))
+    try:
+        return CODECS[name]()
+    except ImportError as e:
+        raise ConfigError('codec {} is not installed: {}'.format(name, e))
+
+
+class CompressedArray(object):
+    """
+        A numpy array compressed with `codec`
+    """
+    __slots__ = ['data', 'shape', 'dtype', 'codec', 'raw_nbytes']
+
+    def __init__(self, array, codec):
+        array = np.ascontiguousarray(array)
+        self.data = codec.compress(array)
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.codec = codec
+        self.raw_nbytes = array.nbytes
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+    def decompress(self):
+        """
+        Returns:
+            read-only numpy array
+        """
+        return np.frombuffer(self.codec.decompress(self.data),
+                             dtype=self.dtype).reshape(self.shape)
@@ -0,0 +1,100 @@
+"""
+Eviction policies decide which experiences leave the replay
+when it runs over its memory budget
+"""
+import numpy as np
+from surreal.session import ConfigError
+
+
+class EvictPolicy(object):
+    """
+        Extend this class and register it in EVICT_POLICIES
+        to add a new policy
+    """
+    requires_priorities = False
+
+    def select(self, storage, num_evict, priorities=None):
+        """
+        Args:
+            storage: replay storage, see surreal.replay.storage
+            num_evict: number of experiences to evict
+            priorities: per-slot priorities for prioritized replays,
+                None otherwise
+
+        Returns:
+            array of at least `num_evict` slot indices to evict
+        """
+        raise NotImplementedError
+
+
+class OldestFirstEvictPolicy(EvictPolicy):
+    def select(self, storage, num_evict, priorities=None):
+        return _smallest(storage.insert_ids, num_evict)
+
+
+class LowestPriorityEvictPolicy(EvictPolicy):
+    requires_priorities = True
+
+    def select(self, storage, num_evict, priorities=None):
+        return _smallest(priorities, num_evict)
+
+
+class FairShareEvictPolicy(EvictPolicy):
+    """
+        Keeps an equal share of the replay for every agent.
+        Agents holding more than their share give up their
+        oldest experiences first.
+    """
+    def select(self, storage, num_evict, priorities=None):
+        agents, agent_index = np.unique(storage.agent_ids,
+                                        return_inverse=True)
+        counts = np.bincount(agent_index)
+        keep = _fair_share(counts, len(storage) - num_evict)
+        # slots sorted by agent, then from oldest to newest
+        order = np.lexsort((storage.insert_ids, agent_index))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        evicted = [order[start:start + count - k]
+                   for start, count, k in zip(starts, counts, keep)]
+        return np.concatenate(evicted)
+
+
+def _smallest(values, n):
+    """
+        Indices of the n smallest values
+    """
+    n = min(n, len(values))
+    if n == len(values):
+        return np.arange(n)
+    return np.argpartition(values, n)[:n]
+
+
+def _fair_share(counts, total):
+    """
+        Water filling: largest cap such that sum(min(counts, cap)) <= total
+
+    Returns:
+        number of experiences to keep for each agent
+    """
+    sorted_counts = np.sort(counts)
+    n_agents = len(counts)
+    below = 0
+    for i, count in enumerate(sorted_counts):
+        if below + count * (n_agents - i) >= total:
+            cap = (total - below) // (n_agents - i)
+            return np.minimum(counts, cap)
+        below += count
+    return counts
+
+
+EVICT_POLICIES = {
+    'oldest': OldestFirstEvictPolicy,
+    'lowest_priority': LowestPriorityEvictPolicy,
+    'fair_share': FairShareEvictPolicy,
+}
+
+
+def make_evict_policy(name):
+    if name not in EVICT_POLICIES:
+        raise ConfigError('unknown evict policy: {}, available: {}'
+                          .format(name, list(EVICT_POLICIES)))
+    return EVICT_POLICIES[name]()
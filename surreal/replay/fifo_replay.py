@@ -1,6 +1,9 @@
 import random
+import time
 from collections import deque
 from .base import Replay
+from surreal.session import ConfigError
+import surreal.utils as U
 
 
 class FIFOReplay(Replay):
@@ -10,6 +13,10 @@ class FIFOReplay(Replay):
     - max_prefetch_queue: to 1
     session_config.sender:
     - flush_iteration: to a small number
+    With session_config.learner.streaming, the learner holds a single
+    request that is answered as soon as batch_size experiences arrived
+    (see surreal.distributed.StreamingDataFetcher) and only the sender
+    settings apply.
     """
     def __init__(self,
                  learner_config,
@@ -22,21 +29,40 @@ class FIFOReplay(Replay):
             session_config=session_config,
             index=index,
         )
+        if self.session_config.learner.stratified_sampling:
+            # experiences popped for a shard request that timed out on
+            # the learner would be lost
+            raise ConfigError('FIFOReplay does not support '
+                              'learner.stratified_sampling')
         self.batch_size = self.learner_config.replay.batch_size
         self.memory_size = self.learner_config.replay.memory_size
+        # (insert time, exp)
         self._memory = deque(maxlen=self.memory_size+3)  # + 3 for a gentle buffering
-        assert self.session_config.replay.max_puller_queue <= 10
-        assert self.session_config.replay.max_prefetch_queue == 1 
+        if not self.session_config.learner.streaming:
+            assert self.session_config.replay.max_puller_queue <= 10
+            assert self.session_config.replay.max_prefetch_queue == 1
         assert not self.session_config.sender.flush_time
         assert self.session_config.sender.flush_iteration <= 10
-
+        if self.session_config.replay.sample_ahead_batches:
+            raise ConfigError('FIFOReplay cannot sample ahead, '
+                              'batches would be stale')
+        # seconds between insert and sample of the sampled experiences
+        self.sample_age = U.MovingAverageRecorder(decay=0.99)
 
     def insert(self, exp_tuple):
-        self._memory.append(exp_tuple)
+        self._memory.append((time.time(), exp_tuple))
+
+    def insert_batch(self, exps):
+        now = time.time()
+        self._memory.extend((now, exp) for exp in exps)
 
     def sample(self, batch_size):
         assert batch_size <= self.memory_size
-        return [self._memory.popleft() for _ in range(batch_size)]
+        items = [self._memory.popleft() for _ in range(batch_size)]
+        now = time.time()
+        self.sample_age.add_value(
+            sum(now - insert_time for insert_time, _ in items) / batch_size)
+        return [exp for _, exp in items]
 
     def evict(self):
         raise NotImplementedError('no support for eviction in FIFO mode')
@@ -44,6 +70,10 @@ class FIFOReplay(Replay):
     def start_sample_condition(self):
         return len(self._memory) >= self.batch_size
 
+    def storage_metrics(self):
+        return {
+            'sample_age_s': self.sample_age.cur_value(),
+        }
+
     def __len__(self):
         return len(self._memory)
-
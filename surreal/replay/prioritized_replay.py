@@ -1,37 +1,73 @@
 # Adapted from https://github.com/openai/baselines
 
+import os
 import numpy as np
-import random
+from .uniform_replay import UniformReplay
+from .segment_tree import SumSegmentTree, MinSegmentTree
+from surreal.distributed import PriorityReceiver
+from surreal.session import ConfigError
+
+
+class PrioritizedReplay(UniformReplay):
+    """
+    Samples experiences proportional to their priority p_i^alpha
+    and returns importance sampling weights with each batch.
+
+    sample() returns
+    {
+        'exps': whatever UniformReplay.sample would return,
+        'priority': {
+            'replay_index': index of this replay shard,
+            'indices': storage indices of the sampled experiences,
+            'insert_ids': insert ids of the sampled experiences,
+            'weights': batch_size * 1 importance sampling weights,
+        }
+    }
+    The learner sends new priorities for 'indices' back through
+    surreal.distributed.PrioritySender along with 'insert_ids', they are
+    applied asynchronously. Updates for slots that were overwritten,
+    moved or freed by eviction since sampling are dropped.
+    """
+    has_priorities = True
 
-from segment_tree import SumSegmentTree, MinSegmentTree
-
-
-class PrioritizedReplay(Replay):
-    
     def __init__(self,
                  learner_config,
                  env_config,
-                 session_config):
+                 session_config,
+                 index=0):
         """
-        Create Prioritized Replay buffer.
-        :param size: int
-            Max number of transitions to store in the buffer. When the buffer
-            overflows the old memories are dropped.
-        :param alpha: float
-            how much prioritization is used
+        Args:
+          alpha: how much prioritization is used
             (0 - no prioritization, 1 - full prioritization)
+          beta: To what degree to use importance weights
+            (0 - no corrections, 1 - full correction)
+          priority_eps: added to all priorities so that
+            no experience has zero probability
         """
-        super(PrioritizedReplayBuffer, self).__init__(
+        super().__init__(
             learner_config=learner_config,
             env_config=env_config,
-            session_config=session_config
+            session_config=session_config,
+            index=index
         )
 
-        self._alpha = self.replay_config.alpha
+        if self.session_config.learner.stratified_sampling:
+            raise ConfigError('stratified sampling merges batches from '
+                              'several shards, priorities are per shard')
+        if self.session_config.replay.shared_memory:
+            raise ConfigError('shared_memory replay samples from every '
+                              'shard, priorities are per shard')
+
+        if self._storage.serialized:
+            raise ConfigError('serialized storage cannot be sent along '
+                              'with priorities')
+
+        self._alpha = self.learner_config.replay.alpha
         assert self._alpha > 0
+        self._beta = self.learner_config.replay.beta
+        assert self._beta >= 0
+        self._priority_eps = self.learner_config.replay.priority_eps
 
-        self._memory = []
-        self.memory_size = self.replay_config.memory_size
         it_capacity = 1
         while it_capacity < self.memory_size:
             it_capacity *= 2
@@ -40,88 +76,94 @@ class PrioritizedReplay(Replay):
         self._it_min = MinSegmentTree(it_capacity)
         self._max_priority = 1.0
 
-    def default_config(self):
-        conf = super().default_config()
-        conf.update({
-            'memory_size': '_int_',
-            'sampling_start_size': '_int_',
-            'alpha': '_float_',
-        })
-        return conf
+        self._priority_receiver = PriorityReceiver(
+            host=os.environ['SYMPH_PRIORITY_UPDATE_HOST'],
+            port=os.environ['SYMPH_PRIORITY_UPDATE_PORT'],
+            replay_index=self.index,
+            handler=self.update_priorities,
+        )
+
+    def start_threads(self):
+        super().start_threads()
+        self._priority_receiver.start()
+
+    def join(self):
+        super().join()
+        self._priority_receiver.join()
 
     def insert(self, exp_dict):
         """
         Adds experience to the replay buffer as usual, but also
         intiialize the priority of the new experience.
         """
-        with self.insert_time.time():
-            if self._next_idx >= len(self._memory):
-                self._memory.append(exp_dict)
-            else:
-                self._memory[self._next_idx] = exp_dict
-            self._next_idx = (self._next_idx + 1) % self.memory_size
-
-            idx = self._next_idx
+        exp_dict = self._storage.encode(exp_dict)
+        with self._lock:
+            idx = self._storage.insert(exp_dict)
             self._it_sum[idx] = self._max_priority ** self._alpha
             self._it_min[idx] = self._max_priority ** self._alpha
+        self._passive_evict()
 
-    def sample(self, batch_size, beta=0):
+    def insert_batch(self, exps):
+        exps = [self._storage.encode(exp_dict) for exp_dict in exps]
+        with self._lock:
+            indices = self._storage.insert_batch(exps)
+            self._it_sum.update(indices, self._max_priority ** self._alpha)
+            self._it_min.update(indices, self._max_priority ** self._alpha)
+        self._passive_evict()
+
+    def sample(self, batch_size):
         """
         WARNING: This function does not make deep copies of the tuple experiences.
                  This means that if any objects in the experiences are modified,
                  the contents of the replay buffer memory will also be modified,
                  so be careful!!!
-        Sample a batch of experiences, along with their importance weights, and the 
+        Sample a batch of experiences, along with their importance weights, and the
         indices of the sampled experiences in the buffer.
-        :param batch_size: int
-            How many transitions to sample.
-        :param beta: float
-            To what degree to use importance weights
-            (0 - no corrections, 1 - full correction)
-        :return experience_batch: List
-            List of tuples, length batch_size, corresponding to the experiences sampled.
-        :return weights: np.array
-            Array of shape (batch_size,) and dtype np.float32
-            denoting importance weight of each sampled transition
-        :return indices: np.array
-            Array of shape (batch_size,) and dtype np.int32
-            indices in buffer of sampled experiences
         """
-        with self.sample_time.time():
-            assert beta >= 0
-
+        with self._lock:
             # sample the experiences proportional to their priorities
-            indices = self._sample_proportional(batch_size)
-            response = [self._storage[idx] for idx in indices]
+            indices = self._redraw_unsampleable(
+                self._sample_proportional(batch_size),
+                self._sample_proportional)
 
             # compute importance weights for the experiences to correct for distribution shift
-            weights = []
-            p_min = self._it_min.min() / self._it_sum.sum()
-            max_weight = (p_min * len(self._storage)) ** (-beta)
-
-            for idx in indices:
-                p_sample = self._it_sum[idx] / self._it_sum.sum()
-                weight = (p_sample * len(self._storage)) ** (-beta)
-                weights.append(weight / max_weight)
-            weights = np.array(weights)
-
-        # return response, weights, indices
-        return response
+            total = self._it_sum.sum()
+            size = len(self._storage)
+            p_min = self._it_min.min() / total
+            max_weight = (p_min * size) ** (-self._beta)
+            p_samples = self._it_sum.get(indices) / total
+            weights = (p_samples * size) ** (-self._beta) / max_weight
+
+            insert_ids = self._storage.insert_ids[indices]
+            if self.aggregate_on_replay:
+                exps = self._storage.gather(indices)
+            else:
+                exps = self._storage.get(indices)
+        if not self.aggregate_on_replay:
+            exps = self._storage.decode(exps)
+        return {
+            'exps': exps,
+            'priority': {
+                'replay_index': self.index,
+                'indices': indices,
+                'insert_ids': insert_ids,
+                'weights': np.expand_dims(weights, axis=1).astype(np.float32),
+            },
+        }
 
     def _sample_proportional(self, batch_size):
         """
-        This is a helper function to sample expriences with probabilities 
+        This is a helper function to sample expriences with probabilities
         proportional to their priorities.
-        Returns a list of indices.
+        Returns an array of indices.
         """
-        res = []
-        for _ in range(batch_size):
-            mass = random.random() * self._it_sum.sum(0, len(self._storage) - 1)
-            idx = self._it_sum.find_prefixsum_idx(mass)
-            res.append(idx)
-        return res
-
-    def update_priorities(self, indices, priorities):
+        total = self._it_sum.sum(0, len(self._storage))
+        masses = np.random.random(batch_size) * total
+        indices = self._it_sum.find_prefixsum_idx(masses)
+        # guard against rounding errors past the last stored experience
+        return np.minimum(indices, len(self._storage) - 1)
+
+    def update_priorities(self, indices, priorities, insert_ids=None):
         """
         Update priorities of sampled transitions.
         sets priority of transition at index indices[i] in buffer
@@ -132,39 +174,61 @@ class PrioritizedReplay(Replay):
             List of updated priorities corresponding to
             transitions at the sampled indices denoted by
             variable `indices`.
+        :param insert_ids: [int]
+            insert ids returned with the sampled transitions, updates
+            for slots that hold another transition by now are dropped.
+            None to update the slots whatever they hold.
         """
+        indices = np.asarray(indices)
+        priorities = np.abs(np.asarray(priorities, dtype=np.float64))
+        priorities = priorities.reshape(-1) + self._priority_eps
         assert len(indices) == len(priorities)
-        for idx, priority in zip(indices, priorities):
-            assert priority > 0
-            assert 0 <= idx < len(self._storage)
-            self._it_sum[idx] = priority ** self._alpha
-            self._it_min[idx] = priority ** self._alpha
-
-            self._max_priority = max(self._max_priority, priority)
-
-    def evict(self):
-        raise NotImplementedError # TODO
-        # if evict_size > len(self._memory):
-        #     evicted = self._memory
-        #     self._memory = []
-        #     self._next_idx = 0
-        #     return evicted
-        # forward_space = len(self._memory) - self._next_idx
-        # if evict_size < forward_space:
-        #     evicted = self._memory[self._next_idx:self._next_idx+evict_size]
-        #     del self._memory[self._next_idx:self._next_idx+evict_size]
-        # else:
-        #     evicted = self._memory[self._next_idx:]
-        #     evict_from_left = evict_size - forward_space
-        #     evicted += self._memory[:evict_from_left]
-        #     del self._memory[self._next_idx:]
-        #     del self._memory[:evict_from_left]
-        #     self._next_idx -= evict_from_left
-        # assert len(evicted) == evict_size
-        # return evicted
-
-    def start_sample_condition(self):
-        return len(self) > self.replay_config.sampling_start_size
-
-    def __len__(self):
-        return len(self._memory)
+        with self._lock:
+            valid = (0 <= indices) & (indices < len(self._storage))
+            if insert_ids is not None:
+                insert_ids = np.asarray(insert_ids)
+                assert len(insert_ids) == len(indices)
+                valid[valid] = (self._storage.insert_ids[indices[valid]]
+                                == insert_ids[valid])
+            indices, priorities = indices[valid], priorities[valid]
+            if len(indices) == 0:
+                return
+            self._it_sum.update(indices, priorities ** self._alpha)
+            self._it_min.update(indices, priorities ** self._alpha)
+
+            self._max_priority = max(self._max_priority, priorities.max())
+
+    def priorities(self):
+        return self._it_sum.get(np.arange(len(self._storage)))
+
+    def _snapshot_columns(self):
+        columns = super()._snapshot_columns()
+        columns['priority'] = self._it_sum.values
+        return columns
+
+    def _snapshot_meta(self):
+        meta = super()._snapshot_meta()
+        meta['max_priority'] = self._max_priority
+        return meta
+
+    def _load_snapshot_columns(self, columns, meta):
+        keep = super()._load_snapshot_columns(columns, meta)
+        priorities = columns['priority'][keep]
+        slots = np.arange(len(keep))
+        self._it_sum.update(slots, priorities)
+        self._it_min.update(slots, priorities)
+        self._max_priority = meta['max_priority']
+        return keep
+
+    def _remove(self, indices):
+        """
+            Moves priorities along with the experiences that storage
+            compacts and clears the freed slots
+        """
+        old_size = len(self._storage)
+        src, dst = self._storage.remove(indices)
+        for tree in (self._it_sum, self._it_min):
+            tree.update(dst, tree.get(src))
+        freed = np.arange(len(self._storage), old_size)
+        self._it_sum.update(freed, 0.0)
+        self._it_min.update(freed, float('inf'))
@@ -0,0 +1,82 @@
+"""
+Keeps the number of times experiences are sampled per inserted
+experience close to a target, by blocking inserts or samples
+"""
+import time
+import threading
+
+
+class RateLimiter(object):
+    """
+        Let d = samples_per_insert * inserted - sampled, counted from the
+        first sample request. An insert waits while d > tolerance, a sample
+        of n experiences waits while d - n < -tolerance.
+
+        A waiting insert blocks the collector thread, the experiences then
+        queue up in the collector socket until agents block in send().
+        A waiting sample delays the reply to the learner.
+        Inserts before the first sample (while the replay fills up to
+        start_sample_condition()) are not counted.
+    """
+    def __init__(self, samples_per_insert, tolerance):
+        """
+        Args:
+            samples_per_insert: target number of sampled experiences
+                per inserted experience
+            tolerance: number of sampled experiences the learner may run
+                ahead of or behind the target, at least the largest
+                sampled batch, otherwise sampling can block forever
+        """
+        assert samples_per_insert > 0
+        assert tolerance > 0
+        self.samples_per_insert = samples_per_insert
+        self.tolerance = tolerance
+        self._condition = threading.Condition()
+        self._started = False
+        self._inserted = 0
+        self._sampled = 0
+        # seconds spent waiting in await_insert() and await_sample()
+        self.insert_wait_time = 0.
+        self.sample_wait_time = 0.
+
+    def await_insert(self, num_exps):
+        with self._condition:
+            if not self._started:
+                return
+            self.insert_wait_time += self._wait_for(
+                lambda: self._deficit() <= self.tolerance)
+            self._inserted += num_exps
+            self._condition.notify_all()
+
+    def await_sample(self, num_exps):
+        with self._condition:
+            self._started = True
+            self.sample_wait_time += self._wait_for(
+                lambda: self._deficit() - num_exps >= -self.tolerance)
+            self._sampled += num_exps
+            self._condition.notify_all()
+
+    def _deficit(self):
+        """
+            Sampled experiences missing to reach the target,
+            negative if the learner samples too much
+        """
+        return self.samples_per_insert * self._inserted - self._sampled
+
+    def _wait_for(self, predicate):
+        """
+        Returns:
+            seconds waited
+        """
+        if predicate():
+            return 0.
+        start = time.time()
+        self._condition.wait_for(predicate)
+        return time.time() - start
+
+    def metrics(self):
+        return {
+            'samples_per_insert': self._sampled / max(self._inserted, 1),
+            'insert_throttled_s': self.insert_wait_time,
+            'sample_throttled_s': self.sample_wait_time,
+        }
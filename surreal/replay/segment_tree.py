@@ -1,6 +1,6 @@
 # Adapted from https://github.com/openai/baselines
 
-import operator
+import numpy as np
 
 
 class SegmentTree(object):
@@ -15,21 +15,24 @@ class SegmentTree(object):
                operation which reduces `operation` over
                a contiguous subsequence of items in the
                array.
+        Node values live in a flat numpy array (root at index 1, leaves at
+        [capacity, 2 * capacity)), so that batched updates and queries
+        walk the tree one level at a time for all indices at once.
         Parameters
         ---------
         capacity: int
             Total size of the array - must be a power of two.
-        operation: lambda obj, obj -> obj
-            an operation for combining elements (eg. sum, max)
+        operation: numpy ufunc
+            an operation for combining elements (eg. np.add, np.minimum)
             must for a mathematical group together with the set of
             possible values for array elements.
-        neutral_element: obj
+        neutral_element: float
             neutral element for the operation above. eg. float('-inf')
             for max and 0 for sum.
         """
         assert capacity > 0 and capacity & (capacity - 1) == 0, "capacity must be positive and a power of 2."
         self._capacity = capacity
-        self._value = [neutral_element for _ in range(2 * capacity)]
+        self._value = np.full(2 * capacity, neutral_element, dtype=np.float64)
         self._operation = operation
 
     def _reduce_helper(self, start, end, node, node_start, node_end):
@@ -51,6 +54,7 @@ class SegmentTree(object):
         """Returns result of applying `self.operation`
         to a contiguous subsequence of the array.
             self.operation(arr[start], operation(arr[start+1], operation(... arr[end])))
+        Reducing over the whole array reads the root in O(1).
         Parameters
         ----------
         start: int
@@ -66,8 +70,41 @@ class SegmentTree(object):
             end = self._capacity
         if end < 0:
             end += self._capacity
+        if start == 0 and end == self._capacity:
+            return float(self._value[1])
         end -= 1
-        return self._reduce_helper(start, end, 1, 0, self._capacity - 1)
+        return float(self._reduce_helper(start, end, 1, 0, self._capacity - 1))
+
+    def update(self, indices, values):
+        """Sets arr[indices[i]] = values[i] for all i and
+        recomputes the affected internal nodes level by level.
+        Parameters
+        ----------
+        indices: array of int
+            leaf indices to set
+        values: array of float or float
+            new values, broadcast against indices
+        """
+        idx = np.asarray(indices, dtype=np.int64) + self._capacity
+        if len(idx) == 0:
+            return
+        self._value[idx] = values
+        idx = np.unique(idx // 2)
+        while idx[0] >= 1:
+            self._value[idx] = self._operation(
+                self._value[2 * idx],
+                self._value[2 * idx + 1]
+            )
+            idx = np.unique(idx // 2)
+
+    @property
+    def values(self):
+        """View of all leaves, arr[0 .. capacity - 1]"""
+        return self._value[self._capacity:]
+
+    def get(self, indices):
+        """Returns arr[indices] for an array of indices"""
+        return self._value[np.asarray(indices, dtype=np.int64) + self._capacity]
 
     def __setitem__(self, idx, val):
         # index of the leaf
@@ -83,14 +120,14 @@ class SegmentTree(object):
 
     def __getitem__(self, idx):
         assert 0 <= idx < self._capacity
-        return self._value[self._capacity + idx]
+        return float(self._value[self._capacity + idx])
 
 
 class SumSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(SumSegmentTree, self).__init__(
             capacity=capacity,
-            operation=operator.add,
+            operation=np.add,
             neutral_element=0.0
         )
 
@@ -104,35 +141,42 @@ class SumSegmentTree(SegmentTree):
         if array values are probabilities, this function
         allows to sample indexes according to the discrete
         probability efficiently.
+        All prefix sums are searched together, one tree level per step.
         Parameters
         ----------
-        perfixsum: float
+        perfixsum: float or np.array of float
             upperbound on the sum of array prefix
         Returns
         -------
-        idx: int
-            highest index satisfying the prefixsum constraint
+        idx: int or np.array of int
+            highest index satisfying the prefixsum constraint,
+            same shape as prefixsum
         """
-        assert 0 <= prefixsum <= self.sum() + 1e-5
-        idx = 1
-        while idx < self._capacity:  # while non-leaf
-            if self._value[2 * idx] > prefixsum:
-                idx = 2 * idx
-            else:
-                prefixsum -= self._value[2 * idx]
-                idx = 2 * idx + 1
-        return idx - self._capacity
+        scalar = np.isscalar(prefixsum)
+        prefixsum = np.array(prefixsum, dtype=np.float64, ndmin=1)
+        assert np.all(prefixsum >= 0)
+        assert np.all(prefixsum <= self.sum() + 1e-5)
+        idx = np.ones(len(prefixsum), dtype=np.int64)
+        while idx[0] < self._capacity:  # while non-leaf
+            left = self._value[2 * idx]
+            go_right = prefixsum >= left
+            prefixsum -= left * go_right
+            idx = 2 * idx + go_right
+        idx -= self._capacity
+        if scalar:
+            return int(idx[0])
+        return idx
 
 
 class MinSegmentTree(SegmentTree):
     def __init__(self, capacity):
         super(MinSegmentTree, self).__init__(
             capacity=capacity,
-            operation=min,
+            operation=np.minimum,
             neutral_element=float('inf')
         )
 
     def min(self, start=0, end=None):
         """Returns min(arr[start], ...,  arr[end])"""
 
-        return super(MinSegmentTree, self).reduce(start, end)
\ No newline at end of file
+        return super(MinSegmentTree, self).reduce(start, end)
@@ -1,10 +1,18 @@
 from multiprocessing import Process
 import os
 from caraml.zmq import ZmqProxyThread
+from .storage import SharedColumnarStorage
 import surreal.utils as U
 
 
 class ShardedReplay(object):
+    """
+        Runs learner_config.replay.replay_shards replay processes behind
+        load balancing collector and sampler proxies.
+        With session_config.replay.shared_memory, the shards store their
+        experiences in one shared memory block allocated here, see
+        surreal.replay.storage.SharedColumnarStorage.
+    """
     def __init__(self,
                  replay_class,
                  learner_config,
@@ -17,6 +25,7 @@ class ShardedReplay(object):
         self.sampler_proxy = None
         self.collector_proxy = None
         self.processes = []
+        self.shared_memory = None
 
         self.learner_config = learner_config
         self.env_config = env_config
@@ -40,6 +49,18 @@ class ShardedReplay(object):
 
         self.processes = []
 
+        if self.session_config.replay.shared_memory:
+            name = 'surreal_replay_{}'.format(os.getpid())
+            self.shared_memory = SharedColumnarStorage.create(
+                name,
+                capacity=self.learner_config.replay.memory_size,
+                num_shards=self.shards,
+                obs_spec=self.env_config.obs_spec,
+                action_spec=self.env_config.action_spec)
+            self.session_config.replay.shared_memory_name = name
+            print('Replay shared memory: {} bytes'.format(
+                self.shared_memory.size))
+
         print('Starting {} replay shards'.format(self.shards))
         for i in range(self.shards):
             print('Replay {} starting'.format(i))
@@ -73,3 +94,6 @@ class ShardedReplay(object):
             U.report_exitcode(p.exitcode, 'replay-{}'.format(i))
         self.collector_proxy.join()
         self.sampler_proxy.join()
+        if self.shared_memory is not None:
+            self.shared_memory.close()
+            self.shared_memory.unlink()
@@ -0,0 +1,73 @@
+"""
+Replay snapshots: every column of a replay is written as one .npy file
+next to a meta.json holding the scalar state. Files are written with
+bulk array copies and read back memory-mapped.
+"""
+import os
+import json
+import shutil
+import numpy as np
+
+
+def save_snapshot(folder, columns, size, meta, lock, chunk_bytes):
+    """
+    Writes columns[name][:size] for every column into folder.
+    Rows are copied out chunk by chunk while holding `lock` and written to
+    disk after releasing it, so writers are only blocked for one memcpy of
+    at most `chunk_bytes`. Every row is consistent, but rows copied late
+    can be newer than `meta`.
+    The previous snapshot in folder is only replaced once the new one is
+    complete.
+
+    Args:
+        folder: snapshot directory
+        columns: {name: array}, first dimension indexes experiences
+        size: number of rows to save
+        meta: json serializable dict saved alongside the columns
+        lock: lock guarding writes to columns
+        chunk_bytes: max number of bytes copied per lock acquisition
+    """
+    tmp_folder = folder + '.tmp'
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+    files = {}
+    for name, column in columns.items():
+        files[name] = np.lib.format.open_memmap(
+            os.path.join(tmp_folder, name + '.npy'), mode='w+',
+            dtype=column.dtype, shape=(size,) + column.shape[1:])
+    row_bytes = sum(column[0].nbytes for column in columns.values())
+    rows_per_chunk = max(1, int(chunk_bytes // max(row_bytes, 1)))
+    for start in range(0, size, rows_per_chunk):
+        end = min(start + rows_per_chunk, size)
+        with lock:
+            chunk = {name: column[start:end].copy()
+                     for name, column in columns.items()}
+        for name in columns:
+            files[name][start:end] = chunk[name]
+    for f in files.values():
+        f.flush()
+    del files
+    meta = dict(meta, size=size, columns=list(columns))
+    with open(os.path.join(tmp_folder, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.rename(tmp_folder, folder)
+
+
+def load_snapshot(folder):
+    """
+    Returns:
+        (columns, meta): columns is {name: read-only memory-mapped array},
+        None if folder does not contain a complete snapshot
+    """
+    meta_file = os.path.join(folder, 'meta.json')
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file) as f:
+        meta = json.load(f)
+    columns = {name: np.load(os.path.join(folder, name + '.npy'),
+                             mmap_mode='r')
+               for name in meta['columns']}
+    return columns, meta
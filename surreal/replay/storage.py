@@ -0,0 +1,1414 @@
+"""
+Storage backends for replay memory.
+A storage holds up to `capacity` experiences and is indexed by
+integer slots in [0, len(storage)). Slots stay contiguous:
+removing experiences moves the last ones into the freed slots.
+"""
+import os
+import sys
+import hashlib
+import weakref
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from surreal.session import ConfigError
+import surreal.utils as U
+from surreal.distributed.codec import make_codec as make_serialization_codec
+from .codec import make_codec, CompressedArray
+
+
+class Storage(object):
+    """
+        Slot bookkeeping shared by all storage backends.
+        For every slot we keep the insertion order and the id of the
+        agent that sent the experience (-1 if unknown), which
+        eviction policies use.
+
+        Subclasses implement _write(), _read(), _move() and _release(),
+        and can override _write_batch() to write several slots at once
+    """
+    # whether columns/snapshot_meta/load_snapshot are implemented
+    supports_snapshot = False
+    # whether remove() is implemented
+    supports_remove = True
+    # whether decode() returns serialized experiences
+    serialized = False
+    # whether len(), get() and gather() may run concurrently with a
+    # writer, without the replay lock, see ColumnarStorage
+    concurrent_reads = False
+
+    def __init__(self, capacity):
+        """
+        Args:
+            capacity: max number of experiences to store.
+                When the buffer overflows the old memories are overwritten
+        """
+        self.capacity = capacity
+        self._size = 0
+        # ring position used once the storage is full
+        self._next_idx = 0
+        # slots from oldest to newest once the storage is full,
+        # None while slots are in insertion order, see remove()
+        self._ring = None
+        self._insert_count = 0
+        self._insert_ids = np.zeros((capacity,), dtype=np.int64)
+        self._agent_ids = np.zeros((capacity,), dtype=np.int32)
+
+    def insert(self, exp_dict):
+        """
+        Returns:
+            index of the slot the experience is written to
+        """
+        idx = self._next_slots(1)[0]
+        self._write(idx, exp_dict)
+        self._insert_ids[idx] = self._insert_count
+        self._agent_ids[idx] = exp_dict.get('agent_id', -1)
+        self._insert_count += 1
+        return idx
+
+    def insert_batch(self, exp_dicts):
+        """
+            Inserts a list of experiences, claiming their slots and
+            updating the bookkeeping once per batch
+
+        Returns:
+            indices of the slots the experiences are written to
+        """
+        slots = [np.zeros((0,), dtype=np.int64)]
+        for start in range(0, len(exp_dicts), self.capacity):
+            chunk = exp_dicts[start:start + self.capacity]
+            indices = self._next_slots(len(chunk))
+            self._write_batch(indices, chunk)
+            self._insert_ids[indices] = \
+                self._insert_count + np.arange(len(chunk))
+            self._agent_ids[indices] = [exp_dict.get('agent_id', -1)
+                                        for exp_dict in chunk]
+            self._insert_count += len(chunk)
+            slots.append(indices)
+        return np.concatenate(slots)
+
+    def _next_slots(self, n):
+        """
+            Claims n slots, appending while there is room and
+            overwriting the oldest slots in ring order after that
+        """
+        assert n <= self.capacity
+        n_append = min(n, self.capacity - self._size)
+        appended = np.arange(self._size, self._size + n_append)
+        self._size += n_append
+        overwritten = (self._next_idx
+                       + np.arange(n - n_append)) % self.capacity
+        if self._ring is not None:
+            overwritten = self._ring[overwritten]
+        self._next_idx = (self._next_idx + n - n_append) % self.capacity
+        for idx in overwritten:
+            self._release(idx)
+        return np.concatenate([appended, overwritten])
+
+    def get(self, indices):
+        """
+        Returns:
+            a list of exp dicts at `indices`, pass them through decode()
+        """
+        return [self._read(i) for i in indices]
+
+    def sampleable(self, indices):
+        """
+        Returns:
+            bool mask of the slots in `indices` that can be sampled
+        """
+        return np.ones(len(indices), dtype=bool)
+
+    def encode(self, exp_dict):
+        """
+            Transforms an experience before insert(). Replays call it
+            without holding their lock, so it can be expensive
+        """
+        return exp_dict
+
+    def decode(self, exps):
+        """
+            Inverse of encode() for a list of experiences returned by get().
+            Replays call it without holding their lock
+        """
+        return exps
+
+    def remove(self, indices):
+        """
+        Removes the experiences at `indices`. Experiences in the last slots
+        are moved into the freed slots so that storage stays contiguous.
+
+        Returns:
+            (src, dst): arrays of slot indices, the experience at src[i]
+            is now at dst[i]
+        """
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        new_size = self._size - len(indices)
+        for idx in indices:
+            self._release(idx)
+        dst = indices[indices < new_size]
+        tail = np.arange(new_size, self._size)
+        src = np.setdiff1d(tail, indices, assume_unique=True)
+        assert len(src) == len(dst)
+        if len(src) > 0:
+            self._move(src, dst)
+            self._insert_ids[dst] = self._insert_ids[src]
+            self._agent_ids[dst] = self._agent_ids[src]
+        self._size = new_size
+        self._reset_ring()
+        return src, dst
+
+    def _reset_ring(self):
+        """
+            Restarts the ring at the oldest experience. Slots moved by
+            remove() are no longer in insertion order, the ring visits
+            them by insert id, then the slots that are still free
+        """
+        order = np.argsort(self._insert_ids[:self._size], kind='stable')
+        if np.all(order == np.arange(self._size)):
+            self._ring = None
+        else:
+            self._ring = np.concatenate(
+                [order, np.arange(self._size, self.capacity)])
+        self._next_idx = 0
+
+    @property
+    def insert_ids(self):
+        """
+            Insertion order of the stored experiences, smaller is older
+        """
+        return self._insert_ids[:self._size]
+
+    @property
+    def agent_ids(self):
+        return self._agent_ids[:self._size]
+
+    @property
+    def bytes_used(self):
+        """
+            Bytes of memory held by the stored experiences
+        """
+        raise NotImplementedError
+
+    def metrics(self):
+        return {
+            'bytes_used': self.bytes_used,
+            'bytes_per_exp': self.bytes_used / max(self._size, 1),
+        }
+
+    def _write(self, idx, exp_dict):
+        raise NotImplementedError
+
+    def _write_batch(self, indices, exp_dicts):
+        for idx, exp_dict in zip(indices, exp_dicts):
+            self._write(idx, exp_dict)
+
+    def _read(self, idx):
+        raise NotImplementedError
+
+    def _move(self, src, dst):
+        raise NotImplementedError
+
+    def _release(self, idx):
+        """
+            Called before the experience at idx is overwritten or removed
+        """
+        pass
+
+    def __len__(self):
+        return self._size
+
+
+class ListStorage(Storage):
+    """
+        Keeps every experience dict as is in a python list.
+        Works for any experience format.
+
+        Memory is accounted per distinct numpy array, so that observations
+        shared between experiences (deduplicated by
+        ExperienceCollectorServer) are only counted once.
+    """
+    def __init__(self, capacity):
+        super().__init__(capacity)
+        self._memory = []
+        # id(array) -> [reference count, nbytes]
+        self._array_refs = {}
+        self._bytes_used = 0
+
+    def _write(self, idx, exp_dict):
+        if idx == len(self._memory):
+            self._memory.append(exp_dict)
+        else:
+            self._memory[idx] = exp_dict
+        for array in _iter_arrays(exp_dict):
+            ref = self._array_refs.get(id(array))
+            if ref is None:
+                self._array_refs[id(array)] = [1, array.nbytes]
+                self._bytes_used += array.nbytes
+            else:
+                ref[0] += 1
+
+    def _release(self, idx):
+        for array in _iter_arrays(self._memory[idx]):
+            ref = self._array_refs[id(array)]
+            ref[0] -= 1
+            if ref[0] == 0:
+                del self._array_refs[id(array)]
+                self._bytes_used -= ref[1]
+
+    def _read(self, idx):
+        return self._memory[idx]
+
+    def _move(self, src, dst):
+        for s, d in zip(src, dst):
+            self._memory[d] = self._memory[s]
+
+    def remove(self, indices):
+        src, dst = super().remove(indices)
+        del self._memory[self._size:]
+        return src, dst
+
+    @property
+    def bytes_used(self):
+        return self._bytes_used
+
+
+class CompressedListStorage(ListStorage):
+    """
+        ListStorage that compresses uint8 observation arrays (pixels)
+        under 'obs' and 'obs_next' with a codec from surreal.replay.codec.
+        Arrays shared between experiences are compressed once.
+        decode() decompresses the sampled arrays on a thread pool.
+    """
+    def __init__(self, capacity, codec, decompress_threads):
+        """
+        Args:
+            codec: name of the codec, see surreal.replay.codec.CODECS
+            decompress_threads: size of the decompression thread pool
+        """
+        super().__init__(capacity)
+        self.codec = make_codec(codec)
+        self._pool = ThreadPoolExecutor(max_workers=decompress_threads)
+        # id(array) -> CompressedArray for arrays that are still alive
+        self._compressed = {}
+        # memory of the distinct CompressedArrays stored,
+        # before and after compression
+        self._raw_bytes_used = 0
+        self._compressed_bytes_used = 0
+        self.compress_time = U.TimeRecorder()
+        self.decompress_time = U.TimeRecorder()
+
+    def encode(self, exp_dict):
+        with self.compress_time.time():
+            exp_dict = dict(exp_dict)
+            for key in ('obs', 'obs_next'):
+                if key in exp_dict:
+                    exp_dict[key] = self._compress_nested(exp_dict[key])
+        return exp_dict
+
+    def _compress_nested(self, obj):
+        if isinstance(obj, dict):
+            return obj.__class__((k, self._compress_nested(v))
+                                 for k, v in obj.items())
+        elif isinstance(obj, (list, tuple)):
+            return obj.__class__(self._compress_nested(v) for v in obj)
+        elif isinstance(obj, np.ndarray) and obj.dtype == np.uint8:
+            key = id(obj)
+            compressed = self._compressed.get(key)
+            if compressed is None:
+                compressed = CompressedArray(obj, self.codec)
+                self._compressed[key] = compressed
+                weakref.finalize(obj, self._compressed.pop, key, None)
+            return compressed
+        return obj
+
+    def decode(self, exps):
+        with self.decompress_time.time():
+            blobs = {}
+            for exp in exps:
+                for blob in _iter_compressed(exp):
+                    blobs[id(blob)] = blob
+            arrays = dict(zip(blobs, self._pool.map(
+                CompressedArray.decompress, blobs.values())))
+            return [_decompress_nested(exp, arrays) for exp in exps]
+
+    def _write(self, idx, exp_dict):
+        new_blobs = {id(blob): blob for blob in _iter_compressed(exp_dict)
+                     if id(blob) not in self._array_refs}
+        super()._write(idx, exp_dict)
+        for blob in new_blobs.values():
+            self._raw_bytes_used += blob.raw_nbytes
+            self._compressed_bytes_used += blob.nbytes
+
+    def _release(self, idx):
+        blobs = {id(blob): blob
+                 for blob in _iter_compressed(self._memory[idx])}
+        super()._release(idx)
+        for key, blob in blobs.items():
+            if key not in self._array_refs:
+                self._raw_bytes_used -= blob.raw_nbytes
+                self._compressed_bytes_used -= blob.nbytes
+
+    def metrics(self):
+        metrics = super().metrics()
+        metrics['compression_ratio'] = \
+            self._raw_bytes_used / max(self._compressed_bytes_used, 1)
+        metrics['compress_time_s'] = self.compress_time.avg
+        metrics['decompress_time_s'] = self.decompress_time.avg
+        return metrics
+
+
+class SerializedListStorage(ListStorage):
+    """
+        ListStorage that keeps every experience in serialized form,
+        serialized once by encode(). decode() returns the serialized
+        experiences, replays join them into the sample reply with
+        U.join_serialized instead of serializing the batch again, the
+        learner gets the usual list of exp dicts from the deserialize()
+        of the sampling codec (see surreal.distributed.codec).
+
+        Observations shared between experiences are stored once per
+        experience.
+    """
+    serialized = True
+
+    def __init__(self, capacity, serializer=U.serialize):
+        """
+        Args:
+            serializer: serialize() of the sampling codec
+        """
+        super().__init__(capacity)
+        self.serializer = serializer
+        self.encode_time = U.TimeRecorder()
+
+    def encode(self, exp_dict):
+        with self.encode_time.time():
+            return {
+                'agent_id': exp_dict.get('agent_id', -1),
+                'binary': self.serializer(exp_dict),
+            }
+
+    def decode(self, exps):
+        return [exp['binary'] for exp in exps]
+
+    def _write(self, idx, exp_dict):
+        if idx == len(self._memory):
+            self._memory.append(exp_dict)
+        else:
+            self._memory[idx] = exp_dict
+        self._bytes_used += len(exp_dict['binary'])
+
+    def _release(self, idx):
+        self._bytes_used -= len(self._memory[idx]['binary'])
+
+    def metrics(self):
+        metrics = super().metrics()
+        metrics['encode_time_s'] = self.encode_time.avg
+        return metrics
+
+
+class ColumnarStorage(Storage):
+    """
+        Preallocates one numpy ring buffer per leaf of the experiences sent
+        by ExpSenderWrapperSSAR and writes incoming experiences in place:
+        {
+            obs = capacity * observation  (one array per modality/key)
+            obs_next = capacity * next_observation
+            action = capacity * action
+            reward = capacity
+            done = capacity
+        }
+        Pixel observations are stored as uint8, everything else as float32.
+        Frame lists sent with `frame_stack_concatenate_on_env=False` are
+        concatenated on insert, so that obs_spec describes the stored shape.
+        `info` is not stored.
+
+        Writers (insert, extend, remove, load_snapshot) must not run
+        concurrently, replays serialize them with their lock. Readers do
+        not need the lock:
+        - every row has a sequence number that writers increment before
+          and after writing the row, it is odd while the row is written
+        - len() is only published once the rows below it are written
+        - gather() and get() copy the rows, then copy again the rows whose
+          sequence number was odd or changed during the copy
+        So a reader always returns complete experiences that were stored
+        at some point during its call. A reader that races with remove()
+        can return an experience that was evicted meanwhile.
+    """
+    supports_snapshot = True
+    concurrent_reads = True
+
+    def __init__(self, capacity, obs_spec, action_spec):
+        """
+        Args:
+            capacity: max number of experiences to store.
+                When the buffer overflows the old memories are overwritten
+            obs_spec: env_config.obs_spec, {modality: {key: shape}}
+            action_spec: env_config.action_spec, {'type': .., 'dim': ..}
+        """
+        super().__init__(capacity)
+        self.obs_spec = obs_spec
+        self.action_spec = action_spec
+
+        self._obs_keys = [(modality, key)
+                          for modality in obs_spec
+                          for key in obs_spec[modality]]
+        self._obs = {}
+        self._obs_next = {}
+        for modality, key in self._obs_keys:
+            shape = (capacity,) + tuple(obs_spec[modality][key])
+            dtype = np.uint8 if modality == 'pixel' else np.float32
+            self._obs[modality, key] = self._allocate(
+                'obs.{}.{}'.format(modality, key), shape, dtype)
+            self._obs_next[modality, key] = self._allocate(
+                'obs_next.{}.{}'.format(modality, key), shape, dtype)
+
+        if action_spec['type'] == 'continuous':
+            action_shape = (capacity,) + tuple(action_spec['dim'])
+            action_dtype = np.float32
+        elif action_spec['type'] == 'discrete':
+            action_shape = (capacity,)
+            action_dtype = np.int32
+        else:
+            raise NotImplementedError('action_spec unsupported '
+                                      + str(action_spec))
+        self._action = self._allocate('action', action_shape, action_dtype)
+        self._reward = self._allocate('reward', (capacity,), np.float32)
+        self._done = self._allocate('done', (capacity,), np.float32)
+        # odd while the row is being written
+        self._seq = self._allocate('seq', (capacity,), np.int64)
+        # size readers without the replay lock sample from
+        self._published_size = 0
+        # rows copied again because they were written during gather()
+        self.cumulative_torn_reads = 0
+
+    @staticmethod
+    def bytes_per_exp_for(obs_spec, action_spec):
+        """
+            Bytes taken by one experience, without allocating the storage
+        """
+        total = 0
+        for modality in obs_spec:
+            itemsize = 1 if modality == 'pixel' else 4
+            for key in obs_spec[modality]:
+                total += 2 * itemsize * int(np.prod(obs_spec[modality][key]))
+        if action_spec['type'] == 'continuous':
+            total += 4 * int(np.prod(action_spec['dim']))
+        else:
+            total += 4
+        # reward, done, insert id, agent id and sequence number
+        return total + 4 + 4 + 8 + 4 + 8
+
+    def _allocate(self, name, shape, dtype):
+        """
+            Creates the array backing one column
+        """
+        return np.zeros(shape, dtype=dtype)
+
+    def _all_columns(self):
+        columns = [self._action, self._reward, self._done]
+        for modality, key in self._obs_keys:
+            columns.append(self._obs[modality, key])
+            columns.append(self._obs_next[modality, key])
+        return columns
+
+    def insert(self, exp_dict):
+        idx = super().insert(exp_dict)
+        self._publish()
+        return idx
+
+    def insert_batch(self, exp_dicts):
+        indices = super().insert_batch(exp_dicts)
+        self._publish()
+        return indices
+
+    def remove(self, indices):
+        src, dst = super().remove(indices)
+        self._publish()
+        return src, dst
+
+    def _publish(self):
+        """
+            Makes the rows written so far visible to len()
+        """
+        self._published_size = self._size
+
+    def _write(self, idx, exp_dict):
+        self._seq[idx] += 1
+        obs, obs_next = exp_dict['obs']
+        for modality, key in self._obs_keys:
+            self._obs[modality, key][idx] = _leaf(obs[modality][key])
+            self._obs_next[modality, key][idx] = \
+                _leaf(obs_next[modality][key])
+        self._action[idx] = exp_dict['action']
+        self._reward[idx] = exp_dict['reward']
+        self._done[idx] = float(exp_dict['done'])
+        self._seq[idx] += 1
+
+    def _write_batch(self, indices, exp_dicts):
+        """
+            One fancy-indexed assignment per column
+        """
+        self._seq[indices] += 1
+        for modality, key in self._obs_keys:
+            self._obs[modality, key][indices] = \
+                [_leaf(exp_dict['obs'][0][modality][key])
+                 for exp_dict in exp_dicts]
+            self._obs_next[modality, key][indices] = \
+                [_leaf(exp_dict['obs'][1][modality][key])
+                 for exp_dict in exp_dicts]
+        self._action[indices] = [exp_dict['action'] for exp_dict in exp_dicts]
+        self._reward[indices] = [exp_dict['reward'] for exp_dict in exp_dicts]
+        self._done[indices] = [float(exp_dict['done'])
+                               for exp_dict in exp_dicts]
+        self._seq[indices] += 1
+
+    def _move(self, src, dst):
+        self._seq[dst] += 1
+        for column in self._all_columns():
+            column[dst] = column[src]
+        self._seq[dst] += 1
+
+    def extend(self, batch, insert_ids=None, agent_ids=None):
+        """
+        Writes a batch of experiences with one vectorized write per column
+
+        Args:
+            batch: batched arrays in the format returned by gather()
+            insert_ids: insertion order to record for the batch,
+                defaults to continuing this storage's insertion count
+            agent_ids: sending agent of each experience, defaults to -1
+
+        Returns:
+            slot indices the batch is written to
+        """
+        n = len(batch['rewards'])
+        indices = self._next_slots(n)
+        self._seq[indices] += 1
+        for modality, key in self._obs_keys:
+            self._obs[modality, key][indices] = batch['obs'][modality][key]
+            self._obs_next[modality, key][indices] = \
+                batch['obs_next'][modality][key]
+        self._action[indices] = batch['actions']
+        self._reward[indices] = np.reshape(batch['rewards'], -1)
+        self._done[indices] = np.reshape(batch['dones'], -1)
+        self._seq[indices] += 1
+        if insert_ids is None:
+            insert_ids = self._insert_count + np.arange(n)
+        self._insert_ids[indices] = insert_ids
+        self._insert_count = max(self._insert_count, int(np.max(insert_ids)) + 1)
+        self._agent_ids[indices] = -1 if agent_ids is None else agent_ids
+        self._publish()
+        return indices
+
+    def gather(self, indices):
+        """
+        Gathers the experiences at `indices` with fancy indexing,
+        rows written meanwhile are gathered again
+
+        Args:
+            indices: int array of shape (batch_size,)
+
+        Returns:
+            batched arrays in the format of SSARAggregator.aggregate()
+        """
+        return self._gather_consistent(np.asarray(indices, dtype=np.int64),
+                                       self._seq)
+
+    def get(self, indices):
+        return split_batch(self.gather(indices))
+
+    def _gather_consistent(self, rows, seq):
+        """
+            _gather_rows(rows), copying again the rows whose sequence
+            number in `seq` was odd or changed during the copy
+        """
+        batch = None
+        pending = np.arange(len(rows))
+        while batch is None or len(pending) > 0:
+            before = seq[rows[pending]]
+            part = self._gather_rows(rows[pending])
+            after = seq[rows[pending]]
+            torn = (before != after) | (before % 2 == 1)
+            if batch is None:
+                batch = part
+            else:
+                _set_rows(batch, pending, part)
+            pending = pending[torn]
+            self.cumulative_torn_reads += len(pending)
+        return batch
+
+    def _gather_rows(self, rows):
+        obs = collections.OrderedDict()
+        obs_next = collections.OrderedDict()
+        for modality, key in self._obs_keys:
+            if modality not in obs:
+                obs[modality] = collections.OrderedDict()
+                obs_next[modality] = collections.OrderedDict()
+            obs[modality][key] = self._obs[modality, key][rows]
+            obs_next[modality][key] = self._obs_next[modality, key][rows]
+        return {
+            'obs': obs,
+            'obs_next': obs_next,
+            'actions': self._action[rows],
+            'rewards': self._reward[rows, None],
+            'dones': self._done[rows, None],
+        }
+
+    @property
+    def columns(self):
+        """
+            {name: array} of every per-slot array, including bookkeeping
+        """
+        columns = collections.OrderedDict()
+        for modality, key in self._obs_keys:
+            columns['obs.{}.{}'.format(modality, key)] = \
+                self._obs[modality, key]
+            columns['obs_next.{}.{}'.format(modality, key)] = \
+                self._obs_next[modality, key]
+        columns['action'] = self._action
+        columns['reward'] = self._reward
+        columns['done'] = self._done
+        columns['insert_ids'] = self._insert_ids
+        columns['agent_ids'] = self._agent_ids
+        return columns
+
+    def snapshot_meta(self):
+        return {
+            'insert_count': self._insert_count,
+        }
+
+    def load_snapshot(self, columns, meta):
+        """
+        Fills the storage from arrays saved from `columns`.
+        If the snapshot holds more experiences than capacity,
+        the newest ones are kept.
+
+        Args:
+            columns: {name: array}, see surreal.replay.snapshot
+            meta: snapshot_meta() of the saved storage plus its 'size'
+
+        Returns:
+            indices of the loaded rows in the snapshot, in slot order
+        """
+        missing = set(self.columns) - set(columns)
+        if missing:
+            raise ValueError('snapshot does not match obs_spec/action_spec, '
+                             'missing columns: {}'.format(sorted(missing)))
+        size = meta['size']
+        if size > self.capacity:
+            keep = np.sort(np.argsort(columns['insert_ids'][:size])
+                           [-self.capacity:])
+        else:
+            keep = np.arange(size)
+        self._size = len(keep)
+        self._seq += 1
+        for name, column in self.columns.items():
+            if len(keep) == size:
+                column[:self._size] = columns[name][:size]
+            else:
+                column[:self._size] = columns[name][keep]
+        self._seq += 1
+        # rows are copied after meta was taken and can be newer
+        self._insert_count = max(meta['insert_count'],
+                                 int(self._insert_ids[:self._size].max(
+                                     initial=-1)) + 1)
+        # the ring continues at the oldest loaded experience
+        self._reset_ring()
+        self._publish()
+        return keep
+
+    @property
+    def nbytes(self):
+        """
+            Total bytes preallocated by the ring buffers
+        """
+        total = (self._insert_ids.nbytes + self._agent_ids.nbytes
+                 + self._seq.nbytes)
+        for column in self._all_columns():
+            total += column.nbytes
+        return total
+
+    @property
+    def bytes_per_exp(self):
+        return self.nbytes / self.capacity
+
+    @property
+    def bytes_used(self):
+        return self.bytes_per_exp * self._size
+
+    def metrics(self):
+        return {
+            'bytes_per_exp': self.bytes_per_exp,
+            'bytes_used': self.bytes_used,
+            'bytes_allocated': self.nbytes,
+            'torn_reads': self.cumulative_torn_reads,
+        }
+
+    def __len__(self):
+        return self._published_size
+
+
+class FramePool(object):
+    """
+        Preallocated uint8 arrays holding each distinct frame once.
+        Frames are identified by content and reference counted,
+        a frame's slot is freed once no experience refers to it.
+        When it runs out of slots, the pool grows by another chunk of
+        chunk_size frames, frames already stored are not copied.
+    """
+    def __init__(self, frame_shape, chunk_size):
+        self.frame_shape = tuple(frame_shape)
+        self.chunk_size = chunk_size
+        # slot i is frame i % chunk_size of chunk i // chunk_size
+        self._chunks = []
+        self._refcounts = np.zeros((0,), dtype=np.int64)
+        self._free = []
+        # content digest -> slot, and slot -> content digest
+        self._slots = {}
+        self._digests = []
+        self._grow()
+
+    def add(self, frame):
+        """
+        Returns:
+            slot of the frame, with its reference count incremented
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        digest = hashlib.blake2b(frame, digest_size=16).digest()
+        slot = self._slots.get(digest)
+        if slot is None:
+            if not self._free:
+                self._grow()
+            slot = self._free.pop()
+            chunk, offset = divmod(slot, self.chunk_size)
+            self._chunks[chunk][offset] = frame
+            self._slots[digest] = slot
+            self._digests[slot] = digest
+        self._refcounts[slot] += 1
+        return slot
+
+    def release(self, slots):
+        for slot in slots:
+            self._refcounts[slot] -= 1
+            if self._refcounts[slot] == 0:
+                del self._slots[self._digests[slot]]
+                self._digests[slot] = None
+                self._free.append(slot)
+
+    def take(self, slots):
+        """
+        Returns:
+            frames at `slots`, of shape slots.shape + frame_shape
+        """
+        slots = np.asarray(slots)
+        if len(self._chunks) == 1:
+            return self._chunks[0][slots]
+        frames = np.empty(slots.shape + self.frame_shape, dtype=np.uint8)
+        chunks, offsets = np.divmod(slots, self.chunk_size)
+        for chunk in np.unique(chunks):
+            mask = chunks == chunk
+            frames[mask] = self._chunks[chunk][offsets[mask]]
+        return frames
+
+    def _grow(self):
+        start = len(self._chunks) * self.chunk_size
+        self._chunks.append(np.zeros((self.chunk_size,) + self.frame_shape,
+                                     dtype=np.uint8))
+        # bookkeeping is 8 bytes per frame, cheap to copy
+        self._refcounts = np.concatenate(
+            [self._refcounts, np.zeros((self.chunk_size,), dtype=np.int64)])
+        self._digests.extend([None] * self.chunk_size)
+        self._free.extend(range(start + self.chunk_size - 1, start - 1, -1))
+
+    @property
+    def num_frames(self):
+        return len(self._slots)
+
+    @property
+    def bytes_used(self):
+        return self.num_frames * int(np.prod(self.frame_shape))
+
+    @property
+    def nbytes(self):
+        return (sum(chunk.nbytes for chunk in self._chunks)
+                + self._refcounts.nbytes)
+
+
+class FrameDedupStorage(ColumnarStorage):
+    """
+        ColumnarStorage that keeps every distinct pixel frame once in a
+        FramePool per pixel key. obs and obs_next columns of pixel keys
+        hold frame_stacks references into the pool instead of stacked
+        frames, consecutive experiences share most of their frames.
+        Stacks are reassembled with one vectorized gather per key and
+        pool chunk.
+
+        Frames are split off the stack along the channel axis, so both
+        frame lists and concatenated stacks are accepted.
+        Pool slots are reused without sequence numbers, so reads need
+        the replay lock.
+    """
+    supports_snapshot = False
+    concurrent_reads = False
+
+    def __init__(self, capacity, obs_spec, action_spec,
+                 frame_stacks, frames_per_exp):
+        """
+        Args:
+            frame_stacks: env_config.frame_stacks, frames per observation
+            frames_per_exp: pool chunk size per experience, the pool
+                grows by a chunk when experiences share fewer frames
+                than this
+        """
+        self.frame_stacks = frame_stacks
+        self._pools = {}
+        for key, shape in obs_spec.get('pixel', {}).items():
+            channels, height, width = shape
+            if channels % frame_stacks != 0:
+                raise ConfigError('pixel/{} has {} channels, not divisible '
+                                  'by frame_stacks {}'
+                                  .format(key, channels, frame_stacks))
+            frame_shape = (channels // frame_stacks, height, width)
+            chunk_size = max(int(capacity * frames_per_exp), 1)
+            self._pools[key] = FramePool(frame_shape, chunk_size)
+        super().__init__(capacity, obs_spec, action_spec)
+
+    def _allocate(self, name, shape, dtype):
+        if name.startswith(('obs.pixel.', 'obs_next.pixel.')):
+            # frame references of a pixel observation
+            return np.zeros(shape[:1] + (self.frame_stacks,), dtype=np.int64)
+        return super()._allocate(name, shape, dtype)
+
+    def _pixel_keys(self):
+        return [key for modality, key in self._obs_keys if modality == 'pixel']
+
+    def _add_stack(self, key, stack):
+        pool = self._pools[key]
+        if isinstance(stack, (list, tuple)):
+            frames = stack
+        else:
+            frames = np.reshape(stack, (self.frame_stacks,)
+                                + pool.frame_shape)
+        return [pool.add(frame) for frame in frames]
+
+    def _write(self, idx, exp_dict):
+        obs, obs_next = exp_dict['obs']
+        for key in self._pixel_keys():
+            self._obs['pixel', key][idx] = \
+                self._add_stack(key, obs['pixel'][key])
+            self._obs_next['pixel', key][idx] = \
+                self._add_stack(key, obs_next['pixel'][key])
+        for modality, key in self._obs_keys:
+            if modality != 'pixel':
+                self._obs[modality, key][idx] = _leaf(obs[modality][key])
+                self._obs_next[modality, key][idx] = \
+                    _leaf(obs_next[modality][key])
+        self._action[idx] = exp_dict['action']
+        self._reward[idx] = exp_dict['reward']
+        self._done[idx] = float(exp_dict['done'])
+
+    def _write_batch(self, indices, exp_dicts):
+        # frames are deduplicated one stack at a time
+        for idx, exp_dict in zip(indices, exp_dicts):
+            self._write(idx, exp_dict)
+
+    def _release(self, idx):
+        if idx >= self._size:
+            return
+        for key in self._pixel_keys():
+            self._pools[key].release(self._obs['pixel', key][idx])
+            self._pools[key].release(self._obs_next['pixel', key][idx])
+
+    def extend(self, batch, insert_ids=None, agent_ids=None):
+        raise NotImplementedError('FrameDedupStorage only supports insert()')
+
+    def _frames(self, key, refs):
+        """
+            Gathers stacks of shape refs.shape[:-1] + (C, H, W)
+        """
+        frames = self._pools[key].take(refs)
+        return frames.reshape(refs.shape[:-1] + (-1,) + frames.shape[-2:])
+
+    def gather(self, indices):
+        batch = super().gather(indices)
+        for key in self._pixel_keys():
+            batch['obs']['pixel'][key] = self._frames(
+                key, batch['obs']['pixel'][key])
+            batch['obs_next']['pixel'][key] = self._frames(
+                key, batch['obs_next']['pixel'][key])
+        return batch
+
+    @property
+    def bytes_used(self):
+        row_bytes = sum(column[0].nbytes for column in self.columns.values())
+        return (row_bytes * len(self)
+                + sum(pool.bytes_used for pool in self._pools.values()))
+
+    @property
+    def nbytes(self):
+        return (super().nbytes
+                + sum(pool.nbytes for pool in self._pools.values()))
+
+    def metrics(self):
+        metrics = Storage.metrics(self)
+        metrics['bytes_allocated'] = self.nbytes
+        for key, pool in self._pools.items():
+            metrics['unique_frames/' + key] = pool.num_frames
+        return metrics
+
+
+class NStepColumnarStorage(ColumnarStorage):
+    """
+        ColumnarStorage of single step transitions that computes n-step
+        transitions at sample time, so agents do not need
+        ExpSenderWrapperSSARNStepBootstrap. Snapshots are not supported,
+        the links do not survive reordering on restore.
+
+        Every slot links to the slot holding the next transition of the
+        same agent, unless the episode ended. gather() follows the links
+        n_step - 1 times for all indices at once and returns
+        {
+            obs: obs of the sampled transition
+            obs_next: obs_next of the transition n_step - 1 steps later
+            rewards: sum_k gamma^k * reward_k
+            dones: whether the episode ended within the n steps
+        }
+        Near the end of an episode, the return is truncated at the last
+        step and done is set. Transitions that do not have n_step - 1
+        successors yet are not sampleable. Every step of an agent must
+        reach this storage in order, so make_storage() requires a single
+        replay shard.
+    """
+    def __init__(self, capacity, obs_spec, action_spec, n_step, gamma):
+        super().__init__(capacity, obs_spec, action_spec)
+        self.n_step = n_step
+        self.gamma = gamma
+        self._successors = np.full((capacity,), -1, dtype=np.int64)
+        # agent id -> (slot, insert id) of its last transition,
+        # None if that transition ended the episode
+        self._last_transition = {}
+
+    supports_snapshot = False
+    supports_remove = False
+    # gather() follows links that writers update
+    concurrent_reads = False
+
+    def insert(self, exp_dict):
+        agent_id = exp_dict.get('agent_id', -1)
+        idx = super().insert(exp_dict)
+        self._successors[idx] = -1
+        last = self._last_transition.get(agent_id)
+        if last is not None:
+            last_idx, last_insert_id = last
+            # the previous slot may have been overwritten since
+            if self._insert_ids[last_idx] == last_insert_id:
+                self._successors[last_idx] = idx
+        if exp_dict['done']:
+            self._last_transition[agent_id] = None
+        else:
+            self._last_transition[agent_id] = (idx, self._insert_ids[idx])
+        return idx
+
+    def insert_batch(self, exp_dicts):
+        # links depend on the order of insertion
+        return np.array([self.insert(exp_dict) for exp_dict in exp_dicts],
+                        dtype=np.int64)
+
+    def remove(self, indices):
+        raise NotImplementedError('NStepColumnarStorage does not support '
+                                  'eviction, slots are linked by position')
+
+    def extend(self, batch, insert_ids=None, agent_ids=None):
+        raise NotImplementedError('NStepColumnarStorage only supports insert()')
+
+    def _follow(self, indices):
+        """
+        Returns:
+            (last, returns, dones, steps): slot of the last transition
+            within n steps, discounted return, whether the episode ended
+            and the number of links followed
+        """
+        last = np.asarray(indices, dtype=np.int64).copy()
+        returns = self._reward[last].astype(np.float64)
+        dones = self._done[last].copy()
+        steps = np.zeros(len(last), dtype=np.int64)
+        for k in range(1, self.n_step):
+            successors = self._successors[last]
+            active = (dones == 0) & (successors >= 0)
+            if not active.any():
+                break
+            nxt = successors[active]
+            returns[active] += self.gamma ** k * self._reward[nxt]
+            dones[active] = self._done[nxt]
+            last[active] = nxt
+            steps[active] += 1
+        return last, returns, dones, steps
+
+    def sampleable(self, indices):
+        _, _, dones, steps = self._follow(indices)
+        return (steps == self.n_step - 1) | (dones != 0)
+
+    def gather(self, indices):
+        last, returns, dones, _ = self._follow(indices)
+        batch = super().gather(indices)
+        for modality, key in self._obs_keys:
+            batch['obs_next'][modality][key] = self._obs_next[modality, key][last]
+        batch['rewards'] = returns.astype(np.float32)[:, None]
+        batch['dones'] = dones[:, None]
+        return batch
+
+
+class MemmapColumnarStorage(ColumnarStorage):
+    """
+        ColumnarStorage whose columns are np.memmap files in `folder`,
+        one file per column. Pages are brought in by the OS on access,
+        so the storage can be much larger than RAM.
+    """
+    def __init__(self, capacity, obs_spec, action_spec, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        super().__init__(capacity, obs_spec, action_spec)
+
+    def _allocate(self, name, shape, dtype):
+        return np.memmap(os.path.join(self.folder, name + '.bin'),
+                         dtype=dtype, mode='w+', shape=shape)
+
+    def flush(self):
+        """
+            Writes dirty pages back to disk
+        """
+        for column in self._all_columns():
+            column.flush()
+
+
+def _attach_shared_memory(name):
+    """
+        Attaches to the block `name` without registering it with the
+        resource tracker, which unlinks registered blocks when it exits.
+        Only the process that created the block tracks and unlinks it.
+        Before Python 3.13, SharedMemory always registers, and
+        unregistering afterwards would also drop the registration of
+        the creator, whose resource tracker child processes share.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class SharedColumnarStorage(ColumnarStorage):
+    """
+        ColumnarStorage in a multiprocessing.shared_memory block shared by
+        all replay shard processes of a ShardedReplay, see create().
+
+        Every column holds num_shards * capacity rows and shard `index`
+        only writes to its stripe [index * capacity, (index + 1) * capacity),
+        so writers need no lock across processes. After each insert, a
+        shard publishes its size in a shared header. Every shard samples
+        from the stripes of all shards: len() and gather() cover all
+        experiences on the host, without copies between processes.
+
+        Rows have a sequence number that is odd while the row is being
+        written. gather() copies a row again if its sequence number was
+        odd or changed during the copy, i.e. it was overwritten by its
+        shard meanwhile.
+    """
+    supports_snapshot = False
+    supports_remove = False
+    # byte alignment of every column in the block
+    ALIGN = 64
+
+    def __init__(self, capacity, obs_spec, action_spec,
+                 name, num_shards, index):
+        """
+        Args:
+            capacity: number of experiences of this shard
+            name: name of the block made by create()
+            num_shards: number of shards sharing the block
+            index: index of this shard
+        """
+        self.num_shards = num_shards
+        self.index = index
+        self._shm = _attach_shared_memory(name)
+        # size and insert count of every shard
+        self._header = np.ndarray((num_shards, 2), dtype=np.int64,
+                                  buffer=self._shm.buf)
+        self._offset = self._header.nbytes
+        # column name -> rows of all shards
+        self._shared = collections.OrderedDict()
+        self._stripe = slice(index * capacity, (index + 1) * capacity)
+        super().__init__(capacity, obs_spec, action_spec)
+        self._insert_ids = self._allocate('insert_ids', (capacity,), np.int64)
+        self._agent_ids = self._allocate('agent_ids', (capacity,), np.int32)
+
+    @classmethod
+    def create(cls, name, capacity, num_shards, obs_spec, action_spec):
+        """
+            Allocates the block for num_shards shards of `capacity`
+            experiences. The caller unlinks it once the shards exit,
+            shards never do.
+
+        Returns:
+            multiprocessing.shared_memory.SharedMemory
+        """
+        num_columns = 2 * sum(len(obs_spec[modality])
+                              for modality in obs_spec) + 6
+        row_bytes = cls.bytes_per_exp_for(obs_spec, action_spec)
+        size = (num_shards * 2 * 8 + num_shards * capacity * row_bytes
+                + num_columns * cls.ALIGN)
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+    def _allocate(self, name, shape, dtype):
+        offset = -(-self._offset // self.ALIGN) * self.ALIGN
+        column = np.ndarray((self.num_shards * shape[0],) + tuple(shape[1:]),
+                            dtype=dtype, buffer=self._shm.buf, offset=offset)
+        self._offset = offset + column.nbytes
+        self._shared[name] = column
+        return column[self._stripe]
+
+    def _publish(self):
+        super()._publish()
+        self._header[self.index] = (self._size, self._insert_count)
+
+    def extend(self, batch, insert_ids=None, agent_ids=None):
+        raise NotImplementedError('SharedColumnarStorage only supports '
+                                  'insert() and insert_batch()')
+
+    def remove(self, indices):
+        raise NotImplementedError('SharedColumnarStorage does not support '
+                                  'eviction, stripes are written by '
+                                  'their shard only')
+
+    def _rows(self, indices):
+        """
+            Maps indices in [0, len(self)), which enumerate the stored
+            experiences of all shards, to rows of the shared columns
+        """
+        sizes = self._header[:, 0].copy()
+        ends = np.cumsum(sizes)
+        stripes = np.searchsorted(ends, indices, side='right')
+        return stripes * self.capacity + indices - (ends - sizes)[stripes]
+
+    def _gather_rows(self, rows):
+        obs = collections.OrderedDict()
+        obs_next = collections.OrderedDict()
+        for modality, key in self._obs_keys:
+            if modality not in obs:
+                obs[modality] = collections.OrderedDict()
+                obs_next[modality] = collections.OrderedDict()
+            obs[modality][key] = \
+                self._shared['obs.{}.{}'.format(modality, key)][rows]
+            obs_next[modality][key] = \
+                self._shared['obs_next.{}.{}'.format(modality, key)][rows]
+        return {
+            'obs': obs,
+            'obs_next': obs_next,
+            'actions': self._shared['action'][rows],
+            'rewards': self._shared['reward'][rows, None],
+            'dones': self._shared['done'][rows, None],
+        }
+
+    def gather(self, indices):
+        rows = self._rows(np.asarray(indices, dtype=np.int64))
+        return self._gather_consistent(rows, self._shared['seq'])
+
+    def __len__(self):
+        return int(self._header[:, 0].sum())
+
+    def metrics(self):
+        metrics = super().metrics()
+        metrics['shard_size'] = self._size
+        return metrics
+
+
+def split_batch(batch):
+    """
+        Inverse of ColumnarStorage.gather(): splits batched arrays
+        into a list of exp dicts in ExpSenderWrapperSSAR format
+    """
+    exps = []
+    for i in range(len(batch['rewards'])):
+        obs = collections.OrderedDict()
+        obs_next = collections.OrderedDict()
+        for modality in batch['obs']:
+            obs[modality] = collections.OrderedDict(
+                (key, value[i]) for key, value in batch['obs'][modality].items())
+            obs_next[modality] = collections.OrderedDict(
+                (key, value[i])
+                for key, value in batch['obs_next'][modality].items())
+        exps.append({
+            'obs': [obs, obs_next],
+            'action': batch['actions'][i],
+            'reward': batch['rewards'][i, 0],
+            'done': batch['dones'][i, 0],
+            'info': {},
+        })
+    return exps
+
+
+def concat_batches(batches):
+    """
+        Concatenates batches in the format of ColumnarStorage.gather()
+    """
+    first = batches[0]
+    obs = collections.OrderedDict()
+    obs_next = collections.OrderedDict()
+    for modality in first['obs']:
+        obs[modality] = collections.OrderedDict()
+        obs_next[modality] = collections.OrderedDict()
+        for key in first['obs'][modality]:
+            obs[modality][key] = np.concatenate(
+                [b['obs'][modality][key] for b in batches])
+            obs_next[modality][key] = np.concatenate(
+                [b['obs_next'][modality][key] for b in batches])
+    return {
+        'obs': obs,
+        'obs_next': obs_next,
+        'actions': np.concatenate([b['actions'] for b in batches]),
+        'rewards': np.concatenate([b['rewards'] for b in batches]),
+        'dones': np.concatenate([b['dones'] for b in batches]),
+    }
+
+
+def _set_rows(batch, positions, part):
+    """
+        batch[...][positions] = part[...] for every array in a
+        batch in the format of ColumnarStorage.gather()
+    """
+    for key, value in part.items():
+        if isinstance(value, dict):
+            _set_rows(batch[key], positions, value)
+        else:
+            batch[key][positions] = value
+
+
+def _leaf(value):
+    """
+        Frame stacks sent as a list of frames are concatenated
+        along the channel axis
+    """
+    if isinstance(value, (list, tuple)):
+        return np.concatenate(value, axis=0)
+    return value
+
+
+def _iter_arrays(obj):
+    """
+        Yields the numpy arrays and CompressedArrays that own the memory of
+        all leaves of a nested dict/list experience,
+        views resolve to their base array
+    """
+    if isinstance(obj, dict):
+        for value in obj.values():
+            yield from _iter_arrays(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            yield from _iter_arrays(value)
+    elif isinstance(obj, np.ndarray):
+        while isinstance(obj.base, np.ndarray):
+            obj = obj.base
+        yield obj
+    elif isinstance(obj, CompressedArray):
+        yield obj
+
+
+def _iter_compressed(obj):
+    for array in _iter_arrays(obj):
+        if isinstance(array, CompressedArray):
+            yield array
+
+
+def _decompress_nested(obj, arrays):
+    """
+        Copy of a nested experience with CompressedArrays replaced by
+        arrays[id(compressed_array)]
+    """
+    if isinstance(obj, dict):
+        return obj.__class__((k, _decompress_nested(v, arrays))
+                             for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return obj.__class__(_decompress_nested(v, arrays) for v in obj)
+    elif isinstance(obj, CompressedArray):
+        return arrays[id(obj)]
+    return obj
+
+
+def make_storage(learner_config, env_config, session_config, index=0):
+    """
+        Instantiates the backend chosen by learner_config.replay.storage.
+        When session_config.replay.memory_budget_bytes is set, columnar
+        storage only preallocates as many experiences as fit in the budget.
+        With session_config.replay.shared_memory, columnar storage of
+        replay shard `index` lives in the block made by ShardedReplay.
+    """
+    storage = learner_config.replay.storage
+    capacity = learner_config.replay.memory_size
+    codec = learner_config.replay.obs_codec
+    if codec is not None and storage != 'list':
+        raise ConfigError('obs_codec requires list storage')
+    if session_config.replay.shared_memory:
+        if storage != 'columnar' or learner_config.replay.nstep_on_replay:
+            raise ConfigError('shared_memory requires columnar storage')
+        if session_config.replay.memory_budget_bytes:
+            raise ConfigError('shared_memory does not support '
+                              'memory_budget_bytes')
+        return SharedColumnarStorage(
+            capacity,
+            obs_spec=env_config.obs_spec,
+            action_spec=env_config.action_spec,
+            name=session_config.replay.shared_memory_name,
+            num_shards=learner_config.replay.replay_shards,
+            index=index)
+    if learner_config.replay.nstep_on_replay:
+        if storage != 'columnar':
+            raise ConfigError('nstep_on_replay requires columnar storage')
+        if session_config.replay.memory_budget_bytes:
+            raise ConfigError('nstep_on_replay does not support '
+                              'memory_budget_bytes')
+        if learner_config.replay.replay_shards != 1:
+            # the collector proxy spreads an agent's steps over all
+            # shards, a shard would link steps that are not consecutive
+            raise ConfigError('nstep_on_replay requires '
+                              'learner_config.replay.replay_shards == 1')
+        return NStepColumnarStorage(
+            capacity,
+            obs_spec=env_config.obs_spec,
+            action_spec=env_config.action_spec,
+            n_step=learner_config.algo.n_step,
+            gamma=learner_config.algo.gamma)
+    if storage == 'list' and codec is not None:
+        return CompressedListStorage(
+            capacity,
+            codec=codec,
+            decompress_threads=learner_config.replay.decompress_threads)
+    elif storage == 'list':
+        return ListStorage(capacity)
+    elif storage == 'serialized':
+        return SerializedListStorage(
+            capacity,
+            serializer=make_serialization_codec(
+                session_config.codec.sampling).serialize)
+    elif storage == 'columnar':
+        budget = session_config.replay.memory_budget_bytes
+        if budget:
+            bytes_per_exp = ColumnarStorage.bytes_per_exp_for(
+                env_config.obs_spec, env_config.action_spec)
+            capacity = min(capacity, int(budget // bytes_per_exp))
+        return ColumnarStorage(capacity,
+                               obs_spec=env_config.obs_spec,
+                               action_spec=env_config.action_spec)
+    elif storage == 'frame_dedup':
+        return FrameDedupStorage(
+            capacity,
+            obs_spec=env_config.obs_spec,
+            action_spec=env_config.action_spec,
+            frame_stacks=env_config.frame_stacks,
+            frames_per_exp=learner_config.replay.frames_per_exp)
+    else:
+        raise ConfigError('unknown replay storage: {}'.format(storage))
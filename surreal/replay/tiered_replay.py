@@ -0,0 +1,298 @@
+import os
+import numpy as np
+from .uniform_replay import UniformReplay
+from .storage import (ColumnarStorage, MemmapColumnarStorage,
+                      concat_batches, split_batch)
+from .evict_policy import OldestFirstEvictPolicy
+from surreal.session import ConfigError
+import surreal.utils as U
+
+
+class ColdTier(object):
+    """
+        Ring of MemmapColumnarStorage segment files on disk.
+        Batches are appended sequentially to the current segment, once all
+        segments are full the oldest segment is overwritten.
+        Indices [0, len(cold_tier)) address experiences across segments,
+        index i lives in segment i // segment_size.
+    """
+    def __init__(self, folder, capacity, segment_size, obs_spec, action_spec):
+        self.folder = folder
+        self.segment_size = segment_size
+        self.num_segments = int(np.ceil(capacity / segment_size))
+        self.obs_spec = obs_spec
+        self.action_spec = action_spec
+        # segment files are created when first written to
+        self._segments = []
+        self._segment_idx = 0
+        self._segment_fill = 0
+        self._size = 0
+
+    def append(self, batch, insert_ids):
+        """
+        Args:
+            batch: batched arrays in the format of ColumnarStorage.gather()
+            insert_ids: insertion order of the experiences in batch
+        """
+        n = len(batch['rewards'])
+        start = 0
+        while start < n:
+            segment = self._current_segment()
+            end = start + min(n - start, self.segment_size - self._segment_fill)
+            old_len = len(segment)
+            segment.extend(_index_batch(batch, slice(start, end)),
+                           insert_ids=insert_ids[start:end])
+            self._size += len(segment) - old_len
+            self._segment_fill += end - start
+            if self._segment_fill == self.segment_size:
+                segment.flush()
+                self._segment_idx = (self._segment_idx + 1) % self.num_segments
+                self._segment_fill = 0
+            start = end
+
+    def gather(self, indices):
+        """
+        Reads the experiences at `indices`, one sorted read per segment
+        so that pages are accessed in file order.
+
+        Returns:
+            batched arrays in the format of ColumnarStorage.gather(),
+            ordered by index
+        """
+        indices = np.sort(indices)
+        segment_ids = indices // self.segment_size
+        bounds = np.searchsorted(segment_ids,
+                                 np.arange(len(self._segments) + 1))
+        batches = []
+        for k, segment in enumerate(self._segments):
+            lo, hi = bounds[k], bounds[k + 1]
+            if hi > lo:
+                batches.append(segment.gather(
+                    indices[lo:hi] - k * self.segment_size))
+        return concat_batches(batches)
+
+    @property
+    def nbytes(self):
+        return sum(segment.nbytes for segment in self._segments)
+
+    def _current_segment(self):
+        if self._segment_idx == len(self._segments):
+            self._segments.append(MemmapColumnarStorage(
+                self.segment_size,
+                obs_spec=self.obs_spec,
+                action_spec=self.action_spec,
+                folder=os.path.join(self.folder,
+                                    'segment_{}'.format(self._segment_idx)),
+            ))
+        return self._segments[self._segment_idx]
+
+    def __len__(self):
+        return self._size
+
+
+class TieredReplay(UniformReplay):
+    """
+    Uniform replay over a hot in-memory tier and a cold tier on disk,
+    for replays that do not fit in RAM.
+
+    The hot tier is a columnar storage of memory_size experiences.
+    When it is full, its spill_size oldest experiences are appended to
+    the cold tier in one sequential write per column. The cold tier is
+    a ring of np.memmap segment files under
+    session_config.folder/replay_cold/shard_<index>, holding
+    cold_memory_size experiences (rounded up to whole segments) before
+    the oldest are overwritten.
+
+    sample() draws uniformly over both tiers, cold experiences are read
+    with sorted offsets. memory_budget_bytes and replay snapshots only
+    apply to the hot tier.
+
+    Spilled experiences leave the hot tier under self._lock and are
+    written to disk under self._cold_lock only, so that disk writes do
+    not block inserts and samples. Until the cold tier holds them, they
+    are sampled from the in-memory spill batches. The cold tier size
+    that sample() uses is only published once the write is complete.
+    """
+    def __init__(self,
+                 learner_config,
+                 env_config,
+                 session_config,
+                 index=0):
+        """
+        Args:
+          cold_memory_size: max number of experiences in the cold tier
+          cold_segment_size: number of experiences per segment file
+          spill_size: number of experiences moved to the cold tier at once
+        """
+        super().__init__(
+            learner_config=learner_config,
+            env_config=env_config,
+            session_config=session_config,
+            index=index
+        )
+        if not isinstance(self._storage, ColumnarStorage):
+            raise ConfigError('TieredReplay requires columnar storage')
+        if not self._storage.supports_remove:
+            # spilling removes the oldest experiences from the hot tier
+            raise ConfigError('TieredReplay does not support {}'.format(
+                type(self._storage).__name__))
+        if self.session_config.replay.shared_memory:
+            raise ConfigError('TieredReplay does not support shared_memory')
+        self.cold_memory_size = self.learner_config.replay.cold_memory_size
+        if self.cold_memory_size <= 0:
+            raise ConfigError('TieredReplay requires a positive '
+                              'cold_memory_size')
+        self.spill_size = self.learner_config.replay.spill_size
+        if not 0 < self.spill_size <= self._storage.capacity:
+            raise ConfigError('spill_size must be in (0, memory_size]')
+        self._cold = ColdTier(
+            folder=os.path.join(self.session_config.folder,
+                                'replay_cold',
+                                'shard_{}'.format(self.index)),
+            capacity=self.cold_memory_size,
+            segment_size=self.learner_config.replay.cold_segment_size,
+            obs_spec=self.env_config.obs_spec,
+            action_spec=self.env_config.action_spec,
+        )
+        # Guards the cold tier, so that disk reads do not block inserts.
+        # Taken before self._lock when both are held
+        self._cold_lock = U.TimedLock()
+        # size of the cold tier that sample() draws from
+        self._cold_size = 0
+        # (batch, insert_ids) taken from the hot tier, not yet in the
+        # cold tier
+        self._spilling = []
+        self._oldest_first = OldestFirstEvictPolicy()
+        self.cold_read_time = U.TimeRecorder()
+        self.spill_time = U.TimeRecorder()
+
+    def insert(self, exp_dict):
+        spilled = []
+        with self._lock:
+            if len(self._storage) == self._storage.capacity:
+                spilled.append(self._take_oldest(self.spill_size))
+                self._spilling.extend(spilled)
+            self._storage.insert(exp_dict)
+        if spilled:
+            self._spill(spilled)
+        self._passive_evict()
+
+    def insert_batch(self, exps):
+        spilled = []
+        with self._lock:
+            start = 0
+            while start < len(exps):
+                if len(self._storage) == self._storage.capacity:
+                    spilled.append(self._take_oldest(self.spill_size))
+                end = start + self._storage.capacity - len(self._storage)
+                self._storage.insert_batch(exps[start:end])
+                start = end
+            self._spilling.extend(spilled)
+        if spilled:
+            self._spill(spilled)
+        self._passive_evict()
+
+    def _spill(self, spilled):
+        """
+            Appends batches taken from the hot tier to the cold tier,
+            then publishes the new cold tier size
+        """
+        with self._cold_lock:
+            with self.spill_time.time():
+                for batch, insert_ids in spilled:
+                    self._cold.append(batch, insert_ids)
+            with self._lock:
+                self._cold_size = len(self._cold)
+                self._spilling = [entry for entry in self._spilling
+                                  if not any(entry is done
+                                             for done in spilled)]
+
+    def sample(self, batch_size):
+        """
+            Indices [0, n_cold) are in the cold tier, followed by the
+            experiences being spilled and the hot tier
+        """
+        with self._lock:
+            n_cold = self._cold_size
+            spill_bounds = np.cumsum(
+                [n_cold] + [len(insert_ids)
+                            for _, insert_ids in self._spilling])
+            n_offset = spill_bounds[-1]
+            size = n_offset + len(self._storage)
+
+            def sampleable(indices):
+                mask = np.ones(len(indices), dtype=bool)
+                is_hot = indices >= n_offset
+                mask[is_hot] = self._storage.sampleable(
+                    indices[is_hot] - n_offset)
+                return mask
+
+            indices = self._redraw_unsampleable(
+                np.random.randint(0, size, size=batch_size),
+                lambda n: np.random.randint(0, size, size=n),
+                sampleable=sampleable)
+            is_hot = indices >= n_offset
+            batches = [self._storage.gather(indices[is_hot] - n_offset)]
+            for k, (batch, _) in enumerate(self._spilling):
+                lo, hi = spill_bounds[k], spill_bounds[k + 1]
+                in_batch = (indices >= lo) & (indices < hi)
+                if in_batch.any():
+                    batches.append(_index_batch(batch,
+                                                indices[in_batch] - lo))
+        is_cold = indices < n_cold
+        if is_cold.any():
+            with self._cold_lock, self.cold_read_time.time():
+                batches.append(self._cold.gather(indices[is_cold]))
+        batch = concat_batches(batches)
+        if self.aggregate_on_replay:
+            return batch
+        return split_batch(batch)
+
+    def _take_oldest(self, n):
+        """
+            Removes the n oldest experiences from the hot tier,
+            called with self._lock held
+
+        Returns:
+            (batch, insert_ids) sorted from oldest to newest
+        """
+        indices = self._oldest_first.select(self._storage, n)
+        insert_ids = self._storage.insert_ids[indices]
+        order = np.argsort(insert_ids)
+        indices, insert_ids = indices[order], insert_ids[order]
+        batch = self._storage.gather(indices)
+        self._remove(indices)
+        return batch, insert_ids
+
+    def storage_metrics(self):
+        metrics = super().storage_metrics()
+        metrics['hot_size'] = len(self._storage)
+        metrics['cold_size'] = self._cold_size
+        metrics['cold_bytes_allocated'] = self._cold.nbytes
+        metrics['cold_read_time'] = self.cold_read_time.avg
+        metrics['spill_time'] = self.spill_time.avg
+        for key, value in self._cold_lock.stats().items():
+            metrics['cold_lock_' + key] = value
+        return metrics
+
+    def __len__(self):
+        return (len(self._storage) + self._cold_size
+                + sum(len(insert_ids) for _, insert_ids in self._spilling))
+
+
+def _index_batch(batch, index):
+    """
+        Rows `index` (a slice or an index array) of every array in batch
+    """
+    return {
+        'obs': {modality: {key: value[index]
+                           for key, value in batch['obs'][modality].items()}
+                for modality in batch['obs']},
+        'obs_next': {modality: {key: value[index]
+                                for key, value
+                                in batch['obs_next'][modality].items()}
+                     for modality in batch['obs_next']},
+        'actions': batch['actions'][index],
+        'rewards': batch['rewards'][index],
+        'dones': batch['dones'][index],
+    }
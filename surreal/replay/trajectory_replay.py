@@ -0,0 +1,231 @@
+import collections
+import numpy as np
+from .base import Replay
+from surreal.session import ConfigError
+import surreal.utils as U
+
+
+class TrajectoryReplay(Replay):
+    """
+    FIFO replay of n_step windows for on-policy learners (PPO), built from
+    single steps sent by surreal.env.ExpSenderWrapperStepWithInfo.
+
+    Every step is stored once, in a ring of per-key arrays. Each agent's
+    current episode is a list of ring slots; every `stride` steps, the
+    window of the next n_step slots (plus the slot holding obs_next) is
+    queued for sampling. sample() gathers the queued windows with one
+    fancy-index per key and returns the batch layout of
+    surreal.learner.aggregator.MultistepAggregatorWithInfo:
+    {
+        obs = batch_size * n_step * observation
+        obs_next = batch_size * 1 * next_observation
+        actions = batch_size * n_step * actions,
+        rewards = batch_size * n_step,
+        dones = batch_size * n_step,
+        persistent_infos = list of batch_size * n_step * info, or None
+        onetime_infos = list of batch_size * info, or None
+    }
+    Windows whose steps were overwritten in the ring before they were
+    sampled are dropped. Every step of an agent must reach this replay
+    in order, so it runs as a single replay shard.
+    """
+    def __init__(self,
+                 learner_config,
+                 env_config,
+                 session_config,
+                 index=0):
+        """
+        Args:
+          memory_size: max number of windows waiting to be sampled,
+            the ring holds 2 * memory_size * n_step steps
+          trajectory: must be set, agents then send single steps
+        """
+        super().__init__(
+            learner_config=learner_config,
+            env_config=env_config,
+            session_config=session_config,
+            index=index
+        )
+        if not self.learner_config.replay.trajectory:
+            raise ConfigError('TrajectoryReplay requires '
+                              'learner_config.replay.trajectory')
+        if self.learner_config.replay.replay_shards != 1:
+            # the collector proxy spreads an agent's steps over all
+            # shards, windows would join steps that are not consecutive
+            raise ConfigError('TrajectoryReplay requires '
+                              'learner_config.replay.replay_shards == 1')
+        self.batch_size = self.learner_config.replay.batch_size
+        self.memory_size = self.learner_config.replay.memory_size
+        self.n_step = self.learner_config.algo.n_step
+        self.stride = self.learner_config.algo.stride
+        self.capacity = 2 * self.memory_size * self.n_step
+
+        self._lock = U.TimedLock()
+        # column name -> array, allocated when the key is first seen
+        self._columns = {}
+        self._insert_ids = np.full((self.capacity,), -1, dtype=np.int64)
+        self._next_slot = 0
+        self._insert_count = 0
+        # agent id -> _Episode
+        self._episodes = {}
+        # (slots, insert ids) of windows, oldest first
+        self._windows = collections.deque(maxlen=self.memory_size)
+        self.cumulative_dropped_windows = 0
+
+    def insert(self, exp_dict):
+        with self._lock:
+            self._insert_step(exp_dict)
+
+    def insert_batch(self, exps):
+        with self._lock:
+            for exp_dict in exps:
+                self._insert_step(exp_dict)
+
+    def sample(self, batch_size):
+        with self._lock:
+            windows = []
+            while len(windows) < batch_size and self._windows:
+                window_slots, window_ids = self._windows.popleft()
+                if np.array_equal(self._insert_ids[window_slots], window_ids):
+                    windows.append(window_slots)
+                else:
+                    self.cumulative_dropped_windows += 1
+            windows = np.array(windows, dtype=np.int64)
+            return self._gather(windows.reshape(-1, self.n_step + 1))
+
+    def evict(self):
+        raise NotImplementedError('no support for eviction in FIFO mode')
+
+    def start_sample_condition(self):
+        return len(self._windows) >= self.batch_size
+
+    def storage_metrics(self):
+        metrics = {
+            'dropped_windows': self.cumulative_dropped_windows,
+            'open_episodes': len(self._episodes),
+        }
+        for key, value in self._lock.stats().items():
+            metrics['lock_' + key] = value
+        return metrics
+
+    def __len__(self):
+        return len(self._windows)
+
+    def _insert_step(self, exp_dict):
+        agent_id = exp_dict.get('agent_id', -1)
+        if exp_dict['episode_start'] or agent_id not in self._episodes:
+            self._episodes[agent_id] = _Episode()
+        episode = self._episodes[agent_id]
+        episode.append(*self._write_step(exp_dict))
+        if exp_dict['done']:
+            # holds the obs_next of the last window
+            episode.append(*self._write_obs(exp_dict['obs_next']))
+        self._queue_windows(episode)
+        if exp_dict['done']:
+            del self._episodes[agent_id]
+
+    def _claim_slot(self):
+        slot = self._next_slot
+        self._next_slot = (self._next_slot + 1) % self.capacity
+        self._insert_ids[slot] = self._insert_count
+        self._insert_count += 1
+        return slot
+
+    def _column(self, name, value, dtype=np.float32):
+        value = np.asarray(value)
+        if name not in self._columns:
+            self._columns[name] = np.zeros((self.capacity,) + value.shape,
+                                           dtype=dtype)
+        return self._columns[name]
+
+    def _write_obs(self, obs, slot=None):
+        if slot is None:
+            slot = self._claim_slot()
+        for modality in obs:
+            dtype = np.uint8 if modality == 'pixel' else np.float32
+            for key, value in obs[modality].items():
+                self._column(('obs', modality, key), value, dtype)[slot] = value
+        return slot, self._insert_ids[slot]
+
+    def _write_step(self, exp_dict):
+        slot = self._claim_slot()
+        self._write_obs(exp_dict['obs'], slot)
+        self._column('action', exp_dict['action'])[slot] = exp_dict['action']
+        self._column('reward', exp_dict['reward'])[slot] = exp_dict['reward']
+        self._column('done', exp_dict['done'])[slot] = float(exp_dict['done'])
+        for i, info in enumerate(exp_dict['persistent_infos']):
+            self._column(('persistent', i), info)[slot] = info
+        if exp_dict['onetime_infos'] is not None:
+            for i, info in enumerate(exp_dict['onetime_infos']):
+                self._column(('onetime', i), info)[slot] = info
+        return slot, self._insert_ids[slot]
+
+    def _queue_windows(self, episode):
+        window_length = self.n_step + 1
+        while len(episode.slots) >= episode.next_window + window_length:
+            window = slice(episode.next_window,
+                           episode.next_window + window_length)
+            self._windows.append((np.array(episode.slots[window]),
+                                  np.array(episode.insert_ids[window])))
+            episode.next_window += self.stride
+        episode.trim()
+
+    def _gather(self, windows):
+        steps = windows[:, :-1]
+        obs = collections.OrderedDict()
+        obs_next = collections.OrderedDict()
+        persistent_infos = []
+        onetime_infos = []
+        for name, column in self._columns.items():
+            if not isinstance(name, tuple):
+                continue
+            if name[0] == 'obs':
+                _, modality, key = name
+                obs.setdefault(modality, collections.OrderedDict())
+                obs_next.setdefault(modality, collections.OrderedDict())
+                obs[modality][key] = column[steps]
+                obs_next[modality][key] = column[windows[:, -1:]]
+            elif name[0] == 'persistent':
+                persistent_infos.append((name[1], column[steps]))
+            elif name[0] == 'onetime':
+                onetime_infos.append((name[1], column[windows[:, 0]]))
+        return {
+            'obs': obs,
+            'obs_next': obs_next,
+            'actions': self._columns['action'][steps],
+            'rewards': self._columns['reward'][steps],
+            'dones': self._columns['done'][steps],
+            'persistent_infos': _sorted_infos(persistent_infos),
+            'onetime_infos': _sorted_infos(onetime_infos),
+        }
+
+
+class _Episode(object):
+    """
+        Ring slots of the steps of one agent's episode
+        that can still be part of a window
+    """
+    def __init__(self):
+        self.slots = []
+        self.insert_ids = []
+        # index in self.slots where the next window starts
+        self.next_window = 0
+
+    def append(self, slot, insert_id):
+        self.slots.append(slot)
+        self.insert_ids.append(insert_id)
+
+    def trim(self):
+        """
+            Forgets the steps before the next window
+        """
+        n = min(self.next_window, len(self.slots))
+        del self.slots[:n]
+        del self.insert_ids[:n]
+        self.next_window -= n
+
+
+def _sorted_infos(infos):
+    if not infos:
+        return None
+    return [column for _, column in sorted(infos, key=lambda info: info[0])]
@@ -1,9 +1,38 @@
-import random
+import numpy as np
 from .base import Replay
+from .storage import make_storage, ColumnarStorage
+from .evict_policy import make_evict_policy
+from .snapshot import save_snapshot, load_snapshot
+from surreal.session import ConfigError
 import surreal.utils as U
 
 
 class UniformReplay(Replay):
+    """
+    Samples experiences uniformly from a storage backend,
+    see surreal.replay.storage.
+
+    The collector thread (insert), the sampler threads (sample) and the
+    evict, snapshot and priority update threads share the storage.
+    Writers (insert, evict, snapshot loads, priority updates) run one at
+    a time under self._lock. With storage that supports concurrent reads
+    (columnar storage, see ColumnarStorage), sample() does not take the
+    lock: it draws from the size published by the last completed write
+    and the storage copies again the rows that a writer touched during
+    the copy. Other storages are sampled under the lock. Either way
+    - a sampled experience is always one complete insert, never a slot
+      that is half overwritten
+    - sample() sees every insert that returned before it started
+    - get() and gather() return data that stays valid once the slot is
+      reused
+    Work that does not touch the slots runs outside the lock: encode()
+    before insert, decode() after get(), serialization of the batch and
+    the disk writes of snapshots. Lock wait and hold times are reported
+    under .storage/lock_*, rows copied again under .storage/torn_reads.
+    """
+    # whether priorities() is available to eviction policies
+    has_priorities = False
+
     def __init__(self,
                  learner_config,
                  env_config,
@@ -14,6 +43,21 @@ class UniformReplay(Replay):
           memory_size: Max number of experience to store in the buffer.
             When the buffer overflows the old memories are dropped.
           sampling_start_size: min number of exp above which we will start sampling
+          storage: 'list' keeps exp dicts in a python list,
+            'columnar' preallocates one numpy ring buffer per key,
+            'frame_dedup' also stores every distinct pixel frame once,
+            'serialized' keeps exp dicts serialized so that sampled
+            batches are not serialized again (see surreal.replay.storage)
+          aggregate_on_replay: sample() returns batched arrays gathered
+            from columnar storage instead of a list of exp dicts
+
+        session_config.replay:
+          memory_budget_bytes: evict experiences when the stored experiences
+            take more memory than this, 0 to only bound by memory_size
+          evict_policy: which experiences to evict, see
+            surreal.replay.evict_policy
+          evict_to_fraction: eviction brings memory usage down to this
+            fraction of the budget
         """
         super().__init__(
             learner_config=learner_config,
@@ -21,9 +65,32 @@ class UniformReplay(Replay):
             session_config=session_config,
             index=index
         )
-        self._memory = []
         self.memory_size = self.learner_config.replay.memory_size
-        self._next_idx = 0
+        self._storage = make_storage(self.learner_config,
+                                     self.env_config,
+                                     self.session_config,
+                                     index=self.index)
+        self.aggregate_on_replay = \
+            self.learner_config.replay.aggregate_on_replay
+        if (self.aggregate_on_replay and
+                not isinstance(self._storage, ColumnarStorage)):
+            raise ConfigError('aggregate_on_replay requires columnar storage')
+        # Serializes writes to storage, and reads of storage
+        # without concurrent_reads
+        self._lock = U.TimedLock()
+
+        self.memory_budget = self.session_config.replay.memory_budget_bytes
+        self.evict_to_fraction = self.session_config.replay.evict_to_fraction
+        self._evict_policy = make_evict_policy(
+            self.session_config.replay.evict_policy)
+        if self._evict_policy.requires_priorities and not self.has_priorities:
+            raise ConfigError('evict policy {} requires a prioritized replay'
+                              .format(self.session_config.replay.evict_policy))
+        self.cumulative_evicted_count = 0
+
+        if (self.session_config.checkpoint.replay.snapshot_interval and
+                not self._storage.supports_snapshot):
+            raise ConfigError('replay snapshots require columnar storage')
 
     # def default_config(self):
     #     conf = super().default_config()
@@ -34,41 +101,163 @@ class UniformReplay(Replay):
     #     return conf
 
     def insert(self, exp_dict):
-        if self._next_idx >= len(self._memory):
-            self._memory.append(exp_dict)
-        else:
-            self._memory[self._next_idx] = exp_dict
-        self._next_idx = (self._next_idx + 1) % self.memory_size
-
-    def sample(self, batch_size):    
-        indices = [random.randint(0, len(self._memory) - 1)
-                   for _ in range(batch_size)]
-        response = [self._memory[i] for i in indices]
-        return response
+        exp_dict = self._storage.encode(exp_dict)
+        with self._lock:
+            self._storage.insert(exp_dict)
+        self._passive_evict()
+
+    def insert_batch(self, exps):
+        exps = [self._storage.encode(exp_dict) for exp_dict in exps]
+        with self._lock:
+            self._storage.insert_batch(exps)
+        self._passive_evict()
+
+    def sample(self, batch_size):
+        if self._storage.concurrent_reads:
+            indices = np.random.randint(0, len(self._storage),
+                                        size=batch_size)
+            if self.aggregate_on_replay:
+                return self._storage.gather(indices)
+            return self._storage.decode(self._storage.get(indices))
+        with self._lock:
+            size = len(self._storage)
+            indices = self._redraw_unsampleable(
+                np.random.randint(0, size, size=batch_size),
+                lambda n: np.random.randint(0, size, size=n))
+            if self.aggregate_on_replay:
+                return self._storage.gather(indices)
+            exps = self._storage.get(indices)
+        return self._storage.decode(exps)
+
+    def serialize_sample(self, sample):
+        if self._storage.serialized:
+            return U.join_serialized(sample)
+        return super().serialize_sample(sample)
+
+    def _redraw_unsampleable(self, indices, draw, sampleable=None,
+                             max_rounds=10):
+        """
+            Replaces the indices that storage cannot sample yet (e.g. n-step
+            transitions still waiting for their successors) with
+            draw(count) new ones. Called with self._lock held.
+            Gives up after max_rounds, the remaining indices are
+            sampled as they are.
+
+        Args:
+            sampleable: bool mask of sampleable indices,
+                defaults to self._storage.sampleable
+        """
+        if sampleable is None:
+            sampleable = self._storage.sampleable
+        for _ in range(max_rounds):
+            invalid = ~sampleable(indices)
+            if not invalid.any():
+                break
+            indices[invalid] = draw(int(invalid.sum()))
+        return indices
 
     def evict(self):
-        raise NotImplementedError  # TODO
-        if evict_size > len(self._memory):
-            evicted = self._memory
-            self._memory = []
-            self._next_idx = 0
-            return evicted
-        forward_space = len(self._memory) - self._next_idx
-        if evict_size < forward_space:
-            evicted = self._memory[self._next_idx:self._next_idx+evict_size]
-            del self._memory[self._next_idx:self._next_idx+evict_size]
-        else:
-            evicted = self._memory[self._next_idx:]
-            evict_from_left = evict_size - forward_space
-            evicted += self._memory[:evict_from_left]
-            del self._memory[self._next_idx:]
-            del self._memory[:evict_from_left]
-            self._next_idx -= evict_from_left
-        assert len(evicted) == evict_size
-        return evicted
+        """
+        Evicts experiences chosen by the evict policy until memory usage
+        is below evict_to_fraction of memory_budget_bytes.
+        No-op when the replay is within its budget.
+
+        Returns:
+            number of evicted experiences
+        """
+        with self._lock:
+            if not self._over_budget():
+                return 0
+            bytes_used = self._storage.bytes_used
+            target = self.memory_budget * self.evict_to_fraction
+            bytes_per_exp = bytes_used / len(self._storage)
+            num_evict = int(np.ceil((bytes_used - target) / bytes_per_exp))
+            indices = self._evict_policy.select(self._storage,
+                                                num_evict,
+                                                self.priorities())
+            self._remove(indices)
+        self.cumulative_evicted_count += len(indices)
+        return len(indices)
+
+    def priorities(self):
+        """
+        Returns:
+            per-slot priorities for eviction, None if not prioritized
+        """
+        return None
+
+    def _remove(self, indices):
+        """
+            Removes experiences from storage, called with self._lock held
+        """
+        self._storage.remove(indices)
+
+    def _over_budget(self):
+        return (self.memory_budget > 0 and
+                self._storage.bytes_used > self.memory_budget)
+
+    def _passive_evict(self):
+        """
+            Without an evict thread, inserts are responsible for
+            keeping the replay within budget
+        """
+        if not self._evict_interval and self._over_budget():
+            self.evict()
+
+    def save_snapshot(self, folder):
+        """
+            Saves the storage columns, see surreal.replay.snapshot
+        """
+        with self._lock:
+            size = len(self._storage)
+            meta = self._snapshot_meta()
+        save_snapshot(folder,
+                      columns=self._snapshot_columns(),
+                      size=size,
+                      meta=meta,
+                      lock=self._lock,
+                      chunk_bytes=self.session_config.checkpoint.replay
+                                      .snapshot_chunk_bytes)
+
+    def load_snapshot(self, folder):
+        if not self._storage.supports_snapshot:
+            return False
+        snapshot = load_snapshot(folder)
+        if snapshot is None:
+            return False
+        columns, meta = snapshot
+        with self._lock:
+            self._load_snapshot_columns(columns, meta)
+        return True
+
+    def _snapshot_columns(self):
+        return self._storage.columns
+
+    def _snapshot_meta(self):
+        return self._storage.snapshot_meta()
+
+    def _load_snapshot_columns(self, columns, meta):
+        """
+        Called with self._lock held
+
+        Returns:
+            indices of the loaded rows in the snapshot, in slot order
+        """
+        return self._storage.load_snapshot(columns, meta)
 
     def start_sample_condition(self):
         return len(self) > self.learner_config.replay.sampling_start_size
 
+    def storage_metrics(self):
+        metrics = self._storage.metrics()
+        metrics['total_evicted_exps'] = self.cumulative_evicted_count
+        for key, value in self._lock.stats().items():
+            metrics['lock_' + key] = value
+        if self.memory_budget:
+            metrics['bytes_budget'] = self.memory_budget
+            metrics['budget_used_percent'] = \
+                metrics['bytes_used'] / self.memory_budget * 100
+        return metrics
+
     def __len__(self):
-        return len(self._memory)
+        return len(self._storage)
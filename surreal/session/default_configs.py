@@ -19,6 +19,46 @@ BASE_LEARNER_CONFIG = {
         # The replay class to instantiate
         'batch_size': '_int_',
         'replay_shards': 1,
+        # UniformReplay storage backend: 'list', 'serialized', 'columnar'
+        # or 'frame_dedup'
+        # 'serialized' is 'list' with every exp kept in serialized form,
+        # sampled batches are joined instead of serialized again
+        # 'columnar' preallocates numpy arrays from env_config.obs_spec,
+        # only works with ExpSenderWrapperSSAR experiences
+        # 'frame_dedup' is 'columnar' but stores each distinct pixel frame
+        # of a frame stack once
+        'storage': 'list',
+        # 'frame_dedup' only: frame pool size per experience, the pool
+        # grows by this much when it is full
+        'frames_per_exp': 2,
+        # 'list' only: compress pixel observations with this codec,
+        # 'zlib', 'lz4' or 'zstd', see surreal.replay.codec
+        'obs_codec': None,
+        'decompress_threads': 4,
+        # Replay gathers sampled exps into batched arrays,
+        # learner skips aggregation. Requires 'columnar' storage
+        'aggregate_on_replay': False,
+        # PrioritizedReplay only
+        'alpha': 0.6,  # how much prioritization is used
+        'beta': 0.4,  # importance sampling correction
+        'priority_eps': 1e-6,  # added to every priority
+        # Agents send single steps with ExpSenderWrapperStepWithInfo and
+        # TrajectoryReplay builds the n_step windows, PPO only
+        'trajectory': False,
+        # Agents send single steps with ExpSenderWrapperSSAR and the replay
+        # computes n_step returns at sample time, DDPG with 'columnar' storage
+        'nstep_on_replay': False,
+        # Sampled experiences per inserted experience, enforced by delaying
+        # sample replies or blocking collection, see
+        # surreal.replay.rate_limiter. None to sample as fast as possible
+        'samples_per_insert': None,
+        # how many sampled experiences the learner may run ahead of or
+        # behind samples_per_insert, at least batch_size
+        'samples_per_insert_tolerance': 10000,
+        # TieredReplay only
+        'cold_memory_size': 0,  # number of experiences kept on disk
+        'cold_segment_size': 100000,  # experiences per memmap segment file
+        'spill_size': 10000,  # experiences moved from memory to disk at once
     },
     'parameter_publish': {
         # Minimum amount of time (seconds) between two parameter publish
@@ -69,10 +109,53 @@ BASE_SESSION_CONFIG = {
         'max_puller_queue': '_int_',  # replay side: pull queue size
         'evict_interval': '_float_',  # in seconds
         'tensorboard_display': True,  # display replay stats on Tensorboard
+        # Number of batches the replay samples and serializes
+        # ahead of learner requests, 0 to sample on request
+        'sample_ahead_batches': 0,
+        # Evict when stored experiences exceed this many bytes, 0 to disable
+        'memory_budget_bytes': 0,
+        # 'oldest', 'lowest_priority' or 'fair_share' (across agents)
+        'evict_policy': 'oldest',
+        # Eviction frees memory down to this fraction of the budget
+        'evict_to_fraction': 0.95,
+        # All replay shards store experiences in one shared memory block
+        # and sample from each other's experiences, 'columnar' storage only
+        'shared_memory': False,
+        # Name of that block, set by ShardedReplay
+        'shared_memory_name': None,
+        # With sender.obs_cache, number of objects retained for agents
+        # across messages, see ExperienceCollectorServer
+        'obs_cache_size': 1024,
     },
     'sender': {
         'flush_iteration': '_int_',
+        # Also flush this many seconds after the oldest buffered
+        # experience, 0 to only flush every flush_iteration experiences
         'flush_time': '_int_',
+        # Opt-in: hash, serialize and send experiences on a background
+        # thread, env.step() only queues them
+        'background': False,
+        # env.step() blocks while this many experiences are queued
+        'max_queue_size': 1000,
+        # Seconds to wait for the replay to acknowledge a flush before
+        # raising ZmqTimeoutError, negative to wait indefinitely
+        'timeout': 60,
+        # How observations are keyed for deduplication, see ExpBuffer:
+        # 'content', 'serialized' or 'identity'. 'identity' is only
+        # correct if the env never modifies returned observations in place
+        'obs_hash': 'content',
+        # Observations that span two flushes are sent once,
+        # the replay retains them in replay.obs_cache_size.
+        # Requires a single replay shard
+        'obs_cache': False,
+    },
+    # Serialization codec of every channel, see surreal.distributed.codec:
+    # 'global' (U.serialize), 'pyarrow', 'pickle5', 'msgpack' or 'npframe'
+    'codec': {
+        'exp_collection': 'global',  # agents -> replay
+        'sampling': 'global',  # replay -> learner
+        'parameter_publish': 'global',  # learner -> parameter server
+        'parameter_serve': 'global',  # parameter server -> agents
     },
     'ps': {
         'parameter_serving_frontend_host': '_str_',
@@ -123,11 +206,28 @@ BASE_SESSION_CONFIG = {
         'prefetch_processes': '_int_',
         'max_prefetch_queue': '_int_',  # learner side: max number of batches to prefetch
         'max_preprocess_queue': '_int_',  # learner side: max number of batches to preprocess
+        # Batches requested from replay per round trip
+        'batches_per_request': 1,
+        # Sample every batch from all replay shards, proportional to
+        # their size, see surreal.distributed.StratifiedSampler
+        'stratified_sampling': False,
+        # seconds before a shard's share is given to the other shards
+        'shard_timeout': 2.0,
+        # On-policy: keep one sample request at the replay and get each
+        # batch as soon as it is filled, see StreamingDataFetcher
+        'streaming': False,
     },
     'checkpoint': {
         'restore': '_bool_',  # if False, ignore the other configs under 'restore'
         'restore_folder': None,  # if None, use the same session folder.
                             # Otherwise restore ckpt from another experiment dir.
+        'replay': {
+            # Seconds between replay snapshots, 0 to disable.
+            # Replays reload their snapshot when 'restore' is set
+            'snapshot_interval': 0,
+            # Max bytes copied per lock acquisition while snapshotting
+            'snapshot_chunk_bytes': 64 * 1024 * 1024,
+        },
         'learner': {
             'restore_target': '_int_',
             'mode': '_enum[best,history]_',
@@ -37,6 +37,12 @@ def _setup_env():
     os.environ["SYMPH_COLLECTOR_BACKEND_PORT"] = "7007"
     os.environ["SYMPH_PREFETCH_QUEUE_HOST"] = "127.0.0.1"
     os.environ["SYMPH_PREFETCH_QUEUE_PORT"] = "7000"
+    os.environ["SYMPH_PRIORITY_UPDATE_HOST"] = "127.0.0.1"
+    os.environ["SYMPH_PRIORITY_UPDATE_PORT"] = "7010"
+    os.environ["SYMPH_STRATIFIED_SAMPLER_HOST"] = "127.0.0.1"
+    os.environ["SYMPH_STRATIFIED_SAMPLER_PORT"] = "7011"
+    os.environ["SYMPH_SHARD_SAMPLER_0_HOST"] = "127.0.0.1"
+    os.environ["SYMPH_SHARD_SAMPLER_0_PORT"] = "7020"
 
 
 def integration_test(temp_path,
@@ -82,6 +82,13 @@ class TurrealParser(SymphonyParser):
             default='gym:HalfCheetah-v2',
             help='What environment to run'
         )
+        parser.add_argument(
+            '--replay-shards',
+            type=int,
+            default=1,
+            help='number of replay shards, must match '
+                 'learner_config.replay.replay_shards'
+        )
         parser.add_argument(
             '--gpu',
             type=str,
@@ -186,7 +193,8 @@ class TurrealParser(SymphonyParser):
                       ps=ps,
                       tensorboard=tensorboard,
                       tensorplex=tensorplex,
-                      loggerplex=loggerplex)
+                      loggerplex=loggerplex,
+                      replay_shards=args.replay_shards)
         self._setup_gpu(agents=agents,
                         evals=evals,
                         learner=learner,
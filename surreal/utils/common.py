@@ -562,6 +562,60 @@ class TimeRecorder():
         return self.moving_average.cur_value()
 
 
+class TimedLock(object):
+    """
+        Lock that records how long threads wait to acquire it
+        and how long they hold it. Use it as a context manager.
+        Statistics are only updated while holding the lock.
+    """
+    def __init__(self, decay=0.9995):
+        self._lock = Lock()
+        self.wait_time = MovingAverageRecorder(decay)
+        self.hold_time = MovingAverageRecorder(decay)
+        self.acquire_count = 0
+        # acquisitions that found the lock taken
+        self.contended_count = 0
+        # seconds spent waiting, summed over threads
+        self.cumulative_wait = 0.
+        self._acquired_at = None
+
+    def acquire(self):
+        pre_time = time.perf_counter()
+        contended = not self._lock.acquire(blocking=False)
+        if contended:
+            self._lock.acquire()
+        self._acquired_at = time.perf_counter()
+        wait = self._acquired_at - pre_time
+        self.acquire_count += 1
+        self.contended_count += contended
+        self.cumulative_wait += wait
+        self.wait_time.add_value(wait)
+        return True
+
+    def release(self):
+        self.hold_time.add_value(time.perf_counter() - self._acquired_at)
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+    def stats(self):
+        """
+        Returns:
+            {wait_s, hold_s, contended_percent, total_wait_s}
+        """
+        return {
+            'wait_s': self.wait_time.cur_value(),
+            'hold_s': self.hold_time.cur_value(),
+            'contended_percent':
+                self.contended_count / max(self.acquire_count, 1) * 100,
+            'total_wait_s': self.cumulative_wait,
+        }
+
+
 class PeriodicWakeUpWorker(Thread):
     """
     Args:
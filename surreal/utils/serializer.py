@@ -2,10 +2,25 @@
 Serializes numpy and JSON-like objects
 """
 import pickle
+import struct
 import base64
 import hashlib
 import json
+import collections
+import numpy as np
 import pyarrow as pa
+import xxhash
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+if pickle.HIGHEST_PROTOCOL >= 5:
+    pickle5 = pickle
+else:
+    try:
+        import pickle5
+    except ImportError:
+        pickle5 = None
 
 
 def pa_serialize(obj):
@@ -23,14 +38,32 @@ _DESERIALIZER = pa_deserialize
 # _DESERIALIZER = pickle.loads
 
 
-def set_global_serializer(serializer, deserializer):
+_MULTIPART_SERIALIZER = None
+_MULTIPART_DESERIALIZER = None
+
+
+def set_global_serializer(serializer, deserializer,
+                          multipart_serializer=None,
+                          multipart_deserializer=None):
     """
     Call at the start of a script
+
+    multipart_serializer(obj) returns a list of frames,
+    multipart_deserializer(frames) is its inverse. Without them
+    serialize_multipart() sends a single frame from serializer.
+    To send numpy arrays as zero-copy frames:
+        set_global_serializer(npframe_serialize, npframe_deserialize,
+                              npframe_serialize_multipart,
+                              npframe_deserialize_multipart)
     """
     assert callable(serializer) and callable(deserializer)
+    assert (multipart_serializer is None) == (multipart_deserializer is None)
     global _SERIALIZER, _DESERIALIZER
+    global _MULTIPART_SERIALIZER, _MULTIPART_DESERIALIZER
     _SERIALIZER = serializer
     _DESERIALIZER = deserializer
+    _MULTIPART_SERIALIZER = multipart_serializer
+    _MULTIPART_DESERIALIZER = multipart_deserializer
 
 
 def serialize(obj):
@@ -44,9 +77,304 @@ def deserialize(binary):
     """
     We can improve this function if we *really* need more memory efficiency
     """
+    parts = split_joined(binary)
+    if parts is not None:
+        return [_DESERIALIZER(part) for part in parts]
     return _DESERIALIZER(binary)
 
 
+def serialize_multipart(obj):
+    """
+    For sockets that send multipart messages
+
+    Returns:
+        list of frames (bytes-like), see npframe_serialize_multipart
+    """
+    if _MULTIPART_SERIALIZER is None:
+        return [_SERIALIZER(obj)]
+    return _MULTIPART_SERIALIZER(obj)
+
+
+def deserialize_multipart(frames):
+    """
+    Inverse of serialize_multipart
+    """
+    if _MULTIPART_DESERIALIZER is None:
+        assert len(frames) == 1
+        return deserialize(frames[0])
+    return _MULTIPART_DESERIALIZER(frames)
+
+
+_JOINED_MAGIC = b'\x00SURREAL_JOINED\x00'
+_NPFRAME_MAGIC = b'\x00SURREAL_NPFRAME\x00'
+_PICKLE5_MAGIC = b'\x00SURREAL_PICKLE5\x00'
+# msgpack extension types
+_MSGPACK_NDARRAY = 1
+_MSGPACK_NUMPY_SCALAR = 2
+
+
+def join_serialized(binaries):
+    """
+    Joins already serialized objects into one message, deserialize() of
+    the message returns the list of the deserialized objects.
+    Costs one copy of the binaries instead of serializing the objects again.
+    """
+    return _join_frames(_JOINED_MAGIC, binaries)
+
+
+def split_joined(binary):
+    """
+    Returns:
+        memoryviews of the parts of a join_serialized() message,
+        None for any other binary
+    """
+    return _split_frames(_JOINED_MAGIC, binary)
+
+
+def _join_frames(magic, frames):
+    """
+        magic, number of frames, frame lengths, then the frames,
+        each padded to 8 bytes so that arrays over them are aligned
+    """
+    lengths = [len(frame) for frame in frames]
+    header = struct.pack('<Q{}Q'.format(len(lengths)), len(lengths), *lengths)
+    parts = [magic, header]
+    offset = len(magic) + len(header)
+    for frame in frames:
+        padding = -offset % 8
+        parts.append(b'\x00' * padding)
+        parts.append(frame)
+        offset += padding + len(frame)
+    return b''.join(parts)
+
+
+def _split_frames(magic, binary):
+    """
+    Returns:
+        memoryviews of the frames of a _join_frames(magic, ...) binary,
+        None if binary does not start with magic
+    """
+    view = memoryview(binary).cast('B')
+    start = len(magic)
+    if view[:start].tobytes() != magic:
+        return None
+    count, = struct.unpack_from('<Q', view, start)
+    lengths = struct.unpack_from('<{}Q'.format(count), view, start + 8)
+    offset = start + 8 * (count + 1)
+    frames = []
+    for length in lengths:
+        offset += -offset % 8
+        frames.append(view[offset:offset + length])
+        offset += length
+    return frames
+
+
+def npframe_serialize_multipart(obj):
+    """
+    Wire format that does not copy numpy arrays: a small pickled header
+    with the structure of obj and one frame per numpy array, a view of
+    its memory. Send the frames as one multipart zmq message with
+    copy=False. dict, OrderedDict, list and tuple containers are
+    traversed, arrays inside other objects are pickled in the header.
+    An array that appears several times is sent once.
+
+    Returns:
+        list of frames, the header (bytes) then memoryviews
+    """
+    buffers = []
+    header = pickle.dumps(_extract_arrays(obj, buffers, {}),
+                          protocol=pickle.HIGHEST_PROTOCOL)
+    return [header] + buffers
+
+
+def npframe_deserialize_multipart(frames):
+    """
+    Inverse of npframe_serialize_multipart, arrays are read-only views
+    of the frames (np.frombuffer), no data is copied
+
+    Args:
+        frames: list of bytes-like objects, e.g. zmq.Frame.buffer
+    """
+    return _restore_arrays(pickle.loads(frames[0]), frames[1:], {})
+
+
+def npframe_serialize(obj):
+    """
+    npframe_serialize_multipart frames joined into one binary, for
+    set_global_serializer and single frame sockets. Costs one copy of
+    the arrays, like pa_serialize
+    """
+    return _join_frames(_NPFRAME_MAGIC, npframe_serialize_multipart(obj))
+
+
+def npframe_deserialize(binary):
+    """
+    Inverse of npframe_serialize, arrays are read-only views of binary
+    """
+    return npframe_deserialize_multipart(_split_frames(_NPFRAME_MAGIC, binary))
+
+
+class _ArrayFrame(object):
+    """
+        Stands for a numpy array in the header of an npframe message,
+        index is the position of its frame after the header
+    """
+    __slots__ = ('index', 'dtype', 'shape')
+
+    def __init__(self, index, dtype, shape):
+        self.index = index
+        self.dtype = dtype
+        self.shape = shape
+
+    def __reduce__(self):
+        return _ArrayFrame, (self.index, self.dtype, self.shape)
+
+
+def _extract_arrays(obj, buffers, memo):
+    """
+    Args:
+        buffers: filled with the memory of the arrays
+        memo: id of the arrays already in buffers -> their _ArrayFrame
+    """
+    cls = type(obj)
+    if cls is dict:
+        return {key: _extract_arrays(value, buffers, memo)
+                for key, value in obj.items()}
+    if cls is list:
+        return [_extract_arrays(value, buffers, memo) for value in obj]
+    if cls is tuple:
+        return tuple([_extract_arrays(value, buffers, memo)
+                      for value in obj])
+    if cls is collections.OrderedDict:
+        return collections.OrderedDict(
+            [(key, _extract_arrays(value, buffers, memo))
+             for key, value in obj.items()])
+    if cls is np.ndarray and not obj.dtype.hasobject:
+        frame = memo.get(id(obj))
+        if frame is None:
+            buffers.append(_array_buffer(obj))
+            frame = _ArrayFrame(len(buffers) - 1, obj.dtype, obj.shape)
+            memo[id(obj)] = frame
+        return frame
+    return obj
+
+
+def _array_buffer(array):
+    """
+        Bytes of the array, without copy if it is C-contiguous
+    """
+    try:
+        return array.data.cast('B')
+    except (TypeError, ValueError):
+        # not contiguous, empty or a dtype without buffer protocol support
+        return np.ascontiguousarray(array).reshape(-1).view(np.uint8).data
+
+
+def _restore_arrays(obj, frames, memo):
+    """
+    Args:
+        memo: frame index -> array already restored
+    """
+    cls = type(obj)
+    if cls is dict:
+        return {key: _restore_arrays(value, frames, memo)
+                for key, value in obj.items()}
+    if cls is list:
+        return [_restore_arrays(value, frames, memo) for value in obj]
+    if cls is tuple:
+        return tuple([_restore_arrays(value, frames, memo)
+                      for value in obj])
+    if cls is collections.OrderedDict:
+        return collections.OrderedDict(
+            [(key, _restore_arrays(value, frames, memo))
+             for key, value in obj.items()])
+    if cls is _ArrayFrame:
+        array = memo.get(obj.index)
+        if array is None:
+            array = np.frombuffer(frames[obj.index],
+                                  dtype=obj.dtype).reshape(obj.shape)
+            memo[obj.index] = array
+        return array
+    return obj
+
+
+def pickle5_serialize_multipart(obj):
+    """
+    Pickle protocol 5 with out-of-band buffers: the pickle, then one
+    frame per contiguous numpy array (or other PickleBuffer), a view of
+    its memory. Non-contiguous arrays are copied into the pickle.
+    Needs python >= 3.8 or the pickle5 package.
+    """
+    buffers = []
+    header = pickle5.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return [header] + [buffer.raw() for buffer in buffers]
+
+
+def pickle5_deserialize_multipart(frames):
+    """
+    Inverse of pickle5_serialize_multipart, arrays are views of the frames
+    """
+    return pickle5.loads(frames[0], buffers=frames[1:])
+
+
+def pickle5_serialize(obj):
+    """
+    pickle5_serialize_multipart frames joined into one binary
+    """
+    return _join_frames(_PICKLE5_MAGIC, pickle5_serialize_multipart(obj))
+
+
+def pickle5_deserialize(binary):
+    """
+    Inverse of pickle5_serialize, arrays are views of binary
+    """
+    return pickle5_deserialize_multipart(
+        _split_frames(_PICKLE5_MAGIC, binary))
+
+
+def msgpack_serialize(obj):
+    """
+    msgpack with numpy arrays and scalars as extension types. Tuples are
+    deserialized as lists and dict subclasses as dicts, arrays of objects
+    and of records are not supported. Needs msgpack >= 1.0.
+    """
+    return msgpack.packb(obj, default=_msgpack_default, use_bin_type=True)
+
+
+def msgpack_deserialize(binary):
+    """
+    Inverse of msgpack_serialize, arrays are read-only
+    """
+    return msgpack.unpackb(binary, ext_hook=_msgpack_ext_hook, raw=False,
+                           strict_map_key=False)
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, (np.ndarray, np.generic)):
+        if obj.dtype.hasobject or obj.dtype.fields is not None:
+            raise TypeError('msgpack cannot serialize {} arrays'
+                            .format(obj.dtype))
+        header = msgpack.packb((obj.dtype.str, obj.shape))
+        code = (_MSGPACK_NDARRAY if isinstance(obj, np.ndarray)
+                else _MSGPACK_NUMPY_SCALAR)
+        return msgpack.ExtType(code, b''.join([
+            struct.pack('<I', len(header)), header, obj.tobytes()]))
+    # e.g. memoryview parts of join_serialized() messages
+    return memoryview(obj)
+
+
+def _msgpack_ext_hook(code, data):
+    if code not in (_MSGPACK_NDARRAY, _MSGPACK_NUMPY_SCALAR):
+        return msgpack.ExtType(code, data)
+    header_size, = struct.unpack_from('<I', data)
+    dtype, shape = msgpack.unpackb(data[4:4 + header_size], raw=False)
+    array = np.frombuffer(data, dtype=dtype,
+                          offset=4 + header_size).reshape(shape)
+    if code == _MSGPACK_NUMPY_SCALAR:
+        return array[()]
+    return array
+
+
 def string_hash(s):
     assert isinstance(s, str)
     return binary_hash(s.encode('utf-8'))
@@ -70,6 +398,21 @@ def pyobj_hash(obj):
     return binary_hash(serialize(obj))
 
 
+def array_hash(obj):
+    """
+    Low collision hash of a numpy array's dtype, shape and content.
+    Hashes the array memory directly with xxh3_128 instead of
+    serializing it first.
+    Other objects are hashed with pyobj_hash.
+    """
+    if not isinstance(obj, np.ndarray) or obj.dtype.hasobject:
+        return pyobj_hash(obj)
+    h = xxhash.xxh3_128()
+    h.update('{}{}'.format(obj.dtype.str, obj.shape).encode('utf-8'))
+    h.update(np.ascontiguousarray(obj).data)
+    return base64.b64encode(h.digest())[:16].decode('utf-8')
+
+
 def bytes2str(bytestring):
     if isinstance(bytestring, str):
         return bytestring
@@ -0,0 +1,137 @@
+"""
+Unit tests of the serialization codecs and their selection per channel.
+
+Usage:
+    python -m pytest test/test_codec.py
+"""
+import numpy as np
+import surreal.utils as U
+from surreal.session import Config, ConfigError, LOCAL_SESSION_CONFIG
+from surreal.distributed.codec import CODECS, make_codec, NpframeCodec
+from surreal.distributed.exp_sender import ExpBuffer
+from surreal.distributed.exp_collector import ExperienceCollectorServer
+from surreal.distributed.data_fetcher import (_split_batches,
+                                              _preprocess_batches)
+
+CHANNELS = ['exp_collection', 'sampling', 'parameter_publish',
+            'parameter_serve']
+
+
+def available_codecs():
+    """
+        Codecs whose dependencies are installed
+    """
+    codecs = {}
+    for name in CODECS:
+        try:
+            codecs[name] = make_codec(name)
+        except ConfigError:
+            print('skipping codec {}: not installed'.format(name))
+    return codecs
+
+
+def make_message():
+    return {
+        'obs': np.arange(12, dtype=np.float32).reshape(3, 4),
+        'pixels': np.arange(60, dtype=np.uint8).reshape(3, 4, 5)[:, ::2],
+        'info': ['step', 7],
+        'reward': 2.5,
+    }
+
+
+def assert_message_equal(received, sent):
+    assert set(received) == set(sent)
+    for key in ['obs', 'pixels']:
+        assert received[key].dtype == sent[key].dtype
+        assert np.array_equal(received[key], sent[key])
+    assert list(received['info']) == sent['info']
+    assert received['reward'] == sent['reward']
+
+
+def test_unknown_codec_raises():
+    try:
+        make_codec('json')
+    except ConfigError:
+        pass
+    else:
+        assert False, 'expected ConfigError'
+
+
+def test_codecs_round_trip():
+    message = make_message()
+    for name, codec in available_codecs().items():
+        assert_message_equal(codec.deserialize(codec.serialize(message)),
+                             message)
+        frames = codec.serialize_multipart(message)
+        assert_message_equal(
+            codec.deserialize_multipart([bytes(f) for f in frames]), message)
+        # joined binaries are read back as a list
+        joined = U.join_serialized([codec.serialize(message),
+                                    codec.serialize({'reward': 0.})])
+        received = codec.deserialize(joined)
+        assert len(received) == 2, name
+        assert_message_equal(received[0], message)
+        assert received[1] == {'reward': 0.}
+
+
+def test_multi_batch_reply_is_decoded_once():
+    message = make_message()
+    for name, codec in available_codecs().items():
+        # batches of a serialized storage are joined experiences
+        batches = [codec.serialize(message),
+                   U.join_serialized([codec.serialize(message),
+                                      codec.serialize({'reward': 0.})])]
+        reply = U.join_serialized(batches)
+        parts = _split_batches(reply)
+        assert parts == [bytes(batch) for batch in batches], name
+        received = _preprocess_batches(lambda batch: batch,
+                                       codec.deserialize, parts)
+        assert_message_equal(received[0], message)
+        assert_message_equal(received[1][0], message)
+        assert received[1][1] == {'reward': 0.}
+        # the codec also reads the reply as a whole
+        assert_message_equal(codec.deserialize(reply)[1][0], message)
+
+
+def make_session_config(codec):
+    return Config({
+        'folder': '/tmp/surreal/codec',
+        'sender': {'flush_iteration': 100},
+        'codec': codec,
+    }).extend(LOCAL_SESSION_CONFIG)
+
+
+def test_channels_default_to_global():
+    session_config = make_session_config({})
+    for channel in CHANNELS:
+        assert session_config.codec[channel] == 'global'
+    session_config = make_session_config({'exp_collection': 'npframe'})
+    assert session_config.codec.exp_collection == 'npframe'
+    assert session_config.codec.sampling == 'global'
+
+
+def test_exp_collection_uses_configured_codec():
+    buffer = ExpBuffer(obs_hash='serialized', codec='npframe')
+    server = ExperienceCollectorServer(host='localhost', port=7201,
+                                       exp_handler=None, codec='npframe')
+    assert isinstance(buffer._codec, NpframeCodec)
+    assert isinstance(server._codec, NpframeCodec)
+    obs = np.arange(8, dtype=np.float32)
+    buffer.add({'obs': [obs]}, {'reward': 1.})
+    frames = buffer.flush()
+    # npframe sends the observation in its own frame
+    assert len(frames) == 2
+    exp_list, ob_storage, retain = server._codec.deserialize_multipart(
+        [bytes(f) for f in frames])
+    assert exp_list[0]['reward'] == 1.
+    obs_hash, = exp_list[0]['obs_hash']
+    assert np.array_equal(ob_storage[obs_hash], obs)
+    assert retain == []
+
+
+if __name__ == '__main__':
+    print('BEGIN CODEC TEST')
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('PASSED')
@@ -0,0 +1,75 @@
+"""
+Unit tests of the replay eviction policies.
+
+Usage:
+    python -m pytest test/test_evict_policy.py
+"""
+import numpy as np
+from surreal.session import ConfigError
+from surreal.replay.storage import ListStorage
+from surreal.replay.evict_policy import make_evict_policy
+
+
+def make_exp(t, agent_id=0):
+    return {'obs': None, 'action': None, 'reward': float(t),
+            'done': False, 'info': {}, 'agent_id': agent_id}
+
+
+def make_storage(agent_ids, capacity=16):
+    storage = ListStorage(capacity)
+    for t, agent_id in enumerate(agent_ids):
+        storage.insert(make_exp(t, agent_id))
+    return storage
+
+
+def evicted_rewards(storage, indices):
+    return sorted(float(storage.get([i])[0]['reward']) for i in indices)
+
+
+def test_oldest_evicts_smallest_insert_ids():
+    storage = make_storage([0] * 8, capacity=8)
+    for t in range(8, 11):
+        storage.insert(make_exp(t))
+    policy = make_evict_policy('oldest')
+    assert evicted_rewards(storage, policy.select(storage, 3)) == [3, 4, 5]
+    assert len(policy.select(storage, 20)) == 8
+
+
+def test_lowest_priority_evicts_smallest_priorities():
+    storage = make_storage([0] * 6)
+    priorities = np.array([0.5, 3., 0.1, 2., 0.2, 1.])
+    policy = make_evict_policy('lowest_priority')
+    assert policy.requires_priorities
+    assert sorted(policy.select(storage, 3, priorities)) == [0, 2, 4]
+
+
+def test_fair_share_trims_largest_agents_oldest_first():
+    # agent 0 owns 6 slots, agent 1 owns 3 and agent 2 owns 1
+    agent_ids = [0, 1, 0, 0, 2, 1, 0, 0, 1, 0]
+    storage = make_storage(agent_ids)
+    policy = make_evict_policy('fair_share')
+    # 7 are kept: agent 2 keeps its one, agents 0 and 1 three each
+    evicted = policy.select(storage, 3)
+    assert evicted_rewards(storage, evicted) == [0, 2, 3]
+    # 4 are kept: 1 for agent 2, the other agents are capped at 1
+    evicted = policy.select(storage, 6)
+    assert len(evicted) == 7
+    kept = sorted(set(range(10)) - set(evicted))
+    assert evicted_rewards(storage, kept) == [4, 8, 9]
+
+
+def test_unknown_policy_raises():
+    try:
+        make_evict_policy('random')
+    except ConfigError:
+        pass
+    else:
+        assert False, 'expected ConfigError'
+
+
+if __name__ == '__main__':
+    print('BEGIN EVICT POLICY TEST')
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('PASSED')
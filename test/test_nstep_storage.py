@@ -0,0 +1,165 @@
+"""
+Unit tests of the n-step returns computed by NStepColumnarStorage.
+
+Usage:
+    python -m pytest test/test_nstep_storage.py
+"""
+import os
+import numpy as np
+from surreal.session import (Config, ConfigError, BASE_LEARNER_CONFIG,
+                             BASE_ENV_CONFIG, LOCAL_SESSION_CONFIG)
+from surreal.replay import storage as replay_storage
+from surreal.replay.storage import NStepColumnarStorage
+from surreal.replay import TieredReplay
+
+OBS_SPEC = {'low_dim': {'flat_inputs': [4]}}
+ACTION_SPEC = {'type': 'continuous', 'dim': [2]}
+GAMMA = 0.5
+
+
+def make_exp(t, done=False, agent_id=0):
+    t = float(t)
+    return {
+        'obs': [{'low_dim': {'flat_inputs': np.full(4, t, np.float32)}},
+                {'low_dim': {'flat_inputs': np.full(4, t + 1, np.float32)}}],
+        'action': np.full(2, t, np.float32),
+        'reward': t + 1,
+        'done': done,
+        'info': {},
+        'agent_id': agent_id,
+    }
+
+
+def make_storage(capacity=16, n_step=3):
+    return NStepColumnarStorage(capacity, OBS_SPEC, ACTION_SPEC,
+                                n_step=n_step, gamma=GAMMA)
+
+
+def discounted(rewards):
+    return sum(GAMMA ** k * r for k, r in enumerate(rewards))
+
+
+def test_returns_sum_discounted_rewards():
+    storage = make_storage()
+    storage.insert_batch([make_exp(t) for t in range(6)])
+    indices = np.arange(4)
+    batch = storage.gather(indices)
+    expected = [discounted([t + 1, t + 2, t + 3]) for t in indices]
+    assert np.allclose(batch['rewards'][:, 0], expected)
+    assert not batch['dones'].any()
+    # obs_next is the one of the transition n_step - 1 steps later
+    assert np.array_equal(batch['obs']['low_dim']['flat_inputs'][:, 0],
+                          indices)
+    assert np.array_equal(batch['obs_next']['low_dim']['flat_inputs'][:, 0],
+                          indices + 3)
+    # the last two transitions miss successors
+    assert list(storage.sampleable(np.arange(6))) == [True] * 4 + [False] * 2
+
+
+def test_returns_truncate_at_done():
+    storage = make_storage()
+    exps = [make_exp(0), make_exp(1, done=True), make_exp(2), make_exp(3),
+            make_exp(4)]
+    storage.insert_batch(exps)
+    batch = storage.gather(np.arange(3))
+    assert np.allclose(batch['rewards'][:, 0],
+                       [discounted([1, 2]), 2, discounted([3, 4, 5])])
+    assert list(batch['dones'][:, 0] != 0) == [True, True, False]
+    # truncated transitions bootstrap from the last step of the episode
+    assert list(batch['obs_next']['low_dim']['flat_inputs'][:, 0]) \
+        == [2, 2, 5]
+    assert list(storage.sampleable(np.arange(5))) \
+        == [True, True, True, False, False]
+
+
+def test_agents_are_linked_separately():
+    storage = make_storage(n_step=2)
+    # two agents interleave, agent 1 ends its episode at t = 3
+    storage.insert_batch([make_exp(0, agent_id=0),
+                          make_exp(1, agent_id=1),
+                          make_exp(2, agent_id=0),
+                          make_exp(3, done=True, agent_id=1),
+                          make_exp(4, agent_id=0),
+                          make_exp(5, agent_id=1)])
+    batch = storage.gather(np.arange(4))
+    assert np.allclose(batch['rewards'][:, 0],
+                       [discounted([1, 3]), discounted([2, 4]),
+                        discounted([3, 5]), 4])
+    assert list(storage.sampleable(np.arange(6))) \
+        == [True, True, True, True, False, False]
+
+
+def test_links_follow_the_ring():
+    storage = make_storage(capacity=4)
+    storage.insert_batch([make_exp(t) for t in range(6)])
+    # slots 2, 3, 0, 1 hold t = 2, 3, 4, 5
+    batch = storage.gather(np.array([2]))
+    assert np.allclose(batch['rewards'][:, 0], [discounted([3, 4, 5])])
+    assert list(storage.sampleable(np.array([2, 3, 0, 1]))) \
+        == [True, True, False, False]
+    # t = 6 overwrites t = 2 and ends the episode of t = 5
+    storage.insert(make_exp(6, done=True))
+    assert np.allclose(storage.gather(np.array([1]))['rewards'][:, 0],
+                       [discounted([6, 7])])
+
+
+def make_configs(replay_shards):
+    learner_config = Config({
+        'model': {},
+        'algo': {'gamma': GAMMA, 'n_step': 3},
+        'replay': {
+            'storage': 'columnar',
+            'nstep_on_replay': True,
+            'batch_size': 8,
+            'memory_size': 16,
+            'replay_shards': replay_shards,
+        },
+    }).extend(BASE_LEARNER_CONFIG)
+    env_config = Config({
+        'env_name': 'nstep',
+        'obs_spec': OBS_SPEC,
+        'action_spec': ACTION_SPEC,
+    }).extend(BASE_ENV_CONFIG)
+    session_config = Config({
+        'folder': '/tmp/surreal/nstep_storage',
+        'sender': {'flush_iteration': 100},
+    }).extend(LOCAL_SESSION_CONFIG)
+    return learner_config, env_config, session_config
+
+
+def test_make_storage_requires_single_shard():
+    storage = replay_storage.make_storage(*make_configs(replay_shards=1))
+    assert isinstance(storage, NStepColumnarStorage)
+    assert storage.n_step == 3
+    # shards only see part of each agent's steps
+    try:
+        replay_storage.make_storage(*make_configs(replay_shards=3))
+    except ConfigError:
+        pass
+    else:
+        assert False, 'expected ConfigError'
+
+
+def test_tiered_replay_rejects_nstep_storage():
+    for name, port in [('SYMPH_COLLECTOR_BACKEND_PORT', 7102),
+                       ('SYMPH_SAMPLER_BACKEND_PORT', 7104),
+                       ('SYMPH_LOGGERPLEX_PORT', 7109),
+                       ('SYMPH_TENSORPLEX_PORT', 7108)]:
+        os.environ.setdefault(name, str(port))
+    os.environ.setdefault('SYMPH_LOGGERPLEX_HOST', 'localhost')
+    os.environ.setdefault('SYMPH_TENSORPLEX_HOST', 'localhost')
+    # spilling to the cold tier removes experiences from the storage
+    try:
+        TieredReplay(*make_configs(replay_shards=1))
+    except ConfigError:
+        pass
+    else:
+        assert False, 'expected ConfigError'
+
+
+if __name__ == '__main__':
+    print('BEGIN NSTEP STORAGE TEST')
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('PASSED')
@@ -0,0 +1,156 @@
+"""
+Unit tests of PrioritizedReplay priority updates and of the
+priority update channel from learner to replay.
+
+Usage:
+    python -m pytest test/test_prioritized_replay.py
+"""
+import os
+import numpy as np
+from surreal.session import (Config, BASE_LEARNER_CONFIG, BASE_ENV_CONFIG,
+                             LOCAL_SESSION_CONFIG)
+from surreal.replay import PrioritizedReplay
+from surreal.distributed import PriorityReceiver
+
+OBS_DIM = 4
+ACTION_DIM = 2
+
+
+def make_replay(memory_size=16, alpha=1.0, beta=1.0):
+    for name, port in [('SYMPH_COLLECTOR_BACKEND_PORT', 7102),
+                       ('SYMPH_SAMPLER_BACKEND_PORT', 7104),
+                       ('SYMPH_PRIORITY_UPDATE_PORT', 7110),
+                       ('SYMPH_LOGGERPLEX_PORT', 7109),
+                       ('SYMPH_TENSORPLEX_PORT', 7108)]:
+        os.environ.setdefault(name, str(port))
+    for name in ['SYMPH_PRIORITY_UPDATE_HOST', 'SYMPH_LOGGERPLEX_HOST',
+                 'SYMPH_TENSORPLEX_HOST']:
+        os.environ.setdefault(name, 'localhost')
+
+    learner_config = Config({
+        'model': {},
+        'algo': {'gamma': 0.99},
+        'replay': {
+            'batch_size': 8,
+            'memory_size': memory_size,
+            'sampling_start_size': 0,
+            'storage': 'columnar',
+            'alpha': alpha,
+            'beta': beta,
+            'priority_eps': 0.,
+        },
+    }).extend(BASE_LEARNER_CONFIG)
+    env_config = Config({
+        'env_name': 'prioritized',
+        'obs_spec': {'low_dim': {'flat_inputs': [OBS_DIM]}},
+        'action_spec': {'type': 'continuous', 'dim': [ACTION_DIM]},
+    }).extend(BASE_ENV_CONFIG)
+    session_config = Config({
+        'folder': '/tmp/surreal/prioritized_replay',
+        'replay': {'tensorboard_display': False},
+        'sender': {'flush_iteration': 100},
+    }).extend(LOCAL_SESSION_CONFIG)
+    return PrioritizedReplay(learner_config, env_config, session_config)
+
+
+def make_exp(t):
+    t = float(t)
+    return {
+        'obs': [{'low_dim': {'flat_inputs': np.full(OBS_DIM, t, np.float32)}},
+                {'low_dim': {'flat_inputs':
+                             np.full(OBS_DIM, t + 1, np.float32)}}],
+        'action': np.full(ACTION_DIM, t, np.float32),
+        'reward': t,
+        'done': False,
+        'info': {},
+    }
+
+
+def test_sampling_follows_updated_priorities():
+    np.random.seed(0)
+    replay = make_replay()
+    replay.insert_batch([make_exp(t) for t in range(8)])
+    priorities = np.array([1, 1, 1, 1, 1, 1, 1, 9], dtype=np.float64)
+    replay.update_priorities(np.arange(8), priorities)
+    counts = np.zeros(8)
+    for _ in range(100):
+        sample = replay.sample(32)
+        np.add.at(counts, sample['priority']['indices'], 1)
+    # slot 7 holds 9 / 16 of the total priority
+    assert abs(counts[7] / counts.sum() - 9 / 16) < 0.05
+    # weights are (N * P(i)) ^ -beta, normalized by the largest one
+    sample = replay.sample(64)
+    indices = sample['priority']['indices']
+    weights = sample['priority']['weights'][:, 0]
+    expected = priorities[indices] ** -1. / priorities.min() ** -1.
+    assert np.allclose(weights, expected)
+
+
+def test_new_experiences_get_max_priority():
+    replay = make_replay()
+    replay.insert_batch([make_exp(t) for t in range(4)])
+    replay.update_priorities([0, 1], [5., 0.5])
+    replay.insert(make_exp(4))
+    assert replay.priorities()[4] == 5.
+    # updates for slots that are not stored are dropped
+    replay.update_priorities([4, 100, -1], [2., 3., 4.])
+    assert np.allclose(replay.priorities(), [5., 0.5, 1., 1., 2.])
+
+
+def test_priorities_move_with_evicted_slots():
+    replay = make_replay()
+    replay.insert_batch([make_exp(t) for t in range(6)])
+    replay.update_priorities(np.arange(6), np.arange(1, 7))
+    with replay._lock:
+        replay._remove([0, 2])
+    rewards = replay._storage.gather(np.arange(4))['rewards'][:, 0]
+    # every experience keeps the priority it was given, t + 1
+    assert np.allclose(replay.priorities(), rewards + 1)
+    assert np.isclose(replay._it_sum.sum(), (rewards + 1).sum())
+    assert replay._it_min.min() == rewards.min() + 1
+
+
+def test_updates_for_overwritten_slots_are_dropped():
+    replay = make_replay(memory_size=4)
+    replay.insert_batch([make_exp(t) for t in range(4)])
+    sample = replay.sample(16)
+    indices = sample['priority']['indices']
+    insert_ids = sample['priority']['insert_ids']
+    assert np.array_equal(insert_ids, indices)
+    # slots 0 and 1 now hold experiences 4 and 5
+    replay.insert_batch([make_exp(t) for t in range(4, 6)])
+    replay.update_priorities(indices, np.full(16, 3.), insert_ids)
+    updated = np.unique(indices[indices >= 2])
+    expected = np.ones(4)
+    expected[updated] = 3.
+    assert np.allclose(replay.priorities(), expected)
+
+
+def test_updates_for_moved_slots_are_dropped():
+    replay = make_replay()
+    replay.insert_batch([make_exp(t) for t in range(6)])
+    with replay._lock:
+        replay._remove([1])
+    # experience 5 moved into slot 1, experience 1 is gone
+    replay.update_priorities([1, 2], [4., 4.], insert_ids=[1, 2])
+    assert np.allclose(replay.priorities(), [1., 1., 4., 1., 1.])
+
+
+def test_receiver_handles_its_shard_only():
+    received = []
+    receiver = PriorityReceiver(
+        host='localhost', port=7111, replay_index=1,
+        handler=lambda indices, priorities, insert_ids:
+            received.append((list(indices), list(priorities),
+                             list(insert_ids))))
+    receiver._handle((0, [1, 2], [11, 12], [0.5, 0.5]))
+    receiver._handle((1, [3], [13], [2.]))
+    assert received == [([3], [2.], [13])]
+
+
+if __name__ == '__main__':
+    print('BEGIN PRIORITIZED REPLAY TEST')
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('PASSED')
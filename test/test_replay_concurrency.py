@@ -0,0 +1,190 @@
+"""
+Stress test of concurrent insert and sample on UniformReplay.
+
+Runs N inserter threads (the collector path, insert_batch) against
+M sampler threads (sample) for every combination of --inserters and
+--samplers. Every experience carries one value t in all of its fields,
+a sample that mixes two experiences fails the test. Prints one json
+line per run with throughput, the replay lock statistics and the rows
+that samplers copied again because they raced with a write, so that
+contention can be compared as load grows.
+
+Usage:
+    python -m pytest test/test_replay_concurrency.py
+    python test/test_replay_concurrency.py --inserters 1 4 --samplers 1 4
+"""
+import os
+import json
+import time
+import argparse
+import threading
+import psutil
+import numpy as np
+from surreal.session import (Config, BASE_LEARNER_CONFIG, BASE_ENV_CONFIG,
+                             LOCAL_SESSION_CONFIG)
+from surreal.replay import UniformReplay
+
+OBS_DIM = 256
+ACTION_DIM = 8
+
+
+def make_replay(storage, aggregate_on_replay, memory_size):
+    for name, port in [('SYMPH_COLLECTOR_BACKEND_PORT', 7102),
+                       ('SYMPH_SAMPLER_BACKEND_PORT', 7104),
+                       ('SYMPH_LOGGERPLEX_PORT', 7109),
+                       ('SYMPH_TENSORPLEX_PORT', 7108)]:
+        os.environ.setdefault(name, str(port))
+    os.environ.setdefault('SYMPH_LOGGERPLEX_HOST', 'localhost')
+    os.environ.setdefault('SYMPH_TENSORPLEX_HOST', 'localhost')
+
+    learner_config = Config({
+        'model': {},
+        'algo': {'gamma': 0.99},
+        'replay': {
+            'batch_size': 64,
+            'memory_size': memory_size,
+            'sampling_start_size': 1000,
+            'storage': storage,
+            'aggregate_on_replay': aggregate_on_replay,
+        },
+    }).extend(BASE_LEARNER_CONFIG)
+    env_config = Config({
+        'env_name': 'stress',
+        'obs_spec': {'low_dim': {'flat_inputs': [OBS_DIM]}},
+        'action_spec': {'type': 'continuous', 'dim': [ACTION_DIM]},
+    }).extend(BASE_ENV_CONFIG)
+    session_config = Config({
+        'folder': '/tmp/surreal/replay_concurrency',
+        'replay': {'tensorboard_display': False},
+        'sender': {'flush_iteration': 100},
+    }).extend(LOCAL_SESSION_CONFIG)
+    return UniformReplay(learner_config, env_config, session_config)
+
+
+def make_exp(t, agent_id):
+    t = float(t)
+    return {
+        'obs': [{'low_dim': {'flat_inputs': np.full(OBS_DIM, t, np.float32)}},
+                {'low_dim': {'flat_inputs':
+                             np.full(OBS_DIM, t + 1, np.float32)}}],
+        'action': np.full(ACTION_DIM, t, np.float32),
+        'reward': t,
+        'done': False,
+        'info': {},
+        'agent_id': agent_id,
+    }
+
+
+def count_torn(sample):
+    """
+        Number of sampled experiences whose fields disagree on t
+    """
+    if isinstance(sample, dict):
+        t = sample['rewards'][:, 0]
+        obs = sample['obs']['low_dim']['flat_inputs']
+        obs_next = sample['obs_next']['low_dim']['flat_inputs']
+        actions = sample['actions']
+    else:
+        t = np.array([exp['reward'] for exp in sample], dtype=np.float32)
+        obs = np.stack([exp['obs'][0]['low_dim']['flat_inputs']
+                        for exp in sample])
+        obs_next = np.stack([exp['obs'][1]['low_dim']['flat_inputs']
+                             for exp in sample])
+        actions = np.stack([exp['action'] for exp in sample])
+    ok = ((obs == t[:, None]).all(axis=1)
+          & (obs_next == t[:, None] + 1).all(axis=1)
+          & (actions == t[:, None]).all(axis=1))
+    return int((~ok).sum())
+
+
+def run(replay, num_inserters, num_samplers, insert_batch, sample_batch,
+        duration):
+    stop = threading.Event()
+    inserted = [0] * num_inserters
+    sampled = [0] * num_samplers
+    torn = [0] * num_samplers
+
+    def insert_loop(i):
+        step = 0
+        while not stop.is_set():
+            # distinct t per experience, exactly representable in float32
+            exps = [make_exp(((step + k) * num_inserters + i) % 2 ** 22, i)
+                    for k in range(insert_batch)]
+            replay._insert_batch_wrapper(exps)
+            step += insert_batch
+            inserted[i] += insert_batch
+
+    def sample_loop(i):
+        replay._wait_sample_condition()
+        while not stop.is_set():
+            sample = replay.sample(sample_batch)
+            torn[i] += count_torn(sample)
+            sampled[i] += sample_batch
+
+    threads = ([threading.Thread(target=insert_loop, args=(i,), daemon=True)
+                for i in range(num_inserters)] +
+               [threading.Thread(target=sample_loop, args=(i,), daemon=True)
+                for i in range(num_samplers)])
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    result = {
+        'benchmark': 'replay_concurrency',
+        'inserters': num_inserters,
+        'samplers': num_samplers,
+        'exps_in_per_s': sum(inserted) / duration,
+        'exps_out_per_s': sum(sampled) / duration,
+        'torn_exps': sum(torn),
+        'retried_rows': replay._storage.metrics().get('torn_reads', 0),
+    }
+    for key, value in replay._lock.stats().items():
+        result['lock_' + key] = value
+    return result
+
+
+def test_concurrent_insert_and_sample():
+    # a small ring so that samplers keep racing with overwrites
+    for storage, aggregate_on_replay in [('columnar', True),
+                                         ('columnar', False),
+                                         ('list', False)]:
+        replay = make_replay(storage, aggregate_on_replay, memory_size=1500)
+        result = run(replay, num_inserters=2, num_samplers=2,
+                     insert_batch=32, sample_batch=64, duration=1.)
+        assert result['exps_out_per_s'] > 0
+        assert result['torn_exps'] == 0, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--inserters', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--samplers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--storage', default='columnar',
+                        choices=['list', 'columnar'])
+    parser.add_argument('--aggregate-on-replay', action='store_true')
+    parser.add_argument('--memory-size', type=int, default=20000)
+    parser.add_argument('--insert-batch', type=int, default=32)
+    parser.add_argument('--sample-batch', type=int, default=256)
+    parser.add_argument('--duration', type=float, default=5.)
+    args = parser.parse_args()
+
+    for num_inserters in args.inserters:
+        for num_samplers in args.samplers:
+            replay = make_replay(args.storage,
+                                 args.aggregate_on_replay,
+                                 args.memory_size)
+            result = run(replay, num_inserters, num_samplers,
+                         args.insert_batch, args.sample_batch, args.duration)
+            print(json.dumps(result))
+            assert result['torn_exps'] == 0, 'sampled torn experiences'
+
+
+if __name__ == '__main__':
+    print('BEGIN REPLAY CONCURRENCY TEST')
+    main()
+    print('PASSED')
+    self = psutil.Process()
+    self.kill()
@@ -0,0 +1,120 @@
+"""
+Unit tests of the replay storage bookkeeping.
+
+Usage:
+    python -m pytest test/test_replay_storage.py
+"""
+import os
+from multiprocessing import resource_tracker
+import numpy as np
+from surreal.replay.storage import (ListStorage, ColumnarStorage,
+                                    SharedColumnarStorage)
+
+OBS_SPEC = {'low_dim': {'flat_inputs': [4]}}
+ACTION_SPEC = {'type': 'continuous', 'dim': [2]}
+
+
+def make_exp(t, agent_id=0):
+    t = float(t)
+    return {
+        'obs': [{'low_dim': {'flat_inputs': np.full(4, t, np.float32)}},
+                {'low_dim': {'flat_inputs': np.full(4, t + 1, np.float32)}}],
+        'action': np.full(2, t, np.float32),
+        'reward': t,
+        'done': False,
+        'info': {},
+        'agent_id': agent_id,
+    }
+
+
+def stored_rewards(storage):
+    return sorted(float(exp['reward'])
+                  for exp in storage.get(range(len(storage))))
+
+
+def test_remove_then_wraparound_overwrites_oldest():
+    for storage in [ListStorage(10),
+                    ColumnarStorage(10, OBS_SPEC, ACTION_SPEC)]:
+        for t in range(10):
+            storage.insert(make_exp(t))
+        storage.remove([0, 1])
+        assert len(storage) == 8
+        assert stored_rewards(storage) == list(range(2, 10))
+        # two appends fill the storage, the next three overwrite the
+        # oldest experiences 2, 3 and 4
+        for t in range(10, 15):
+            storage.insert(make_exp(t))
+        assert len(storage) == 10
+        assert stored_rewards(storage) == list(range(5, 15))
+        assert sorted(storage.insert_ids) == list(range(5, 15))
+        # a full turn of the ring keeps overwriting oldest first
+        for t in range(15, 27):
+            storage.insert(make_exp(t))
+        assert stored_rewards(storage) == list(range(17, 27))
+
+
+def test_remove_then_insert_batch_overwrites_oldest():
+    storage = ListStorage(6)
+    storage.insert_batch([make_exp(t) for t in range(6)])
+    storage.remove([1, 4])
+    storage.insert_batch([make_exp(t) for t in range(6, 11)])
+    assert stored_rewards(storage) == list(range(5, 11))
+
+
+def test_remove_moves_tail_into_freed_slots():
+    storage = ListStorage(8)
+    for t in range(8):
+        storage.insert(make_exp(t))
+    src, dst = storage.remove([1, 3, 7])
+    assert list(dst) == [1, 3]
+    assert list(src) == [5, 6]
+    assert [float(exp['reward']) for exp in storage.get(range(5))] \
+        == [0, 5, 2, 6, 4]
+    assert list(storage.insert_ids) == [0, 5, 2, 6, 4]
+
+
+def test_bytes_used_follows_remove():
+    storage = ListStorage(4)
+    for t in range(4):
+        storage.insert(make_exp(t))
+    per_exp = storage.bytes_used / 4
+    storage.remove([0, 2])
+    assert storage.bytes_used == 2 * per_exp
+    storage.insert(make_exp(4))
+    assert storage.bytes_used == 3 * per_exp
+
+
+def test_shards_do_not_track_shared_memory():
+    name = 'surreal_test_{}'.format(os.getpid())
+    block = SharedColumnarStorage.create(name, capacity=4, num_shards=2,
+                                         obs_spec=OBS_SPEC,
+                                         action_spec=ACTION_SPEC)
+    registered = []
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: registered.append(args)
+    try:
+        # the resource tracker of a shard would unlink the block on exit
+        shards = [SharedColumnarStorage(4, OBS_SPEC, ACTION_SPEC, name=name,
+                                        num_shards=2, index=index)
+                  for index in range(2)]
+    finally:
+        resource_tracker.register = register
+    try:
+        assert registered == []
+        shards[0].insert(make_exp(0))
+        shards[1].insert_batch([make_exp(1), make_exp(2)])
+        assert len(shards[0]) == 3
+        assert sorted(shards[0].gather(np.arange(3))['rewards'][:, 0]) \
+            == [0, 1, 2]
+    finally:
+        # only the creator unlinks the block
+        block.close()
+        block.unlink()
+
+
+if __name__ == '__main__':
+    print('BEGIN REPLAY STORAGE TEST')
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('PASSED')
@@ -0,0 +1,65 @@
+"""
+Unit tests of the numpy segment trees of PrioritizedReplay.
+
+Usage:
+    python -m pytest test/test_segment_tree.py
+"""
+import numpy as np
+from surreal.replay.segment_tree import SumSegmentTree, MinSegmentTree
+
+
+def test_prefixsum_idx_matches_searchsorted():
+    rng = np.random.RandomState(0)
+    tree = SumSegmentTree(64)
+    values = rng.uniform(0.1, 2., size=50)
+    tree.update(np.arange(50), values)
+    cumsum = np.cumsum(values)
+    prefixsums = rng.uniform(0, cumsum[-1], size=1000)
+    expected = np.searchsorted(cumsum, prefixsums, side='right')
+    assert np.array_equal(tree.find_prefixsum_idx(prefixsums), expected)
+    for prefixsum in prefixsums[:20]:
+        assert tree.find_prefixsum_idx(float(prefixsum)) == \
+            np.searchsorted(cumsum, prefixsum, side='right')
+
+
+def test_prefixsum_idx_skips_zero_leaves():
+    # integer values keep the sums exact, boundaries included
+    tree = SumSegmentTree(16)
+    values = np.array([0, 3, 0, 0, 1, 2, 0, 5], dtype=np.float64)
+    tree.update(np.arange(8), values)
+    cumsum = np.cumsum(values)
+    prefixsums = np.arange(0, cumsum[-1], 0.5)
+    expected = np.searchsorted(cumsum, prefixsums, side='right')
+    found = tree.find_prefixsum_idx(prefixsums)
+    assert np.array_equal(found, expected)
+    assert np.all(values[found] > 0)
+
+
+def test_batched_update_matches_setitem():
+    rng = np.random.RandomState(1)
+    batched = SumSegmentTree(32)
+    single = SumSegmentTree(32)
+    minimum = MinSegmentTree(32)
+    for _ in range(10):
+        indices = rng.randint(0, 32, size=8)
+        values = rng.uniform(0, 1, size=8)
+        batched.update(indices, values)
+        minimum.update(indices, values)
+        # the last write to a repeated index wins, as with numpy
+        for idx, value in zip(indices, values):
+            single[int(idx)] = value
+    assert np.allclose(batched.values, single.values)
+    assert np.isclose(batched.sum(), single.values.sum())
+    assert np.isclose(batched.sum(3, 20), single.values[3:20].sum())
+    touched = np.isfinite(minimum.values)
+    assert minimum.min() == single.values[touched].min()
+    assert minimum.min(0, 16) == np.min(minimum.values[:16])
+    assert np.array_equal(batched.get([0, 5, 31]), single.values[[0, 5, 31]])
+
+
+if __name__ == '__main__':
+    print('BEGIN SEGMENT TREE TEST')
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('PASSED')
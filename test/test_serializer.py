@@ -0,0 +1,87 @@
+"""
+Unit tests of the npframe wire format and of joined messages.
+
+Usage:
+    python -m pytest test/test_serializer.py
+"""
+import collections
+import numpy as np
+import surreal.utils as U
+
+
+def make_message():
+    frame = np.arange(24, dtype=np.uint8).reshape(2, 3, 4)
+    return {
+        'obs': [frame, frame],
+        'action': np.linspace(0, 1, 6).reshape(3, 2)[:, 1],
+        'reward': np.float32(1.5),
+        'scalar': np.array(3, dtype=np.int64),
+        'empty': np.zeros((0, 5), dtype=np.float32),
+        'ordered': collections.OrderedDict([('b', (1, 'x')), ('a', None)]),
+        'objects': np.array([{'k': 1}, 'v'], dtype=object),
+    }
+
+
+def assert_message_equal(received, sent):
+    assert set(received) == set(sent)
+    for i in range(2):
+        assert np.array_equal(received['obs'][i], sent['obs'][i])
+    assert np.array_equal(received['action'], sent['action'])
+    assert received['reward'] == sent['reward']
+    assert received['scalar'].shape == () and received['scalar'] == 3
+    assert received['empty'].shape == (0, 5)
+    assert received['empty'].dtype == np.float32
+    assert type(received['ordered']) is collections.OrderedDict
+    assert list(received['ordered'].items()) == [('b', (1, 'x')), ('a', None)]
+    assert list(received['objects']) == [{'k': 1}, 'v']
+
+
+def test_npframe_multipart_round_trip():
+    message = make_message()
+    frames = U.npframe_serialize_multipart(message)
+    # the repeated frame is sent once, object arrays go in the header
+    assert len(frames) == 1 + 4
+    # contiguous arrays are sent without copy
+    assert np.shares_memory(np.frombuffer(frames[1], np.uint8),
+                            message['obs'][0])
+    received = U.npframe_deserialize_multipart(
+        [bytes(frame) for frame in frames])
+    assert_message_equal(received, message)
+    assert received['obs'][0] is received['obs'][1]
+    assert not received['obs'][0].flags.writeable
+
+
+def test_npframe_round_trip():
+    message = make_message()
+    binary = U.npframe_serialize(message)
+    assert_message_equal(U.npframe_deserialize(binary), message)
+    # non-contiguous views are copied into their frame
+    transposed = np.arange(12, dtype=np.float64).reshape(3, 4).T
+    assert np.array_equal(
+        U.npframe_deserialize(U.npframe_serialize(transposed)), transposed)
+
+
+def test_join_serialized_round_trip():
+    messages = [make_message(), {'step': 1}, np.arange(7, dtype=np.int16)]
+    binaries = [U.npframe_serialize(message) for message in messages]
+    joined = U.join_serialized(binaries)
+    parts = U.split_joined(joined)
+    assert [bytes(part) for part in parts] == [bytes(b) for b in binaries]
+    # parts are padded so that arrays over them are aligned
+    base = np.frombuffer(joined, np.uint8).ctypes.data
+    for part in parts:
+        assert (np.frombuffer(part, np.uint8).ctypes.data - base) % 8 == 0
+    received = [U.npframe_deserialize(part) for part in parts]
+    assert_message_equal(received[0], messages[0])
+    assert received[1] == {'step': 1}
+    assert np.array_equal(received[2], messages[2])
+    assert U.split_joined(binaries[1]) is None
+    assert U.split_joined(U.join_serialized([])) == []
+
+
+if __name__ == '__main__':
+    print('BEGIN SERIALIZER TEST')
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('PASSED')
@@ -0,0 +1,153 @@
+"""
+Unit tests of stratified sampling across replay shards: the replies of
+the shards, how the learner joins them and how the receiver merges them.
+
+Usage:
+    python -m pytest test/test_stratified_sampler.py
+"""
+import os
+import numpy as np
+import surreal.utils as U
+from surreal.session import (Config, ConfigError, BASE_LEARNER_CONFIG,
+                             BASE_ENV_CONFIG, LOCAL_SESSION_CONFIG)
+from surreal.replay import UniformReplay, FIFOReplay
+from surreal.distributed import StratifiedSampler
+from surreal.distributed.stratified_sampler import decode_parts
+
+OBS_DIM = 4
+ACTION_DIM = 2
+NUM_SHARDS = 2
+
+
+def make_configs(memory_size=16):
+    for name, port in [('SYMPH_COLLECTOR_BACKEND_PORT', 7102),
+                       ('SYMPH_SAMPLER_BACKEND_PORT', 7104),
+                       ('SYMPH_LOGGERPLEX_PORT', 7109),
+                       ('SYMPH_TENSORPLEX_PORT', 7108)]:
+        os.environ.setdefault(name, str(port))
+    for i in range(NUM_SHARDS):
+        os.environ.setdefault('SYMPH_SHARD_SAMPLER_{}_HOST'.format(i),
+                              'localhost')
+        os.environ.setdefault('SYMPH_SHARD_SAMPLER_{}_PORT'.format(i),
+                              str(7120 + i))
+    os.environ.setdefault('SYMPH_LOGGERPLEX_HOST', 'localhost')
+    os.environ.setdefault('SYMPH_TENSORPLEX_HOST', 'localhost')
+
+    learner_config = Config({
+        'model': {},
+        'algo': {'gamma': 0.99},
+        'replay': {
+            'batch_size': 4,
+            'memory_size': memory_size,
+            'sampling_start_size': 4,
+            'storage': 'columnar',
+            'aggregate_on_replay': True,
+            'replay_shards': NUM_SHARDS,
+        },
+    }).extend(BASE_LEARNER_CONFIG)
+    env_config = Config({
+        'env_name': 'stratified',
+        'obs_spec': {'low_dim': {'flat_inputs': [OBS_DIM]}},
+        'action_spec': {'type': 'continuous', 'dim': [ACTION_DIM]},
+    }).extend(BASE_ENV_CONFIG)
+    session_config = Config({
+        'folder': '/tmp/surreal/stratified_sampler',
+        'replay': {'tensorboard_display': False},
+        'sender': {'flush_iteration': 4},
+        'learner': {'stratified_sampling': True},
+    }).extend(LOCAL_SESSION_CONFIG)
+    return learner_config, env_config, session_config
+
+
+def make_exp(t):
+    t = float(t)
+    return {
+        'obs': [{'low_dim': {'flat_inputs': np.full(OBS_DIM, t, np.float32)}},
+                {'low_dim': {'flat_inputs':
+                             np.full(OBS_DIM, t + 1, np.float32)}}],
+        'action': np.full(ACTION_DIM, t, np.float32),
+        'reward': t,
+        'done': False,
+        'info': {},
+    }
+
+
+class ShardClient(object):
+    """
+        Sends the requests of StratifiedSampler straight to the shard
+        handler of a replay, like the ZmqClient it replaces
+    """
+    def __init__(self, replay, codec):
+        self.replay = replay
+        self.codec = codec
+
+    def request(self, request):
+        reply = self.replay._shard_sample_request_handler(
+            self.codec.serialize(request))
+        return U.split_joined(reply)
+
+
+def make_sampler(replays):
+    sampler = StratifiedSampler(host='localhost', port=7130,
+                                shard_addresses=[('localhost', 7120 + i)
+                                                 for i in range(NUM_SHARDS)],
+                                timeout=1.)
+    sampler._clients = [ShardClient(replay, sampler.codec)
+                        for replay in replays]
+    return sampler
+
+
+def test_shard_reply_joins_size_and_batch():
+    replay = UniformReplay(*make_configs(), index=0)
+    codec = replay._sampling_codec
+    replay.insert_batch([make_exp(t) for t in range(2)])
+    # not ready to be sampled, only the size is sent
+    size, = U.split_joined(
+        replay._shard_sample_request_handler(codec.serialize(2)))
+    assert codec.deserialize(size) == 2
+    replay.insert_batch([make_exp(t) for t in range(2, 6)])
+    size, batches = U.split_joined(
+        replay._shard_sample_request_handler(codec.serialize((3, 2))))
+    assert codec.deserialize(size) == 6
+    for batch in U.split_joined(batches):
+        assert len(codec.deserialize(batch)['rewards']) == 3
+    assert replay.cumulative_request_count == 1
+    assert replay.cumulative_sampled_count == 6
+
+
+def test_sampler_joins_shard_parts():
+    replays = [UniformReplay(*make_configs(), index=i)
+               for i in range(NUM_SHARDS)]
+    for i, replay in enumerate(replays):
+        replay.insert_batch([make_exp(100 * i + t) for t in range(8)])
+    sampler = make_sampler(replays)
+    codec = sampler.codec
+    # the parts are forwarded as sent by the shards
+    reply = sampler._handle(codec.serialize(6))
+    batch = decode_parts(codec, reply)
+    rewards = batch['rewards'][:, 0]
+    assert len(rewards) == 6
+    assert (rewards < 100).sum() == 3 and (rewards >= 100).sum() == 3
+    reply = sampler._handle(codec.serialize((6, 3)))
+    batches = [decode_parts(codec, part) for part in U.split_joined(reply)]
+    assert len(batches) == 3
+    for batch in batches:
+        assert batch['obs']['low_dim']['flat_inputs'].shape == (6, OBS_DIM)
+    assert len(sampler.sample(5)['rewards']) == 5
+
+
+def test_fifo_replay_rejects_stratified_sampling():
+    try:
+        FIFOReplay(*make_configs())
+    except ConfigError:
+        pass
+    else:
+        assert False, 'expected ConfigError'
+
+
+if __name__ == '__main__':
+    print('BEGIN STRATIFIED SAMPLER TEST')
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('PASSED')